@@ -2,162 +2,251 @@ import os
 
 import pandas as pd
 import json
-import requests
+import pickle
 import string
 import re
-from dotenv import load_dotenv
+import time
+from df_cache import load_dataframe
+from executors import run_blocking
+from sandbox import run_sandboxed, run_sandboxed_sync
+from frame_handoff import attach, share_file, release
+from xlsx_stream import list_sheets
+# 表格上下文按 token 预算构造 (get_col_letter 也移过去了，这里继续导出)
+from prompt_builder import build_table_context, build_multi_context, record_prompt, get_col_letter
+# DeepSeek 调用已移到 llm_client (这里继续导出 call_deepseek_raw，兼容旧的 import)
+from llm_client import call_deepseek_raw, call_deepseek_async, stream_deepseek_async
+from answer_templates import format_answer, summary_input
+
+def _build_analysis_prompt(file_path: str, user_query: str, sheet: str = None):
+    """Chat 第一步的 Prompt：只喂结构和 3 行样例，不喂全量数据"""
+    # 1. 读取数据 (走缓存，只读，不需要拷贝；只读选中的工作表)
+    df = load_dataframe(file_path, copy=False, sheet=sheet)
+
+    # 2. 准备元数据 (列名、类型、每列统计、几行样例，按 token 预算裁剪；宽表不会把 Prompt 撑爆)
+    table_context, _ = build_table_context(file_path, user_query, sheet, df=df)
+
+    # 3. 构造 Prompt：要求 AI 不直接回答，而是写 Python 代码
+    # 关键点：告诉 AI 它有一个现成的 dataframe 叫 'df'
+    system_prompt = """
+    你是一个 Python Pandas 数据分析专家。
+    你不需要直接回答问题，而是需要编写 Python 代码来计算答案。
+    
+    【环境说明】
+    1. 内存中已经加载了一个 pandas DataFrame，变量名为 `df`。
+    2. 请根据用户问题，利用 `df` 编写代码。
+    3. **必须**将最终计算结果赋值给变量 `result`。
+    4. 代码中不要包含 print()，只进行计算和赋值。
+    5. 输出格式：仅输出代码块，用 ```python 包裹，不要有其他废话。
+    """
 
-# ================= 配置区 =================
-# 请确保 API_KEY 正确且有余额
-load_dotenv()
-API_KEY = os.getenv("key")
-API_URL = "https://api.deepseek.com/chat/completions"
-# =========================================
+    user_message = f"""
+    【数据结构信息】
+    {table_context}
 
-def get_col_letter(n):
+    【用户问题】: {user_query}
+    
+    请写出计算用的 Python 代码：
     """
-    将数字索引转化为 Excel 列名
-    0 -> A, 1 -> B, ... 26 -> AA
+    record_prompt("analysis", system_prompt, user_message)
+    return system_prompt, user_message
+
+def _extract_python_code(generated_content: str) -> str:
+    """清洗 AI 返回的代码 (去掉 markdown 符号)"""
+    code_match = re.search(r'```python(.*?)```', generated_content, re.DOTALL)
+    if code_match:
+        return code_match.group(1).strip()
+    # 如果 AI 没写 markdown，尝试直接用返回内容（容错）
+    return generated_content.strip().replace('```', '')
+
+def run_analysis_code(file_path: str, code_to_run: str, frame: dict = None, sheet: str = None):
     """
-    s = ""
-    while n >= 0:
-        s = chr(n % 26 + 65) + s
-        n = n // 26 - 1
-    return s
-
-def call_deepseek_raw(system_prompt, user_content):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
-
-    payload = {
-        "model": "deepseek-chat",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_content}
-        ],
-        "stream": False,
-        "temperature": 0.1 # 低温度保证逻辑严谨
-    }
-
+    在本地 Python 环境中执行分析代码 (使用 exec)
+    模块级函数：API 接口会把它放进进程池执行，避免阻塞事件循环
+    :param frame: 可选，共享内存句柄 (frame_handoff)，有则直接挂载，不再读文件
+    :param sheet: 工作表名，None 为第一个
+    """
+    df = attach(frame) if frame is not None else load_dataframe(file_path, sheet=sheet)
+    # 这是一个沙箱环境，传入 df，并准备捕获 result 变量
+    local_vars = {"df": df, "pd": pd}
+    exec(code_to_run, {}, local_vars)
+
+    # 获取计算结果
+    result = local_vars.get('result', "代码执行完毕，但未找到 result 变量")
+    # 结果要跨进程传回，传不了的对象 (生成器、lambda 等) 直接转成文本
     try:
-        response = requests.post(
-            API_URL,
-            headers=headers,
-            data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
-            proxies={"http": None, "https": None}
-        )
-        response.encoding = 'utf-8'
-
-        if response.status_code != 200:
-            raise Exception(f"API Error ({response.status_code}): {response.text}")
-
-        return response.json()['choices'][0]['message']['content']
-    except Exception as e:
-        print(f"Request Error: {repr(str(e))}")
-        raise e
+        pickle.dumps(result)
+    except Exception:
+        result = str(result)
+    return result
+
+# 第三步：让 AI 把冰冷的数字转换成自然语言 (小而简单的结果直接套模板，见 answer_templates)
+SUMMARY_PROMPT = "你是一个贴心的数据助手。请根据用户的问题和计算出的结果，给出一个简洁、友好的回答。"
+
+def _build_summary_message(user_query, calculation_result):
+    return f"用户问题：{user_query}\n计算结果：{summary_input(calculation_result)}\n请回复用户："
 
-def get_ai_analysis(file_path: str, user_query: str):
+def _exec_error_answer(e: Exception) -> str:
+    return f"分析执行出错: {str(e)}。AI 生成的代码可能不适配当前数据。"
+
+def get_ai_analysis(file_path: str, user_query: str, sheet: str = None):
     """
     Dashboard 智能咨询 (Chat) - Code Interpreter 模式
     """
     try:
-        # 1. 读取全量数据 (但不要把数据喂给 AI，只喂结构)
-        df = pd.read_excel(file_path)
-
-        # 2. 准备元数据 (让 AI 知道有哪些列，数据长什么样，但只给看 3 行)
-        columns = ", ".join(df.columns.tolist())
-        dtypes = str(df.dtypes)
-        preview_data = df.head(3).to_markdown(index=False)
-
-        # 3. 构造 Prompt：要求 AI 不直接回答，而是写 Python 代码
-        # 关键点：告诉 AI 它有一个现成的 dataframe 叫 'df'
-        system_prompt = """
-        你是一个 Python Pandas 数据分析专家。
-        你不需要直接回答问题，而是需要编写 Python 代码来计算答案。
-        
-        【环境说明】
-        1. 内存中已经加载了一个 pandas DataFrame，变量名为 `df`。
-        2. 请根据用户问题，利用 `df` 编写代码。
-        3. **必须**将最终计算结果赋值给变量 `result`。
-        4. 代码中不要包含 print()，只进行计算和赋值。
-        5. 输出格式：仅输出代码块，用 ```python 包裹，不要有其他废话。
-        """
-
-        user_message = f"""
-        【数据结构信息】
-        列名: {columns}
-        数据类型:
-        {dtypes}
-        
-        数据样例 (前3行):
-        {preview_data}
-
-        【用户问题】: {user_query}
-        
-        请写出计算用的 Python 代码：
-        """
-
-        # 4. 第一步：调用 AI 获取分析代码
-        generated_content = call_deepseek_raw(system_prompt, user_message)
-
-        # 5. 清洗 AI 返回的代码 (去掉 markdown 符号)
-        code_match = re.search(r'```python(.*?)```', generated_content, re.DOTALL)
-        if code_match:
-            code_to_run = code_match.group(1).strip()
-        else:
-            # 如果 AI 没写 markdown，尝试直接用返回内容（容错）
-            code_to_run = generated_content.strip().replace('```', '')
+        system_prompt, user_message = _build_analysis_prompt(file_path, user_query, sheet)
 
+        # 第一步：调用 AI 获取分析代码
+        code_to_run = _extract_python_code(call_deepseek_raw(system_prompt, user_message))
         print(f"🤖 AI 生成的代码:\n{code_to_run}") # 调试用，方便看后台
 
-        # 6. 第二步：在本地 Python 环境中执行代码 (使用 exec)
-        # 这是一个沙箱环境，传入 df，并准备捕获 result 变量
-        local_vars = {"df": df, "pd": pd}
-
+        # 第二步：执行代码
         try:
-            exec(code_to_run, {}, local_vars)
+            calculation_result = run_sandboxed_sync(run_analysis_code, file_path, code_to_run, sheet=sheet)
+        except Exception as e:
+            return {"answer": _exec_error_answer(e)}
 
-            # 获取计算结果
-            calculation_result = local_vars.get('result', "代码执行完毕，但未找到 result 变量")
+        # 第三步：组织语言 (能套模板就不再调模型)
+        final_answer = format_answer(user_query, calculation_result)
+        if final_answer is None:
+            final_answer = call_deepseek_raw(SUMMARY_PROMPT, _build_summary_message(user_query, calculation_result))
 
-        except Exception as e:
-            return {"answer": f"分析执行出错: {str(e)}。AI 生成的代码可能不适配当前数据。"}
+        return {"answer": final_answer}
 
-        # 7. (可选) 第三步：让 AI 把冰冷的数字转换成自然语言
-        # 如果你只想要数字，可以直接返回 calculation_result
-        # 这里我们再调一次 AI，让它组织语言
-        summary_prompt = "你是一个贴心的数据助手。请根据用户的问题和计算出的结果，给出一个简洁、友好的回答。"
-        summary_message = f"用户问题：{user_query}\n计算结果：{calculation_result}\n请回复用户："
+    except Exception as e:
+        return {"answer": f"系统内部错误: {str(e)}"}
 
-        final_answer = call_deepseek_raw(summary_prompt, summary_message)
+class _AnalysisExecError(Exception):
+    """AI 生成的代码执行失败 (与系统内部错误区分开，提示语不同)"""
 
-        return {"answer": final_answer}
+async def _compute_analysis_async(file_path: str, user_query: str, sheet: str, timings: dict):
+    """Chat 的前两步：生成代码 + 在沙箱执行，返回 result；耗时记到 timings 里"""
+    start = time.perf_counter()
+    system_prompt, user_message = await run_blocking(_build_analysis_prompt, file_path, user_query, sheet)
+
+    code_to_run = _extract_python_code(await call_deepseek_async(system_prompt, user_message))
+    timings["codegen_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"🤖 AI 生成的代码:\n{code_to_run}")
+
+    start = time.perf_counter()
+    try:
+        # 拼 Prompt 时表已在本进程缓存里，发布到共享内存交给沙箱，省掉沙箱进程再读一遍
+        frame = await run_blocking(share_file, file_path, None, sheet)
+        try:
+            return await run_sandboxed(run_analysis_code, file_path, code_to_run, frame=frame, sheet=sheet)
+        finally:
+            release(frame)
+    except Exception as e:
+        raise _AnalysisExecError(_exec_error_answer(e))
+    finally:
+        timings["execute_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+async def get_ai_analysis_async(file_path: str, user_query: str, sheet: str = None):
+    """
+    get_ai_analysis 的异步版本 (API 接口使用)
+    - 读表 / 拼 Prompt 在线程池
+    - 等待模型返回不占用事件循环
+    - 执行 AI 代码在沙箱进程 (有超时和资源限制)
+    - 结果能套模板时只调一次模型
+    """
+    try:
+        timings = {}
+        try:
+            calculation_result = await _compute_analysis_async(file_path, user_query, sheet, timings)
+        except _AnalysisExecError as e:
+            return {"answer": str(e)}
+
+        final_answer = format_answer(user_query, calculation_result)
+        mode = "template"
+        if final_answer is None:
+            final_answer = await call_deepseek_async(SUMMARY_PROMPT, _build_summary_message(user_query, calculation_result))
+            mode = "llm"
+
+        return {"answer": final_answer, "answer_mode": mode}
 
     except Exception as e:
         return {"answer": f"系统内部错误: {str(e)}"}
 
-def get_multi_file_agent(file_map: dict, user_query: str):
+async def stream_ai_analysis(file_path: str, user_query: str, sheet: str = None):
     """
-    多文件关联分析 Agent (已升级：增强 Excel 公式鲁棒性约束)
+    Chat 的流式版本 (SSE 接口使用)：async for event, data in stream_ai_analysis(...)
+    - ("stage", {"stage": "codegen" / "summarize"})  进度提示 (生成并执行代码 / 模型总结中)
+    - ("delta", {"text": ...})  回答的增量文本 (模板回答一次给全)
+    - ("done",  {"answer": 完整回答, "answer_mode": "template" / "llm" / "error", "timings": {...}})
+    首字时间 (ttft_ms) 从开始处理算到第一段回答文本发出
+    """
+    start = time.perf_counter()
+    timings = {}
+    parts = []
+    mode = "error"
+
+    def _elapsed():
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    try:
+        yield "stage", {"stage": "codegen"}
+        try:
+            calculation_result = await _compute_analysis_async(file_path, user_query, sheet, timings)
+        except _AnalysisExecError as e:
+            parts.append(str(e))
+            timings["ttft_ms"] = _elapsed()
+            yield "delta", {"text": parts[-1]}
+        else:
+            final_answer = format_answer(user_query, calculation_result)
+            if final_answer is not None:
+                mode = "template"
+                parts.append(final_answer)
+                timings["ttft_ms"] = _elapsed()
+                yield "delta", {"text": final_answer}
+            else:
+                mode = "llm"
+                yield "stage", {"stage": "summarize"}
+                message = _build_summary_message(user_query, calculation_result)
+                async for delta in stream_deepseek_async(SUMMARY_PROMPT, message):
+                    if not parts:
+                        timings["ttft_ms"] = _elapsed()
+                    parts.append(delta)
+                    yield "delta", {"text": delta}
+    except Exception as e:
+        mode = "error"
+        parts = [f"系统内部错误: {str(e)}"]
+        timings.setdefault("ttft_ms", _elapsed())
+        yield "delta", {"text": parts[0]}
+
+    timings["total_ms"] = _elapsed()
+    print(f"⏱️ Chat [{mode}]: 首字 {timings.get('ttft_ms')} ms，总计 {timings['total_ms']} ms")
+    yield "done", {"answer": "".join(parts), "answer_mode": mode, "timings": timings}
+
+def _excel_source(key: str, fpath: str, sheet: str = None):
+    """dfs key -> (文件名, 工作表名)，用于 Excel 外部引用；key 为 '文件名/工作表' 或文件名 (第一个工作表)"""
+    fname = key.split("/", 1)[0]  # 工作表名里不允许出现 "/"
+    if sheet is None:
+        try:
+            sheet = list_sheets(fpath)[0]  # 只读 workbook.xml
+        except Exception:
+            sheet = "Sheet1"
+    return fname, sheet
+
+def _build_multi_file_prompt(file_map: dict, user_query: str, sheets: dict = None):
     """
-    # 1. 构建多表元数据 (保持不变)
+    多表 Agent 的 Prompt：每个文件 (工作表) 只取表头和 3 行预览
+    :param sheets: {dfs key: 工作表名 或 None (第一个)}
+    """
+    # 1. 构建多表元数据 (所有表共用一个 token 预算；整表不在缓存时只读开头几百行做统计，不为了拼 Prompt 加载整表)
     schema_info = []
-    preview_info = []
     available_keys = list(file_map.keys())
+    contexts = build_multi_context(file_map, user_query, sheets)
 
     for fname, fpath in file_map.items():
-        try:
-            df_temp = pd.read_excel(fpath, nrows=3)
-            cols = ", ".join(df_temp.columns.tolist())
-            schema_info.append(f"- 文件名 Key: '{fname}' | 列: {cols}")
-            preview_info.append(f"--- '{fname}' 预览 ---\n{df_temp.to_markdown(index=False)}")
-        except Exception as e:
-            schema_info.append(f"- 文件名: {fname} | 读取失败: {e}")
+        table_context, metrics = contexts[fname]
+        if "error" in metrics:
+            schema_info.append(f"- 文件名: {fname} | {table_context}")
+            continue
+        book, sheet_name = _excel_source(fname, fpath, (sheets or {}).get(fname))
+        ref = f"[{book}]{sheet_name}".replace("'", "''")  # Excel 引用中的单引号要写两个
+        schema_info.append(f"--- 文件名 Key: '{fname}' | 工作表: {sheet_name} | Excel 引用前缀: '{ref}'! ---\n"
+                           f"{table_context}")
 
     schema_str = "\n".join(schema_info)
-    preview_str = "\n".join(preview_info)
 
     # 2. 构造 Prompt
     # 🟢 核心修改：加入"Excel 公式强制规范" 模块，解决 #NAME? 和 #N/A 问题
@@ -169,8 +258,8 @@ def get_multi_file_agent(file_map: dict, user_query: str):
     2. 编写 Excel 公式来解释你的操作。
     
     【💻 Python 执行环境】
-    1. 只有一个变量：`dfs` (字典, Key=文件名, Value=DataFrame)。
-    2. 必须通过文件名 Key 获取数据: `df = dfs['文件名']`。
+    1. 只有一个变量：`dfs` (字典, Key=文件名 或 "文件名/工作表名", Value=DataFrame)。
+    2. 必须通过【可用文件列表】中的 Key 原样获取数据: `df = dfs['文件名']`。
     3. 最终结果赋值给 `result_df`。
     
     【🛡️ Excel 公式强制规范 (必须严格遵守)】
@@ -179,7 +268,7 @@ def get_multi_file_agent(file_map: dict, user_query: str):
        - 必须将数据源视为**独立的外部 Excel 文件**进行引用。
        - 引用格式必须严格遵循：`'[完整文件名]SheetName'!范围`。
        - 文件名必须包含后缀 (如 .xlsx)。
-       - 默认假设 Sheet 名称为 "Sheet1" (除非你有明确理由使用其他名称)。
+       - 工作表名称必须使用【数据结构详情】中给出的 "Excel 引用前缀"，不要自己假设为 "Sheet1"。
        - ✅ 正确示例: `'[上半年数据.xlsx]Sheet1'!$A:$A`
        - ❌ 错误示例: `'上半年数据'!$A:$A` (这是内部引用，禁止使用)
     
@@ -221,7 +310,7 @@ def get_multi_file_agent(file_map: dict, user_query: str):
        - ⚠️ **Excel 最佳实践强制要求**：
          1. **假设布局**：默认 A 列为 ID。请根据任务逻辑，合理安排后续列的顺序（如 B, C, D...）。
          2. **链式引用 (关键)**：如果“金额”列依赖于“数量”列，**必须引用“数量”列的单元格 (如 D2)**，严禁把“数量”的计算逻辑（加减乘除/XLOOKUP）再写一遍。
-         3. **外部数据源**：查找源数据时，必须使用外部文件格式 `'[文件名.xlsx]Sheet1'!范围`。
+         3. **外部数据源**：查找源数据时，必须使用外部文件格式 `'[文件名.xlsx]工作表名'!范围` (即给出的 Excel 引用前缀)。
          4. **单行引用**：所有引用基于第 2 行（如 `$A2`），以便用户向下拖拽填充。
        
        - ✅ **正确示例** (假设 B列=姓名, C列=数量, D列=单价, E列=总价):
@@ -234,21 +323,19 @@ def get_multi_file_agent(file_map: dict, user_query: str):
     """
 
     user_message = f"""
-    【数据结构详情】
+    【数据结构详情 (含每列统计与样例数据)】
     {schema_str}
-    
-    【数据内容预览】
-    {preview_str}
 
     【用户需求】
     {user_query}
     
     请严格按 JSON 格式输出：
     """
-    # 3. 调用 AI
-    content = call_deepseek_raw(system_prompt, user_message)
+    record_prompt("multi_file", system_prompt, user_message)
+    return system_prompt, user_message
 
-    # 🟢 解析 JSON
+def _parse_multi_file_response(content: str):
+    """🟢 解析 JSON"""
     try:
         # 清洗可能存在的 markdown 符号
         clean_content = content.replace("```json", "").replace("```", "").strip()
@@ -271,133 +358,162 @@ def get_multi_file_agent(file_map: dict, user_query: str):
             "column_formulas": {} # 容错空字典
         }
 
-def get_formula_suggestion(file_path: str, user_requirement: str):
+def get_multi_file_agent(file_map: dict, user_query: str, sheets: dict = None):
     """
-    智能生成：Python 负责执行，Excel 公式负责展示 (优化版：移除 row 占位符)
+    多文件关联分析 Agent (已升级：增强 Excel 公式鲁棒性约束)
     """
+    system_prompt, user_message = _build_multi_file_prompt(file_map, user_query, sheets)
+    # 调用 AI
+    content = call_deepseek_raw(system_prompt, user_message)
+    return _parse_multi_file_response(content)
+
+async def get_multi_file_agent_async(file_map: dict, user_query: str, sheets: dict = None):
+    """get_multi_file_agent 的异步版本 (API 接口使用)"""
+    system_prompt, user_message = await run_blocking(_build_multi_file_prompt, file_map, user_query, sheets)
+    content = await call_deepseek_async(system_prompt, user_message)
+    return _parse_multi_file_response(content)
+
+def _build_formula_prompt(file_path: str, user_requirement: str, sheet: str = None):
+    """公式生成的 Prompt：列映射 (带列字母) + 每列统计 + 样例行，按 token 预算裁剪"""
+    # 1. 读取 Excel 获取上下文 (只读，不需要拷贝；只读选中的工作表)
+    df = load_dataframe(file_path, copy=False, sheet=sheet)
+
+    # 获取真实数据维度
+    real_row_count = len(df)
+    data_end_row = real_row_count + 1 # 假设第一行是表头
+
+    # 2. 生成列映射 (列字母 + 列名 + 统计 + 样例；用户需求里提到的列优先保留)
+    table_context, _ = build_table_context(file_path, user_requirement, sheet, df=df, letters=True)
+
+    # 3. 构建 Prompt (核心升级：要求生成标准 Excel 相对引用)
+    system_prompt = f"""
+    你是一个 Python Excel 自动化专家。
+    
+    【🎯 核心任务】
+    你需要根据用户需求，判断是修改**表格结构**还是计算**单元格数值**，并生成对应的 JSON。
+    
+    【💻 1. Python 执行逻辑 (核心规则)】
+    环境中有变量：`df` (Pandas DataFrame), `rows` (List[Dict]), `row` (当前行, 仅在 Formula 模式有效)。
+    
+    🔴 **模式 A: structure (结构修改 - 排序/筛选/删除)**
+    - **定义**: 改变行数、顺序或删除列的操作。
+    - **执行方式**: 后端使用 `exec()`，**必须使用赋值语句**更新 `df`。
+    - **操作对象**: 直接操作 `df`。
+    - **必遵规则**: 代码必须改变 `df` 的状态。
+      - ✅ 正确: `df = df.sort_values(by='年龄', ascending=False)`
+      - ✅ 正确: `df.drop(columns=['无用列'], inplace=True)`
+      - ✅ 正确: `df = df[df['性别'] == '女']`
+    
+    🔵 **模式 B: formula (数值计算 - 新增列/覆盖列/指定列)**
+    - **定义**: 对每一行进行数学计算、文本处理或逻辑判断。
+    - **执行方式**: 后端使用 `eval()`，**仅支持 Python 表达式 (Expression)**。
+    - **操作对象**: 使用 `row` (当前行字典) 或 `rows` (所有行列表)。
+    - **🛑 致命错误避坑 (严禁使用赋值号)**:
+      - 后端会自动处理写入操作，你只需要算出**值**。
+      - ❌ **严重错误**: `row['年龄'] = row['年龄'] + 1` (这会导致 SyntaxError)
+      - ✅ **完美正确**: `row['年龄'] + 1` (只返回计算结果)
+    - **单元格汇总 (mode="cell")**:
+      - ✅ 正确: `excel_ops.EXCEL_SUM([r['金额'] for r in rows])`
+    
+    【👀 2. Excel 展示公式 (用户体验优化)】
+    - 无论哪种模式，都请生成一个 **标准 Excel 公式** 用于前端展示。
+    - **核心原则**：假设你正在在一个**全新的空白辅助列**编写此公式。
+    - **关于覆盖操作**：即使是对原列进行覆盖（如“年龄加1”），公式依然要引用原列（如 `=C2+1`）。这是为了展示计算逻辑，不用担心循环引用。
+    - **必须**使用具体相对引用 (如 `A2`) 或 完整区域 (如 `A2:A{data_end_row}`)。
+    
+    【📝 3. Explanation (解释字段 - 必须包含位置信息)】
+    - **explanation** 字段必须包含两部分信息：
+      1. **逻辑**: 做了什么计算 (e.g. "性别为男则年龄+5")
+      2. **去向**: 结果写到了哪里 (必须明确区分 "覆盖原列 [列名]" / "新建列 [列名]" / "写入指定列 [列号]")
+    - **示例**:
+      - "计算年龄+5，并**覆盖原‘年龄’列**。"
+      - "计算总价，结果**写入新列‘F’**。"
+    
+    【📍 4. Target Position (智能定位规则)】
+    - **情况 1：新建列** (例如 "计算总价")
+      - `target_position`: `"总价"` (输出新列名)
+    - **情况 2：覆盖原列** (例如 "把**年龄**加1", "结果写入**原列**")
+      - `target_position`: `"年龄"` (❌ 严禁输出 "原列"，必须填入具体的**被覆盖列名**)
+    - **情况 3：指定列号** (例如 "写入 **G** 列", "写入第 7 列")
+      - `target_position`: `"G"` (直接输出列号字母)
+    - **情况 4：结构修改 / 单元格汇总**
+      - `target_position`: `"全表"` 或 具体单元格如 `"E13"`
+    
+    【JSON 输出模板】
+    {{
+        "action_type": "structure" | "formula",
+        "python_expression": "string (注意: formula模式下严禁写 '=', 只能写表达式)", 
+        "excel_formula": "string (用于前端展示的标准Excel公式)",
+        "mode": "column" | "cell" | "structure", 
+        "target_position": "string (写入的目标列名 或 列字母)",
+        "explanation": "简短说明"
+    }}
+    """
+
+    user_prompt = f"""
+    【数据统计】
+    - 数据结束行: {data_end_row} (引用整列数据时请用到此行号)
+    
+    【列结构映射 (请根据此确定 A/B/C 列)】:
+    {table_context}
+
+    【用户需求】: 
+    {user_requirement}
+    """
+
+    record_prompt("formula", system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+def _parse_formula_response(content: str):
+    """清洗 AI 返回的 JSON，并把展示公式拼进解释"""
+    # 清洗结果
+    clean_content = content.replace("```json", "").replace("```", "").strip()
+    print(f"--- AI Response: {clean_content} ---")
+
     try:
-        # 1. 读取 Excel 获取上下文
-        df = pd.read_excel(file_path)
-
-        # 获取真实数据维度
-        real_row_count = len(df)
-        data_end_row = real_row_count + 1 # 假设第一行是表头
-
-        preview = df.head(5).to_markdown(index=False)
-
-        # 2. 生成列映射
-        col_mapping_list = []
-        for i, col in enumerate(df.columns):
-            letter = get_col_letter(i)
-            col_mapping_list.append(f"【{letter}列】: {col}")
-
-        column_mapping_str = " | ".join(col_mapping_list)
-
-        # 3. 构建 Prompt (核心升级：要求生成标准 Excel 相对引用)
-        system_prompt = f"""
-        你是一个 Python Excel 自动化专家。
-        
-        【🎯 核心任务】
-        你需要根据用户需求，判断是修改**表格结构**还是计算**单元格数值**，并生成对应的 JSON。
-        
-        【💻 1. Python 执行逻辑 (核心规则)】
-        环境中有变量：`df` (Pandas DataFrame), `rows` (List[Dict]), `row` (当前行, 仅在 Formula 模式有效)。
-        
-        🔴 **模式 A: structure (结构修改 - 排序/筛选/删除)**
-        - **定义**: 改变行数、顺序或删除列的操作。
-        - **执行方式**: 后端使用 `exec()`，**必须使用赋值语句**更新 `df`。
-        - **操作对象**: 直接操作 `df`。
-        - **必遵规则**: 代码必须改变 `df` 的状态。
-          - ✅ 正确: `df = df.sort_values(by='年龄', ascending=False)`
-          - ✅ 正确: `df.drop(columns=['无用列'], inplace=True)`
-          - ✅ 正确: `df = df[df['性别'] == '女']`
-        
-        🔵 **模式 B: formula (数值计算 - 新增列/覆盖列/指定列)**
-        - **定义**: 对每一行进行数学计算、文本处理或逻辑判断。
-        - **执行方式**: 后端使用 `eval()`，**仅支持 Python 表达式 (Expression)**。
-        - **操作对象**: 使用 `row` (当前行字典) 或 `rows` (所有行列表)。
-        - **🛑 致命错误避坑 (严禁使用赋值号)**:
-          - 后端会自动处理写入操作，你只需要算出**值**。
-          - ❌ **严重错误**: `row['年龄'] = row['年龄'] + 1` (这会导致 SyntaxError)
-          - ✅ **完美正确**: `row['年龄'] + 1` (只返回计算结果)
-        - **单元格汇总 (mode="cell")**:
-          - ✅ 正确: `excel_ops.EXCEL_SUM([r['金额'] for r in rows])`
-        
-        【👀 2. Excel 展示公式 (用户体验优化)】
-        - 无论哪种模式，都请生成一个 **标准 Excel 公式** 用于前端展示。
-        - **核心原则**：假设你正在在一个**全新的空白辅助列**编写此公式。
-        - **关于覆盖操作**：即使是对原列进行覆盖（如“年龄加1”），公式依然要引用原列（如 `=C2+1`）。这是为了展示计算逻辑，不用担心循环引用。
-        - **必须**使用具体相对引用 (如 `A2`) 或 完整区域 (如 `A2:A{data_end_row}`)。
-        
-        【📝 3. Explanation (解释字段 - 必须包含位置信息)】
-        - **explanation** 字段必须包含两部分信息：
-          1. **逻辑**: 做了什么计算 (e.g. "性别为男则年龄+5")
-          2. **去向**: 结果写到了哪里 (必须明确区分 "覆盖原列 [列名]" / "新建列 [列名]" / "写入指定列 [列号]")
-        - **示例**:
-          - "计算年龄+5，并**覆盖原‘年龄’列**。"
-          - "计算总价，结果**写入新列‘F’**。"
-        
-        【📍 4. Target Position (智能定位规则)】
-        - **情况 1：新建列** (例如 "计算总价")
-          - `target_position`: `"总价"` (输出新列名)
-        - **情况 2：覆盖原列** (例如 "把**年龄**加1", "结果写入**原列**")
-          - `target_position`: `"年龄"` (❌ 严禁输出 "原列"，必须填入具体的**被覆盖列名**)
-        - **情况 3：指定列号** (例如 "写入 **G** 列", "写入第 7 列")
-          - `target_position`: `"G"` (直接输出列号字母)
-        - **情况 4：结构修改 / 单元格汇总**
-          - `target_position`: `"全表"` 或 具体单元格如 `"E13"`
-        
-        【JSON 输出模板】
-        {{
-            "action_type": "structure" | "formula",
-            "python_expression": "string (注意: formula模式下严禁写 '=', 只能写表达式)", 
-            "excel_formula": "string (用于前端展示的标准Excel公式)",
-            "mode": "column" | "cell" | "structure", 
-            "target_position": "string (写入的目标列名 或 列字母)",
-            "explanation": "简短说明"
-        }}
-        """
-
-        user_prompt = f"""
-        【数据统计】
-        - 数据结束行: {data_end_row} (引用整列数据时请用到此行号)
-        
-        【列结构映射 (请根据此确定 A/B/C 列)】:
-        {column_mapping_str}
-
-        【数据预览】:
-        {preview}
-
-        【用户需求】: 
-        {user_requirement}
-        """
+        result = json.loads(clean_content)
+    except:
+        # 简单的 JSON 容错处理
+        start = clean_content.find('{')
+        end = clean_content.rfind('}') + 1
+        result = json.loads(clean_content[start:end])
 
+    # 🟢 关键步骤：拼接公式到解释中
+    formula_display = result.get('excel_formula', '')
+    if formula_display and formula_display not in result.get('explanation', ''):
+        # 优化显示的文本格式
+        result['explanation'] = f"{result['explanation']} (参考公式: `{formula_display}`)"
+
+    return result
+
+def get_formula_suggestion(file_path: str, user_requirement: str, sheet: str = None):
+    """
+    智能生成：Python 负责执行，Excel 公式负责展示 (优化版：移除 row 占位符)
+    """
+    try:
+        system_prompt, user_prompt = _build_formula_prompt(file_path, user_requirement, sheet)
         print(f"--- AI Request: {user_requirement} ---")
         content = call_deepseek_raw(system_prompt, user_prompt)
+        return _parse_formula_response(content)
 
-        # 清洗结果
-        clean_content = content.replace("```json", "").replace("```", "").strip()
-        print(f"--- AI Response: {clean_content} ---")
-
-        try:
-            result = json.loads(clean_content)
-        except:
-            # 简单的 JSON 容错处理
-            start = clean_content.find('{')
-            end = clean_content.rfind('}') + 1
-            result = json.loads(clean_content[start:end])
-
-        # 🟢 关键步骤：拼接公式到解释中
-        formula_display = result.get('excel_formula', '')
-        if formula_display and formula_display not in result.get('explanation', ''):
-            # 优化显示的文本格式
-            result['explanation'] = f"{result['explanation']} (参考公式: `{formula_display}`)"
+    except Exception as e:
+        print(f"AI Service Error: {repr(str(e))}")
+        return {
+            "action_type": "error",
+            "explanation": f"AI分析失败: {str(e)}"
+        }
 
-        return result
+async def get_formula_suggestion_async(file_path: str, user_requirement: str, sheet: str = None):
+    """get_formula_suggestion 的异步版本 (API 接口使用)"""
+    try:
+        system_prompt, user_prompt = await run_blocking(_build_formula_prompt, file_path, user_requirement, sheet)
+        print(f"--- AI Request: {user_requirement} ---")
+        content = await call_deepseek_async(system_prompt, user_prompt)
+        return _parse_formula_response(content)
 
     except Exception as e:
         print(f"AI Service Error: {repr(str(e))}")
         return {
             "action_type": "error",
             "explanation": f"AI分析失败: {str(e)}"
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,161 @@
+# backend/answer_templates.py
+"""
+Chat 计算结果的本地模板回答
+
+Chat 原来固定调两次模型：先生成计算代码，再把 result 交给模型"组织语言"。
+大部分问题的结果只是一个数、一个名字或者几行分组统计，第二次调用白白多等一整个往返。
+这里对这类"小而简单"的结果直接按模板拼出回答，不再调用模型；
+结果太大 / 太复杂 (大表、长文本、嵌套结构) 时返回 None，仍交给模型总结 (流式输出)。
+"""
+import datetime
+import numbers
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# ================= 配置区 =================
+CHAT_LOCAL_ANSWER = os.getenv("CHAT_LOCAL_ANSWER", "1") != "0"  # 关掉后每次都让模型总结
+CHAT_LOCAL_MAX_ITEMS = int(os.getenv("CHAT_LOCAL_MAX_ITEMS", "10"))  # 列表 / Series / 表格最多几项 (行)
+CHAT_LOCAL_MAX_COLS = int(os.getenv("CHAT_LOCAL_MAX_COLS", "6"))  # 表格最多几列
+CHAT_LOCAL_MAX_TEXT = int(os.getenv("CHAT_LOCAL_MAX_TEXT", "200"))  # 单个文本结果的长度上限
+SUMMARY_RESULT_CHARS = int(os.getenv("SUMMARY_RESULT_CHARS", "2000"))  # 交给模型总结时结果文本的长度上限
+# =========================================
+
+
+def _is_scalar(value) -> bool:
+    if value is None or isinstance(value, (str, bool, numbers.Number, np.generic,
+                                            datetime.date, datetime.datetime, pd.Timestamp)):
+        return True
+    return False
+
+
+def _fmt_value(value) -> str:
+    """单个值的展示格式：千分位、去掉多余的小数位、日期不带 00:00:00"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return "空"
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return "是" if value else "否"
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, numbers.Real):
+        if float(value).is_integer() and abs(value) < 1e15:
+            return f"{int(value):,}"
+        if abs(value) >= 1:
+            return f"{value:,.2f}"
+        return f"{value:.4g}"
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        if value.hour == 0 and value.minute == 0 and value.second == 0:
+            return value.strftime("%Y-%m-%d")
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def _fits_text(value) -> bool:
+    return not isinstance(value, str) or (len(value) <= CHAT_LOCAL_MAX_TEXT and "\n" not in value)
+
+
+def _format_pairs(pairs, header: str) -> str:
+    lines = [header] + [f"- {_fmt_value(k)}：{_fmt_value(v)}" for k, v in pairs]
+    return "\n".join(lines)
+
+
+def _format_frame(df: pd.DataFrame, header: str) -> Optional[str]:
+    if len(df) > CHAT_LOCAL_MAX_ITEMS or len(df.columns) > CHAT_LOCAL_MAX_COLS:
+        return None
+    values = df.to_numpy(dtype=object).ravel()
+    if not all(_is_scalar(v) and _fits_text(v) for v in values):
+        return None
+    if df.shape == (1, 1):
+        return f"{header}{_fmt_value(df.iat[0, 0])}"
+    # 默认的 0,1,2... 行号没有意义，分组统计之类的行索引才展示
+    show_index = not isinstance(df.index, pd.RangeIndex)
+    if len(df) == 1:
+        pairs = list(df.iloc[0].items())
+        if show_index:
+            header = f"{header}{_fmt_value(df.index[0])}"
+        return _format_pairs(pairs, header)
+    lines = [header]
+    for i, (label, row) in enumerate(df.iterrows(), 1):
+        cells = "，".join(f"{c}={_fmt_value(v)}" for c, v in row.items())
+        lines.append(f"{i}. {_fmt_value(label)}：{cells}" if show_index else f"{i}. {cells}")
+    return "\n".join(lines)
+
+
+def format_answer(user_query: str, result) -> Optional[str]:
+    """
+    小而简单的结果直接按模板生成回答
+    :return: 回答文本；结果不适合套模板时返回 None (调用方交给模型总结)
+    """
+    if not CHAT_LOCAL_ANSWER:
+        return None
+    header = f"关于「{user_query.strip()}」，计算结果为："
+
+    if isinstance(result, (pd.DataFrame, pd.Series, list, tuple, set, dict)) and len(result) == 0:
+        return "计算结果为空，没有找到符合条件的数据。"
+
+    if _is_scalar(result):
+        return f"{header}{_fmt_value(result)}" if _fits_text(result) else None
+
+    if isinstance(result, pd.DataFrame):
+        return _format_frame(result, header)
+
+    if isinstance(result, pd.Series):
+        if len(result) > CHAT_LOCAL_MAX_ITEMS:
+            return None
+        if not all(_is_scalar(v) and _fits_text(v) for v in result.tolist()):
+            return None
+        if len(result) == 1:
+            return f"{header}{_fmt_value(result.iloc[0])}"
+        if isinstance(result.index, pd.RangeIndex):
+            return f"{header}{'、'.join(_fmt_value(v) for v in result.tolist())}"
+        return _format_pairs(result.items(), header)
+
+    if isinstance(result, dict):
+        if len(result) > CHAT_LOCAL_MAX_ITEMS:
+            return None
+        if not all(_is_scalar(v) and _fits_text(v) for v in result.values()):
+            return None
+        return _format_pairs(result.items(), header)
+
+    if isinstance(result, (list, tuple, set)):
+        items = list(result)
+        if len(items) > CHAT_LOCAL_MAX_ITEMS or not all(_is_scalar(v) and _fits_text(v) for v in items):
+            return None
+        return f"{header}{'、'.join(_fmt_value(v) for v in items)}"
+
+    return None
+
+
+def summary_input(result) -> str:
+    """交给模型总结的结果文本：大表只给开头若干行，超长文本截断，避免总结请求本身又慢又贵"""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        text = result.to_string(max_rows=30, max_cols=20)
+    else:
+        text = str(result)
+    if len(text) > SUMMARY_RESULT_CHARS:
+        text = text[:SUMMARY_RESULT_CHARS] + f"\n...(已截断，共 {len(text)} 字符)"
+    return text
+
+
+if __name__ == "__main__":
+    # 简单演示：哪些结果走模板，哪些仍交给模型
+    samples = {
+        "平均工资是多少": np.float64(12345.678),
+        "一共多少人": np.int64(1200),
+        "最早入职日期": pd.Timestamp("2020-03-01"),
+        "各部门人数": pd.Series({"研发": 40, "销售": 25, "财务": 6}),
+        "工资最高的员工": pd.DataFrame({"姓名": ["张三"], "工资": [32000.5]}),
+        "前三名": pd.DataFrame({"姓名": ["张三", "李四", "王五"], "业绩": [98, 95, 91]}),
+        "每个人的明细": pd.DataFrame({"x": range(100)}),
+    }
+    for q, r in samples.items():
+        answer = format_answer(q, r)
+        print(f"--- {q} -> {'模板' if answer is not None else '交给模型'}")
+        if answer is not None:
+            print(answer)
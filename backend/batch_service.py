@@ -1,79 +1,172 @@
 import pandas as pd
 import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 # 引入你原本的两个服务
 from ai_service import get_formula_suggestion
 from formula_service import apply_formula_to_file
+from sandbox import run_sandboxed_sync, SANDBOX_WORKERS
+from schema_index import compute_schema
+from result_index import normalize_query
+from llm_client import LLM_MODEL, LLM_TEMPERATURE
+import llm_cache
 
-def batch_process_files(file_path_list: list, user_requirement: str):
+# ================= 配置区 =================
+# 三个阶段分别限流：读表头走进程池；AI 请求是等网络，走线程池；
+# 应用公式会执行 AI 写的代码，交给沙箱进程 (有超时和资源限制)，这里的线程只负责等待结果
+# 注意：应用阶段真正的并行度是沙箱进程数 SANDBOX_WORKERS，BATCH_APPLY_WORKERS 超过它也没用 (多出的线程只是排队)，
+# 要提高批处理吞吐需要同时调大 SANDBOX_WORKERS
+BATCH_SCAN_WORKERS = int(os.getenv("BATCH_SCAN_WORKERS", str(os.cpu_count() or 2)))
+BATCH_APPLY_WORKERS = int(os.getenv("BATCH_APPLY_WORKERS", str(os.cpu_count() or 2)))
+BATCH_LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", "4"))
+# =========================================
+
+def _scan_signature(f_path: str) -> dict:
     """
-    智能批处理入口：自动识别不同结构的文件，分组处理
+    现读表头生成表结构指纹 (进程池中执行)，只用于库里没有指纹的文件
+    分组用 column_set_hash (列名集合，忽略顺序)；需要严格区分列顺序时改用 schema_fingerprint
     """
-    # 1. 分组字典： { "列指纹字符串": [文件路径1, 文件路径2] }
-    schema_groups = {}
+    return compute_schema(f_path)
+
+def _suggest_for_schema(rep_file: str, user_requirement: str, schema_fingerprint: str = None):
+    """
+    分组的 AI 请求：同样的表结构 (列顺序 + 类型) + 同样的需求，以前问过就直接复用
+    (分组内本来就共用一份处理逻辑，这里只是把复用范围扩大到以前的批次)
+    """
+    key = None
+    if schema_fingerprint:
+        key = llm_cache.make_key(f"formula_by_schema:{schema_fingerprint}", normalize_query(user_requirement),
+                                 LLM_MODEL, LLM_TEMPERATURE)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            print(f"⚡ 同结构表格复用 AI 逻辑: {os.path.basename(rep_file)}")
+            return json.loads(cached)
+
+    ai_result = get_formula_suggestion(rep_file, user_requirement)
+    if key is not None and ai_result.get("action_type") != "error":
+        llm_cache.put(key, json.dumps(ai_result, ensure_ascii=False))
+    return ai_result
+
+def _apply_timed(f_path: str, ai_result: dict):
+    """应用同一套逻辑到单个文件并计时 (沙箱进程中执行)"""
+    start = time.perf_counter()
+    new_path, safe_name = apply_formula_to_file(f_path, ai_result)
+    return new_path, safe_name, round((time.perf_counter() - start) * 1000, 2)
 
-    print(f"📦 收到 {len(file_path_list)} 个文件，正在进行结构分析...")
+def batch_process_files(file_path_list: list, user_requirement: str,
+                        scan_workers: int = None, apply_workers: int = None, llm_workers: int = None,
+                        schemas: list = None):
+    """
+    智能批处理入口：自动识别不同结构的文件，分组处理
+    - 分组：优先用上传时存好的表结构指纹 (schemas，可用 schema_index.schemas_for_paths 从库里查)，
+      没有指纹的文件才在进程池里现读表头
+    - 各分组的 AI 请求：线程池并发，哪组先拿到结果哪组先开始应用；同结构 + 同需求以前问过的直接复用
+    - 逐文件应用：沙箱进程并行，并行度不超过 SANDBOX_WORKERS (沙箱进程池与 API 共用)
+    :param schemas: 可选，与 file_path_list 顺序一致的 {"schema_fingerprint", "column_set_hash"}，缺的为 None
+    :return: 与 file_path_list 顺序一致的结果列表，每项带 elapsed_ms (应用耗时)
+    """
+    scan_workers = scan_workers or BATCH_SCAN_WORKERS
+    # 每个应用线程都要占一个沙箱进程，线程数超过进程数只会排队等待
+    apply_workers = min(apply_workers or BATCH_APPLY_WORKERS, SANDBOX_WORKERS)
+    llm_workers = llm_workers or BATCH_LLM_WORKERS
 
-    # --- 第一步：按列结构分组 ---
-    for f_path in file_path_list:
-        try:
-            # 优化：只读取前 0 行，极大提高速度，只为获取表头
-            df_preview = pd.read_excel(f_path, nrows=0)
+    batch_start = time.perf_counter()
+    # 按输入顺序预留结果位置
+    batch_results = [None] * len(file_path_list)
+    # 1. 分组字典： { "列指纹": [文件序号1, 文件序号2] }
+    schema_groups = {}
+    file_schemas = list(schemas) if schemas is not None else [None] * len(file_path_list)
 
-            # 生成指纹：将列名排序并拼接 (忽略顺序差异，只看列是否相同)
-            # 如果需要严格区分列顺序，去掉 sorted() 即可
-            cols = sorted(df_preview.columns.tolist())
-            signature = "|".join(cols)
+    # --- 第一步：按列结构分组 (有指纹的直接分组，不读文件) ---
+    for i, schema in enumerate(file_schemas):
+        if schema and schema.get("column_set_hash"):
+            schema_groups.setdefault(schema["column_set_hash"], []).append(i)
+    missing = [i for i, schema in enumerate(file_schemas) if not (schema and schema.get("column_set_hash"))]
 
-            if signature not in schema_groups:
-                schema_groups[signature] = []
-            schema_groups[signature].append(f_path)
+    print(f"📦 收到 {len(file_path_list)} 个文件，{len(missing)} 个需要现读表头进行结构分析...")
 
-        except Exception as e:
-            print(f"⚠️ 跳过无法读取的文件 {f_path}: {e}")
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(scan_workers, len(missing)) or 1, mp_context=mp_context) as scan_pool:
+        scan_futures = {scan_pool.submit(_scan_signature, file_path_list[i]): i for i in missing}
+        for future in as_completed(scan_futures):
+            i = scan_futures[future]
+            try:
+                file_schemas[i] = future.result()
+                schema_groups.setdefault(file_schemas[i]["column_set_hash"], []).append(i)
+            except Exception as e:
+                print(f"⚠️ 跳过无法读取的文件 {file_path_list[i]}: {e}")
+                batch_results[i] = {
+                    "original_file": file_path_list[i],
+                    "status": "failed",
+                    "error": f"无法读取表头: {e}"
+                }
 
+    # 分组内保持输入顺序，代表文件固定为组内第一个
+    for indices in schema_groups.values():
+        indices.sort()
     print(f"📊 分析完成，共识别出 {len(schema_groups)} 种不同的表格结构。")
 
     # --- 第二步：按组进行 AI 咨询与处理 ---
-    batch_results = []
+    with ThreadPoolExecutor(max_workers=llm_workers) as llm_pool, \
+            ThreadPoolExecutor(max_workers=apply_workers) as apply_pool:
 
-    for signature, files in schema_groups.items():
-        print(f"\n======== 处理分组: 包含 {len(files)} 个文件 ========")
-        print(f"列结构: {signature[:50]}...") # 打印一部分看看
+        llm_futures = {}
+        for signature, indices in schema_groups.items():
+            # 1. 选出代表文件 (Representative)
+            rep_file = file_path_list[indices[0]]
 
-        # 1. 选出代表文件 (Representative)
-        rep_file = files[0]
+            # 2. 调用 AI 获取处理逻辑 (该组只调一次 AI，节省 token)
+            print(f"🤖 正在请求 AI 分析代表文件: {os.path.basename(rep_file)} (分组含 {len(indices)} 个文件)")
+            rep_fingerprint = file_schemas[indices[0]].get("schema_fingerprint")
+            llm_futures[llm_pool.submit(_suggest_for_schema, rep_file, user_requirement, rep_fingerprint)] = signature
 
-        # 2. 调用 AI 获取处理逻辑 (该组只调一次 AI，节省 token)
-        print(f"🤖 正在请求 AI 分析代表文件: {os.path.basename(rep_file)}")
-        ai_result = get_formula_suggestion(rep_file, user_requirement)
+        apply_futures = {}
+        for future in as_completed(llm_futures):
+            signature = llm_futures[future]
+            indices = schema_groups[signature]
+            print(f"\n======== 分组就绪: 包含 {len(indices)} 个文件 ========")
+            print(f"列结构指纹: {signature[:12]}") # 打印一部分看看
 
-        # 如果 AI 分析出错，这组所有文件都标记失败
-        if ai_result.get('action_type') == 'error':
-            for f in files:
-                batch_results.append({
-                    "original_file": f,
-                    "status": "failed",
-                    "error": ai_result.get('explanation')
-                })
-            continue
+            try:
+                ai_result = future.result()
+            except Exception as e:
+                ai_result = {"action_type": "error", "explanation": str(e)}
+
+            # 如果 AI 分析出错，这组所有文件都标记失败
+            if ai_result.get('action_type') == 'error':
+                for i in indices:
+                    batch_results[i] = {
+                        "original_file": file_path_list[i],
+                        "status": "failed",
+                        "error": ai_result.get('explanation')
+                    }
+                continue
+
+            # 3. 将同一套逻辑应用到该组所有文件
+            for i in indices:
+                print(f"⚙️ 正在应用逻辑到: {os.path.basename(file_path_list[i])}")
+                apply_futures[apply_pool.submit(run_sandboxed_sync, _apply_timed, file_path_list[i], ai_result)] = (i, signature)
 
-        # 3. 将同一套逻辑应用到该组所有文件
-        for f in files:
-            print(f"⚙️ 正在应用逻辑到: {os.path.basename(f)}")
+        for future in as_completed(apply_futures):
+            i, signature = apply_futures[future]
             try:
-                new_path, safe_name = apply_formula_to_file(f, ai_result)
-                batch_results.append({
-                    "original_file": f,
+                new_path, safe_name, elapsed_ms = future.result()
+                batch_results[i] = {
+                    "original_file": file_path_list[i],
                     "processed_file": new_path,
                     "download_name": safe_name,
                     "status": "success",
-                    "group_signature": signature
-                })
+                    "group_signature": signature,
+                    "elapsed_ms": elapsed_ms
+                }
             except Exception as e:
-                batch_results.append({
-                    "original_file": f,
+                batch_results[i] = {
+                    "original_file": file_path_list[i],
                     "status": "failed",
                     "error": str(e)
-                })
+                }
 
-    return batch_results
\ No newline at end of file
+    print(f"✅ 批处理完成: {len(file_path_list)} 个文件，总耗时 {round(time.perf_counter() - batch_start, 2)} 秒")
+    return batch_results
@@ -0,0 +1,158 @@
+# backend/code_columns.py
+"""
+多表代码的列裁剪分析
+
+多表关联时用户经常选好几张几十列的宽表，AI 写的代码却往往只用到其中两三列：
+    a = dfs['工资表.xlsx'][['工号', '实发']]
+    b = dfs['花名册.xlsx'][['工号', '部门']]
+    result_df = a.merge(b, on='工号')
+
+执行前用 ast 静态分析代码，算出每张表真正用到的列，只加载这些列 (旁路文件按列存储，没用到的列完全不读)。
+
+分析是保守的，只有能证明结果不依赖其他列时才裁剪，拿不准的一律整表加载：
+- dfs 只能以 dfs['常量文件名'] 的形式出现 (dfs.values()、dfs[变量] 等 -> 所有表整表加载)
+- 每张表的每一处使用都必须是按常量列名取列：df['列']、df[['列1', '列2']]、df.列名
+  (整表 merge、df[条件]、df.iloc、df.columns、df['新列'] = ... 等任何其他用法 -> 该表整表加载)
+- 可以先赋给一个变量 (df = dfs['a.xlsx'])，但该变量在代码里只能被赋值这一次
+- 代码里出现 eval / exec / locals / globals / vars / getattr 时全部整表加载
+"""
+import ast
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+FRAMES_VAR = "dfs"
+_DYNAMIC_NAMES = {"eval", "exec", "locals", "globals", "vars", "getattr"}
+
+
+def _slice_node(node: ast.Subscript):
+    """兼容 Python 3.8：下标外面还包着一层 ast.Index"""
+    sl = node.slice
+    if type(sl).__name__ == "Index":
+        sl = sl.value
+    return sl
+
+
+def _const_str(node) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _projected_columns(node) -> Optional[List[str]]:
+    """df['列'] / df[['列1', '列2']] 的下标部分 -> 列名列表；其他写法返回 None"""
+    single = _const_str(node)
+    if single is not None:
+        return [single]
+    if isinstance(node, ast.List) and node.elts:
+        names = [_const_str(e) for e in node.elts]
+        if all(n is not None for n in names):
+            return names
+    return None
+
+
+def _frame_key(parent, node) -> Optional[str]:
+    """node 是 dfs 这个名字，parent 是 dfs['常量'] 时返回文件名 key"""
+    if isinstance(parent, ast.Subscript) and parent.value is node and isinstance(parent.ctx, ast.Load):
+        return _const_str(_slice_node(parent))
+    return None
+
+
+def _bound_names(tree) -> Dict[str, int]:
+    """统计每个名字被绑定的次数 (赋值、循环变量、函数参数、import as 等都算)"""
+    counts = {}
+
+    def bump(name):
+        counts[name] = counts.get(name, 0) + 1
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bump(node.id)
+        elif isinstance(node, ast.arg):
+            bump(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bump(node.name)
+        elif isinstance(node, ast.alias):
+            bump(node.asname or node.name.split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            for name in node.names:
+                bump(name)
+                bump(name)  # 跨作用域改写，直接视为多次绑定
+    return counts
+
+
+def plan_columns(py_code: str, file_columns: Dict[str, list]) -> Dict[str, Optional[list]]:
+    """
+    :param py_code: AI 生成的多表代码
+    :param file_columns: {文件名 key: 该文件的全部列名}
+    :return: {文件名 key: 需要加载的列 (按原表顺序)}，None 表示整表加载
+    """
+    full = {key: None for key in file_columns}
+    try:
+        tree = ast.parse(py_code)
+    except SyntaxError:
+        return full
+
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+        if isinstance(node, ast.Name) and node.id in _DYNAMIC_NAMES:
+            return full
+
+    # 1. 找出所有 dfs['文件名']，以及 df = dfs['文件名'] 这样的别名
+    uses = {key: [] for key in file_columns}  # key -> 表达式节点列表 (这些节点的值就是整张表)
+    aliases = []  # (别名, key)
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id == FRAMES_VAR):
+            continue
+        ref = parents.get(node)
+        key = _frame_key(ref, node)
+        if key is None or key not in file_columns:
+            return full
+        holder = parents.get(ref)
+        if (isinstance(holder, ast.Assign) and holder.value is ref and len(holder.targets) == 1
+                and isinstance(holder.targets[0], ast.Name)):
+            aliases.append((holder.targets[0].id, key))
+        else:
+            uses[key].append(ref)
+
+    bound = _bound_names(tree)
+    blocked = set()
+    alias_keys = {}  # 只被绑定过一次的别名 -> key
+    for name, key in aliases:
+        if bound.get(name, 0) != 1 or name == FRAMES_VAR:
+            blocked.add(key)
+        else:
+            alias_keys[name] = key
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id in alias_keys:
+            uses[alias_keys[node.id]].append(node)
+
+    # 2. 每一处使用都必须是按常量列名取列
+    plan = {}
+    for key, columns in file_columns.items():
+        if key in blocked:
+            plan[key] = None
+            continue
+        needed = set()
+        for expr in uses[key]:
+            parent = parents.get(expr)
+            picked = None
+            if isinstance(parent, ast.Subscript) and parent.value is expr and isinstance(parent.ctx, ast.Load):
+                picked = _projected_columns(_slice_node(parent))
+            elif (isinstance(parent, ast.Attribute) and parent.value is expr and parent.attr in columns
+                  and not hasattr(pd.DataFrame, parent.attr)):
+                picked = [parent.attr]
+            if picked is None:
+                needed = None
+                break
+            needed.update(picked)
+
+        if needed is None:
+            plan[key] = None
+        else:
+            # 只保留文件里真有的列 (写错的列名照样会在执行时报 KeyError)；一列都没用到时留第一列保住行数
+            selected = [c for c in columns if c in needed] or list(columns[:1])
+            plan[key] = None if len(selected) == len(columns) else selected
+    return plan
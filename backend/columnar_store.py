@@ -0,0 +1,195 @@
+# backend/columnar_store.py
+"""
+列式旁路文件 (Feather / Arrow IPC)
+
+openpyxl 解析 .xlsx 是整个系统最大的 CPU 开销。上传时顺手把表格另存一份
+Feather 文件 (与 xlsx 同名，后缀 .feather)，之后所有读取都优先走它：
+- 不压缩，支持内存映射 (memory_map) 读取，大表加载从秒级降到毫秒级
+- 原始 xlsx 保留不动，只用于下载
+- 没有安装 pyarrow 或表格无法转换 (列名非字符串、混合类型列等) 时自动回退到 read_excel
+- 多工作表的文件，每个工作表各有一份旁路文件，第一次用到哪个 sheet 才解析哪个 (sheet 为 None 表示第一个)
+"""
+import hashlib
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from xlsx_stream import read_sheet_head, StreamUnsupported
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow 是可选依赖
+    pa = None
+    feather = None
+
+SIDECAR_EXT = ".feather"
+
+
+def sidecar_path_for(xlsx_path: str, sheet: str = None) -> str:
+    """
+    xlsx 对应的旁路文件路径：uploads/abc.xlsx -> uploads/abc.feather
+    其他工作表：uploads/abc.sheet-<工作表名哈希>.feather (工作表名可能含文件名不允许的字符)
+    """
+    base = os.path.splitext(xlsx_path)[0]
+    if sheet is None:
+        return base + SIDECAR_EXT
+    digest = hashlib.sha1(sheet.encode("utf-8")).hexdigest()[:12]
+    return f"{base}.sheet-{digest}{SIDECAR_EXT}"
+
+
+def existing_sidecar(xlsx_path: str, sheet: str = None):
+    """旁路文件存在且不比 xlsx 旧时返回其路径，否则返回 None"""
+    if feather is None:
+        return None
+    path = sidecar_path_for(xlsx_path, sheet)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(xlsx_path):
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def write_sidecar(df: pd.DataFrame, xlsx_path: str, sheet: str = None):
+    """
+    把 DataFrame 写成 xlsx 的旁路文件。
+    :return: 旁路文件路径；无法写入时返回 None (调用方照常使用 xlsx 即可)
+    """
+    if feather is None:
+        return None
+
+    # Arrow 会把非字符串列名转成字符串，读回来就和 read_excel 不一致了
+    if not all(isinstance(c, str) for c in df.columns):
+        return None
+
+    path = sidecar_path_for(xlsx_path, sheet)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # 不压缩，才能内存映射零拷贝读取
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)  # 原子替换，避免并发读到半个文件
+        return path
+    except Exception as e:
+        print(f"⚠️ 旁路文件写入失败，继续使用 xlsx: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+class SidecarWriter:
+    """
+    分批追加写旁路文件 (合并大量文件时用，不必先把所有数据拼成一个 DataFrame)
+    - 第一批决定 schema，之后每批都按这个 schema 写入
+    - 任何一批写不进去 (类型对不上等) 就放弃旁路文件，close() 返回 None，调用方照常使用 xlsx
+    - 必须在 xlsx 保存之后再 close()，否则旁路文件会比 xlsx 旧而被当作过期
+    """
+
+    def __init__(self, xlsx_path: str):
+        self.path = sidecar_path_for(xlsx_path)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        self._writer = None
+        self._schema = None
+        self.failed = feather is None
+
+    def write(self, df: pd.DataFrame):
+        if self.failed:
+            return
+        try:
+            if not all(isinstance(c, str) for c in df.columns):
+                raise ValueError("列名不全是字符串")
+            table = pa.Table.from_pandas(df, preserve_index=False, schema=self._schema)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pa.ipc.new_file(self.tmp_path, table.schema)
+            self._writer.write_table(table)
+        except Exception as e:
+            print(f"⚠️ 旁路文件追加写入失败，继续使用 xlsx: {e}")
+            self.abort()
+
+    def abort(self):
+        self.failed = True
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def close(self):
+        """结束写入：成功返回旁路文件路径，否则返回 None"""
+        if self.failed or self._writer is None:
+            self.abort()
+            return None
+        self._writer.close()
+        self._writer = None
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+
+def read_frame(xlsx_path: str, columns: list = None, sheet: str = None) -> pd.DataFrame:
+    """
+    读取表格：优先内存映射读取旁路文件，否则解析 xlsx 并顺手补写旁路文件。
+    :param columns: 只读取这些列 (旁路文件按列存储，没用到的列完全不会被读入内存)
+    :param sheet: 工作表名，None 为第一个；只解析这一个工作表
+    """
+    sidecar = existing_sidecar(xlsx_path, sheet)
+    if sidecar:
+        try:
+            return feather.read_table(sidecar, columns=columns, memory_map=True).to_pandas()
+        except Exception as e:
+            print(f"⚠️ 旁路文件读取失败，回退到 xlsx: {e}")
+
+    df = pd.read_excel(xlsx_path, sheet_name=sheet if sheet is not None else 0)
+    write_sidecar(df, xlsx_path, sheet)
+    return df[columns] if columns is not None else df
+
+
+def read_head(xlsx_path: str, nrows: int, sheet: str = None) -> pd.DataFrame:
+    """
+    只读前 nrows 行 (Prompt 预览、表结构指纹用)
+    有旁路文件时只解码第一个数据块；没有时直接流式读 sheet XML 的开头 (xlsx_stream.read_sheet_head)
+    """
+    sidecar = existing_sidecar(xlsx_path, sheet)
+    if sidecar:
+        try:
+            with pa.memory_map(sidecar) as source:
+                reader = pa.ipc.open_file(source)
+                batches, count = [], 0
+                for i in range(reader.num_record_batches):
+                    if count >= nrows:
+                        break
+                    batch = reader.get_batch(i)
+                    batches.append(batch)
+                    count += batch.num_rows
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+                return table.slice(0, nrows).to_pandas()
+        except Exception as e:
+            print(f"⚠️ 旁路文件读取失败，回退到 xlsx: {e}")
+    try:
+        head = read_sheet_head(xlsx_path, nrows, sheet=sheet)
+        df = pd.DataFrame(head["rows"], columns=head["columns"])
+        # 空单元格与 read_excel 一样用 NaN 表示 (全空列因此是 float64，而不是 None 组成的 object 列)
+        return df.where(df.notna(), np.nan).infer_objects()
+    except StreamUnsupported:
+        return pd.read_excel(xlsx_path, sheet_name=sheet if sheet is not None else 0, nrows=nrows)
+
+
+def read_columns(xlsx_path: str, sheet: str = None) -> list:
+    """只取列名：有旁路文件时只读 schema，不加载任何数据"""
+    sidecar = existing_sidecar(xlsx_path, sheet)
+    if sidecar:
+        try:
+            with pa.memory_map(sidecar) as source:
+                return list(pa.ipc.open_file(source).schema.names)
+        except Exception as e:
+            print(f"⚠️ 旁路文件 schema 读取失败，回退到 xlsx: {e}")
+    try:
+        return read_sheet_head(xlsx_path, 0, sheet=sheet)["columns"]
+    except StreamUnsupported:
+        return pd.read_excel(xlsx_path, sheet_name=sheet if sheet is not None else 0, nrows=0).columns.tolist()
@@ -0,0 +1,208 @@
+# backend/df_cache.py
+"""
+进程级 DataFrame 缓存
+
+同一个请求里 (以及相邻的请求之间) 经常会把同一个 .xlsx 解析好几次，
+这里按 (文件路径, mtime, size, 工作表) 缓存解析结果，按内存占用做 LRU 淘汰。
+多工作表的文件每个 sheet 单独缓存、单独加载，只用到一个 sheet 时不会解析其他 sheet。
+
+- 每个 FileRecord 的 stored_path 都是唯一的 uuid 文件名，所以路径就等价于文件 id。
+- 文件被覆盖写入后 mtime/size 会变化，旧缓存自然失效。
+- 默认返回副本，调用方可以随意修改 (AI 代码经常 inplace 操作 df)。
+
+另外缓存分页预览用的排序 / 筛选结果 (行号数组)，翻页时不用每页都重新排序。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import read_frame, read_head, existing_sidecar
+
+# 缓存内存上限 (MB)，可通过环境变量调整
+MAX_CACHE_MB = float(os.getenv("DF_CACHE_MAX_MB", "512"))
+# 排序 / 筛选视图缓存条数 (每条是一个行号数组，100 万行约 8MB)
+MAX_VIEWS = int(os.getenv("DF_VIEW_CACHE_SIZE", "16"))
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (df, nbytes)
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+_views = OrderedDict()  # (文件 key, 排序, 筛选) -> 行号数组
+
+
+def _make_key(file_path: str, sheet: str = None):
+    """生成缓存 key：绝对路径 + 修改时间 + 文件大小 + 工作表 (None 为第一个)"""
+    st = os.stat(file_path)
+    return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, sheet)
+
+
+def _estimate_bytes(df: pd.DataFrame) -> int:
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+def _evict_if_needed():
+    """超出内存上限时从最久未使用的条目开始淘汰 (调用方需持有锁)"""
+    limit = MAX_CACHE_MB * 1024 * 1024
+    while _entries and _stats["bytes"] > limit:
+        _, (_, nbytes) = _entries.popitem(last=False)
+        _stats["bytes"] -= nbytes
+        _stats["evictions"] += 1
+
+
+def load_dataframe(file_path: str, copy: bool = True, sheet: str = None) -> pd.DataFrame:
+    """
+    读取 Excel 为 DataFrame，命中缓存时不再重新解析。
+    :param copy: 只读场景 (如预览) 可传 False 省掉一次拷贝，但绝不能修改返回值
+    :param sheet: 工作表名，None 为第一个
+    """
+    key = _make_key(file_path, sheet)
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            df = entry[0]
+            return df.copy() if copy else df
+        _stats["misses"] += 1
+
+    # 解析放在锁外面，避免大文件阻塞其他请求的缓存命中 (优先读列式旁路文件)
+    df = read_frame(file_path, sheet=sheet)
+    nbytes = _estimate_bytes(df)
+
+    with _lock:
+        if key not in _entries:
+            # 同一文件的旧版本 (mtime/size 不同) 直接丢掉
+            for old_key in [k for k in _entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+                _stats["bytes"] -= _entries.pop(old_key)[1]
+            _entries[key] = (df, nbytes)
+            _stats["bytes"] += nbytes
+            _evict_if_needed()
+
+    return df.copy() if copy else df
+
+
+def load_columns(file_path: str, columns: list = None, sheet: str = None) -> pd.DataFrame:
+    """
+    只加载部分列 (多表代码的列裁剪用)，columns 为 None 时等同于 load_dataframe
+    - 整表已在缓存里：直接从缓存里取这几列
+    - 有旁路文件：只内存映射读取这几列，不进缓存 (缓存里只放整表)
+    - 都没有：只能先整表解析 (同时生成旁路文件并进缓存)
+    """
+    if columns is None:
+        return load_dataframe(file_path, sheet=sheet)
+
+    key = _make_key(file_path, sheet)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[0][columns].copy()
+
+    if existing_sidecar(file_path, sheet):
+        return read_frame(file_path, columns=columns, sheet=sheet)
+    return load_dataframe(file_path, copy=False, sheet=sheet)[columns].copy()
+
+
+def peek_dataframe(file_path: str, sheet: str = None):
+    """整表已在缓存里时返回它 (只读，不拷贝)，否则返回 None，不触发任何加载"""
+    key = _make_key(file_path, sheet)
+    with _lock:
+        entry = _entries.get(key)
+        return entry[0] if entry is not None else None
+
+
+def load_head(file_path: str, nrows: int, sheet: str = None) -> pd.DataFrame:
+    """前 nrows 行 (Prompt 预览用)：整表在缓存里就直接切，否则只读开头，不加载整表"""
+    key = _make_key(file_path, sheet)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            return entry[0].head(nrows).copy()
+    return read_head(file_path, nrows, sheet=sheet)
+
+
+def _compute_positions(df: pd.DataFrame, sort_by, ascending, filter_column, filter_value) -> np.ndarray:
+    positions = np.arange(len(df))
+
+    if filter_column:
+        # 不区分大小写的包含匹配，空值不参与
+        col = df[filter_column].reset_index(drop=True)
+        mask = col.notna() & col.astype(str).str.contains(str(filter_value), case=False, regex=False)
+        positions = positions[mask.to_numpy()]
+
+    if sort_by:
+        series = df[sort_by].reset_index(drop=True).iloc[positions]
+        try:
+            ordered = series.sort_values(ascending=ascending, kind="mergesort", na_position="last")
+        except TypeError:
+            # 混合类型 (数字 + 文本) 无法直接比较，按文本排序
+            ordered = series.where(series.isna(), series.astype(str)).sort_values(
+                ascending=ascending, kind="mergesort", na_position="last")
+        positions = ordered.index.to_numpy()
+
+    return positions
+
+
+def load_view(file_path: str, sort_by: str = None, ascending: bool = True,
+              filter_column: str = None, filter_value: str = None, sheet: str = None):
+    """
+    分页预览用：返回 (只读 DataFrame, 行号数组 或 None)
+    - 不排序也不筛选时行号为 None，直接按位置切片即可
+    - 同一个文件 + 同样的排序 / 筛选条件，结果会被缓存，翻页时只做切片
+    """
+    df = load_dataframe(file_path, copy=False, sheet=sheet)
+    if not sort_by and not filter_column:
+        return df, None
+
+    view_key = (_make_key(file_path, sheet), sort_by, ascending, filter_column, filter_value)
+    with _lock:
+        positions = _views.get(view_key)
+        if positions is not None:
+            _views.move_to_end(view_key)
+            return df, positions
+
+    positions = _compute_positions(df, sort_by, ascending, filter_column, filter_value)
+
+    with _lock:
+        _views[view_key] = positions
+        while len(_views) > MAX_VIEWS:
+            _views.popitem(last=False)
+    return df, positions
+
+
+def invalidate(file_path: str = None):
+    """清除某个文件 (或全部) 的缓存 (所有工作表)"""
+    with _lock:
+        if file_path is None:
+            _entries.clear()
+            _views.clear()
+            _stats["bytes"] = 0
+            return
+        abs_path = os.path.abspath(file_path)
+        for key in [k for k in _entries if k[0] == abs_path]:
+            _stats["bytes"] -= _entries.pop(key)[1]
+        for key in [k for k in _views if k[0][0] == abs_path]:
+            del _views[key]
+
+
+def cache_stats() -> dict:
+    """返回命中率等统计信息"""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            "entries": len(_entries),
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "evictions": _stats["evictions"],
+            "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+            "memory_mb": round(_stats["bytes"] / 1024 / 1024, 2),
+            "max_memory_mb": MAX_CACHE_MB,
+            "views": len(_views),
+        }
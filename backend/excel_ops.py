@@ -3,6 +3,19 @@ import math
 import re
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
+# 支持整列 (Series / ndarray) 逐元素计算的函数，vector_engine 会直接把整列传进来
+ELEMENTWISE_FUNCS = {
+    "EXCEL_SUM", "EXCEL_AVERAGE", "EXCEL_MULTIPLY", "EXCEL_DIVIDE", "EXCEL_ROUND",
+    "EXCEL_IF", "EXCEL_AND", "EXCEL_OR",
+    "EXCEL_LEFT", "EXCEL_RIGHT", "EXCEL_MID", "EXCEL_LEN", "EXCEL_CONCAT", "EXCEL_FIND",
+    "EXCEL_VLOOKUP_DICT",
+}
+# 只传一个列表/整列时做聚合 (而不是逐元素) 的函数
+AGGREGATE_FUNCS = {"EXCEL_SUM", "EXCEL_AVERAGE"}
+
 # ================= 工具函数 =================
 def _to_float(val):
     """尝试将任何东西转为 float，失败返回 0"""
@@ -15,24 +28,106 @@ def _to_str(val):
     """转为字符串，None转为空"""
     return "" if val is None else str(val)
 
+def _is_vector(val):
+    """是否整列输入 (pandas Series / NumPy 数组)"""
+    return isinstance(val, (pd.Series, np.ndarray))
+
+def _align(*args):
+    """把 ndarray 统一转成 Series，并与参数中第一个 Series 共用索引，避免按索引错位"""
+    index = next((a.index for a in args if isinstance(a, pd.Series)), None)
+    return [
+        pd.Series(a, index=index) if isinstance(a, np.ndarray) else a
+        for a in args
+    ]
+
+def _to_float_vec(s: pd.Series) -> pd.Series:
+    """
+    向量版 _to_float：逐元素结果与 _to_float 完全一致
+    - 数字 / 布尔列直接转 float (NaN 保持 NaN)；可空整数等扩展类型里的 pd.NA 在标量路径会转换失败，变成 0
+    - 日期 / 时长列 float() 都会失败 (含 NaT)，全部为 0
+    - 其他列先用 to_numeric 批量转换，转不出来的元素 (文本、None、NaT、'1_000'、'nan' 等) 再逐个走 _to_float
+    """
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+        if isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+            return pd.Series(s.to_numpy(dtype=float, na_value=0.0), index=s.index)
+        return s.astype(float)
+    if pd.api.types.is_datetime64_any_dtype(s) or pd.api.types.is_timedelta64_dtype(s):
+        return pd.Series(0.0, index=s.index)
+
+    values = np.array(pd.to_numeric(s, errors="coerce").to_numpy(dtype=float, na_value=np.nan))
+    missing = np.isnan(values)
+    if missing.any():
+        raw = s.to_numpy(dtype=object)
+        values[missing] = [_to_float(v) for v in raw[missing]]
+    return pd.Series(values, index=s.index)
+
+def _num(val):
+    """标量走 _to_float，整列走 _to_float_vec"""
+    if isinstance(val, pd.Series):
+        return _to_float_vec(val)
+    if isinstance(val, np.ndarray):
+        return _to_float_vec(pd.Series(val))
+    return _to_float(val)
+
+def _to_str_vec(s: pd.Series) -> pd.Series:
+    """向量版 _to_str：全是字符串时直接用，否则逐元素转换 (None -> "")"""
+    if not s.isna().any() and pd.api.types.is_string_dtype(s):
+        return s.astype(object)
+    return s.map(_to_str).astype(object)
+
+def _truthy(val):
+    """向量版 Python 真值判断 (与 `if x:` 一致：0 / 空串为假，NaN 为真)"""
+    if not isinstance(val, pd.Series):
+        return bool(val)
+    if pd.api.types.is_bool_dtype(val):
+        return val.astype(bool)
+    if pd.api.types.is_numeric_dtype(val):
+        return val != 0
+    return val.map(bool).astype(bool)
+
+def _elementwise(func, *args):
+    """参数组合无法直接向量化时 (如截取长度也是整列)，按元素调用标量版本"""
+    args = _align(*args)
+    index = next(a.index for a in args if isinstance(a, pd.Series))
+    columns = [a.tolist() if isinstance(a, pd.Series) else [a] * len(index) for a in args]
+    return pd.Series([func(*vals) for vals in zip(*columns)], index=index)
+
+def _column_values(val):
+    """聚合函数的单个列表/整列入参 -> 数值 Series"""
+    if isinstance(val, pd.Series):
+        return _to_float_vec(val)
+    return _to_float_vec(pd.Series(list(val), dtype=object))
+
 # ================= 数学运算 =================
 
 def EXCEL_SUM(*args):
     """
     模拟 SUM。
     支持传入单个列表/Series (如 df['列']) 或 多个参数。
+    多个参数中包含整列时，按行逐元素相加。
     """
     # 如果第一个参数是列表或 Series，直接求和该列表
+    if len(args) == 1 and isinstance(args[0], (list, tuple, pd.Series, np.ndarray)):
+        return float(_column_values(args[0]).sum(skipna=False))
     if len(args) == 1 and hasattr(args[0], '__iter__'):
         return sum(_to_float(x) for x in args[0])
 
     # 否则求和所有参数
-    return sum(_to_float(x) for x in args)
+    return sum(_num(x) for x in _align(*args))
 
 def EXCEL_AVERAGE(*args):
     """模拟 AVERAGE"""
-    values = []
     # 处理列表/Series输入
+    if len(args) == 1 and isinstance(args[0], (list, tuple, pd.Series, np.ndarray)):
+        values = _column_values(args[0])
+        if values.empty:
+            return 0
+        return float(values.mean(skipna=False))
+
+    if any(_is_vector(x) for x in args):
+        return EXCEL_SUM(*args) / len(args)
+
+    values = []
     if len(args) == 1 and hasattr(args[0], '__iter__'):
         values = [_to_float(x) for x in args[0]]
     else:
@@ -44,10 +139,20 @@ def EXCEL_AVERAGE(*args):
 
 def EXCEL_MULTIPLY(a, b):
     """安全乘法"""
-    return _to_float(a) * _to_float(b)
+    a, b = _align(a, b)
+    return _num(a) * _num(b)
 
 def EXCEL_DIVIDE(a, b):
     """安全除法，防除零"""
+    if _is_vector(a) or _is_vector(b):
+        a, b = _align(a, b)
+        val_a, val_b = _num(a), _num(b)
+        if not isinstance(val_b, pd.Series):
+            return pd.Series(0.0, index=val_a.index) if val_b == 0 else val_a / val_b
+        # 除数为 0 的位置结果为 0 (先把 0 换成 NaN，避免产生 inf 警告)
+        result = val_a / val_b.mask(val_b == 0)
+        return result.mask(val_b == 0, 0.0)
+
     val_b = _to_float(b)
     if val_b == 0:
         return 0
@@ -55,6 +160,16 @@ def EXCEL_DIVIDE(a, b):
 
 def EXCEL_ROUND(number, digits):
     """四舍五入"""
+    if _is_vector(digits):
+        return _elementwise(EXCEL_ROUND, number, digits)
+    if _is_vector(number):
+        values = _num(number)
+        try:
+            # 逐个用 Python round (与标量分支一致)：Series.round 按十进制缩放取整，2.675 会得到 2.68 而不是 2.67
+            n = int(digits)
+            return pd.Series([round(v, n) for v in values.tolist()], index=values.index, dtype=float)
+        except:
+            return pd.Series(0, index=values.index)
     try:
         return round(_to_float(number), int(digits))
     except:
@@ -64,48 +179,89 @@ def EXCEL_ROUND(number, digits):
 
 def EXCEL_IF(condition, true_val, false_val):
     """模拟 IF"""
+    if _is_vector(condition):
+        condition, true_val, false_val = _align(condition, true_val, false_val)
+        cond = _truthy(condition)
+        true_col = true_val if isinstance(true_val, pd.Series) else pd.Series([true_val] * len(cond), index=cond.index, dtype=object)
+        return true_col.where(cond, false_val)
     return true_val if condition else false_val
 
 def EXCEL_AND(*args):
     """模拟 AND"""
+    if any(_is_vector(x) for x in args):
+        result = True
+        for x in _align(*args):
+            result = _truthy(x) & result
+        return result
     return all(args)
 
 def EXCEL_OR(*args):
     """模拟 OR"""
+    if any(_is_vector(x) for x in args):
+        result = False
+        for x in _align(*args):
+            result = _truthy(x) | result
+        return result
     return any(args)
 
 # ================= 文本处理 (最常用) =================
 
 def EXCEL_LEFT(text, num_chars):
     """模拟 LEFT"""
+    if _is_vector(num_chars):
+        return _elementwise(EXCEL_LEFT, text, num_chars)
+    if _is_vector(text):
+        n = int(_to_float(num_chars))
+        return _to_str_vec(_align(text)[0]).str[:n]
     s = _to_str(text)
     n = int(_to_float(num_chars))
     return s[:n]
 
 def EXCEL_RIGHT(text, num_chars):
     """模拟 RIGHT"""
+    if _is_vector(num_chars):
+        return _elementwise(EXCEL_RIGHT, text, num_chars)
+    if _is_vector(text):
+        n = int(_to_float(num_chars))
+        s = _to_str_vec(_align(text)[0])
+        return s.str[-n:] if n > 0 else s.str[:0]
     s = _to_str(text)
     n = int(_to_float(num_chars))
     return s[-n:] if n > 0 else ""
 
 def EXCEL_MID(text, start_num, num_chars):
     """模拟 MID (注意 Excel 索引从1开始，Python从0开始)"""
-    s = _to_str(text)
+    if _is_vector(start_num) or _is_vector(num_chars):
+        return _elementwise(EXCEL_MID, text, start_num, num_chars)
     start = int(_to_float(start_num)) - 1
     length = int(_to_float(num_chars))
     if start < 0: start = 0
+    if _is_vector(text):
+        return _to_str_vec(_align(text)[0]).str[start : start + length]
+    s = _to_str(text)
     return s[start : start + length]
 
 def EXCEL_LEN(text):
     """模拟 LEN"""
+    if _is_vector(text):
+        return _to_str_vec(_align(text)[0]).str.len()
     return len(_to_str(text))
 
 def EXCEL_CONCAT(*args):
     """模拟 CONCAT"""
+    if any(_is_vector(x) for x in args):
+        result = ""
+        for x in _align(*args):
+            result = result + (_to_str_vec(x) if isinstance(x, pd.Series) else _to_str(x))
+        return result
     return "".join([_to_str(x) for x in args])
 
 def EXCEL_FIND(find_text, within_text):
     """模拟 FIND (没找到返回 -1，而不是报错)"""
+    if _is_vector(find_text):
+        return _elementwise(EXCEL_FIND, find_text, within_text)
+    if _is_vector(within_text):
+        return _to_str_vec(_align(within_text)[0]).str.find(_to_str(find_text)) + 1
     try:
         return _to_str(within_text).find(_to_str(find_text)) + 1
     except:
@@ -118,4 +274,11 @@ def EXCEL_VLOOKUP_DICT(lookup_value, lookup_dict, default=""):
     Python 版 VLOOKUP 的简化。
     lookup_dict 应该是一个 {'张三': '经理', '李四': '专员'} 的字典。
     """
-    return lookup_dict.get(lookup_value, default)
\ No newline at end of file
+    if _is_vector(lookup_value):
+        values = _align(lookup_value)[0]
+        # 逐元素 dict.get，与标量路径一致；Series.map(dict) 会因为缺失值把整数结果变成 float
+        result = pd.Series([lookup_dict.get(v, default) for v in values.tolist()], index=values.index, dtype=object)
+        inferred = result.infer_objects()
+        # 全是整数 / 布尔时保留对应的整数类型，其余情况保持原值 (object)
+        return inferred if inferred.dtype.kind in "iub" else result
+    return lookup_dict.get(lookup_value, default)
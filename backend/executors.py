@@ -0,0 +1,67 @@
+# backend/executors.py
+"""
+并发控制：把阻塞/CPU 密集的工作从事件循环里挪出去
+
+- run_cpu:      CPU 密集任务 (解析 Excel、合并上传) -> 有界进程池 (AI 生成的代码见 sandbox.py)
+- run_blocking: 普通阻塞调用 (小文件 IO、读缓存) -> 有界线程池 (不占用 FastAPI 默认线程池)
+- llm_slot:     同时在途的 LLM 请求数上限
+
+所有上限都可以通过环境变量调整。
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from anyio import CapacityLimiter, to_thread
+
+# ================= 配置区 =================
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+BLOCKING_THREADS = int(os.getenv("BLOCKING_THREADS", "16"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# =========================================
+
+_process_pool = None
+_thread_limiter = None
+_llm_semaphore = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn 而不是 fork：API 进程里有锁和线程，fork 出来的子进程可能继承到被占用的锁
+        _process_pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+async def run_cpu(func, *args, **kwargs):
+    """在进程池中执行 (func 必须是模块级函数，参数和返回值要能 pickle)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在有界线程池中执行阻塞调用"""
+    global _thread_limiter
+    if _thread_limiter is None:
+        _thread_limiter = CapacityLimiter(BLOCKING_THREADS)
+    return await to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_thread_limiter)
+
+
+def llm_slot() -> asyncio.Semaphore:
+    """async with llm_slot(): ... 限制同时在途的 LLM 请求数"""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+
+def shutdown():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -1,12 +1,29 @@
 # backend/formula_service.py
 import openpyxl
 from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
 import os
 import uuid
 import pandas as pd
+import time
 import excel_ops
+from df_cache import load_dataframe, load_columns
+from frame_handoff import attach
+from columnar_store import write_sidecar
+from vector_engine import evaluate_column
+from xlsx_stream import read_sheet_layout, patch_sheet, StreamUnsupported
+
+def apply_formula_to_file(file_path: str, ai_result: dict, exec_report: dict = None, frame: dict = None,
+                          sheet: str = None):
+    """
+    :param exec_report: 可选，传入一个字典用于回填执行信息 (走了哪条计算路径、耗时等)
+    :param frame: 可选，API 进程发布的共享内存句柄 (frame_handoff)，有则直接挂载，不再读文件
+    :param sheet: 要处理的工作表名，None 为第一个
+      (结构修改只输出这一个工作表，结果在新文件的第一个工作表；数值计算保留其他工作表，结果仍在原工作表)
+    """
+    if exec_report is None:
+        exec_report = {}
 
-def apply_formula_to_file(file_path: str, ai_result: dict):
     # 1. 基础文件准备
     dir_name = os.path.dirname(file_path)
     _, ext = os.path.splitext(os.path.basename(file_path))
@@ -15,21 +32,22 @@ def apply_formula_to_file(file_path: str, ai_result: dict):
 
     # 2. 读取数据
     try:
-        df = pd.read_excel(file_path)
+        df = attach(frame) if frame is not None else load_dataframe(file_path, sheet=sheet)
     except Exception as e:
         raise Exception(f"无法读取 Excel 文件: {e}")
 
+    action_type = ai_result.get('action_type', 'formula')
+    py_expr = ai_result.get('python_expression', '')
+
     # 3. 准备 Python 执行沙箱
     safe_env = {
         "excel_ops": excel_ops,
         "df": df,
         "pd": pd,
-        "rows": df.to_dict('records'),
+        # 大表转 records 本身就很贵，表达式用不到 rows 时就不构造
+        "rows": df.to_dict('records') if 'rows' in py_expr else [],
         "row": None
     }
-
-    action_type = ai_result.get('action_type', 'formula')
-    py_expr = ai_result.get('python_expression', '')
     mode = ai_result.get('mode', 'column')
     # AI 可能返回 "性别" (列名) 也可能返回 "B" (列字母)
     target_pos = str(ai_result.get('target_position', 'AI计算结果')).strip()
@@ -49,19 +67,19 @@ def apply_formula_to_file(file_path: str, ai_result: dict):
                 raise Exception(f"结构修改代码执行失败: {e}")
             new_df = safe_env.get('df')
             if new_df is None: raise ValueError("DataFrame 丢失")
-            new_df.to_excel(new_file_path, index=False)
+            # 只输出处理过的这一个工作表 (不为了保留其他工作表去解析整本工作簿)
+            new_df.to_excel(new_file_path, index=False, sheet_name=sheet or "Sheet1")
+            write_sidecar(new_df, new_file_path)
             return new_file_path, safe_name
 
         # ==========================================
         # 🔵 分支 B: 值计算模式 (Value Calculation Mode)
         # ==========================================
         else:
-            wb = openpyxl.load_workbook(file_path)
-            ws = wb.active
+            calculated_values, final_value = None, None
 
             if mode == 'column':
-                # --- 1. Python 计算逻辑 (保持不变) ---
-                calculated_values = []
+                # --- 1. Python 计算逻辑 ---
                 def calc_single_row(current_row):
                     safe_env['row'] = current_row
                     try:
@@ -70,66 +88,21 @@ def apply_formula_to_file(file_path: str, ai_result: dict):
                         return f"Error: {str(e)}"
 
                 print("⏳ 正在进行 Python 内存计算...")
-                series_result = df.apply(calc_single_row, axis=1)
+                start = time.perf_counter()
+                try:
+                    # 优先整列向量化计算，一次算完所有行
+                    series_result = evaluate_column(py_expr, df, {**globals(), **safe_env})
+                    exec_report["engine"] = "vectorized"
+                except Exception as e:
+                    # 兜底：逐行 eval (结果与原逻辑完全一致)；向量化路径的任何异常都不应让整个请求失败
+                    print(f"↩️ 无法向量化 ({e})，回退到逐行计算")
+                    series_result = df.apply(calc_single_row, axis=1)
+                    exec_report["engine"] = "row"
+                    exec_report["fallback_reason"] = str(e)
                 calculated_values = series_result.tolist()
-
-                # --- 2. 智能定位逻辑 (🔥 核心逻辑升级 🔥) ---
-                print(f"💾 正在定位目标列 '{target_pos}'...")
-                target_col_idx = None
-
-                # 📌 策略 A: 优先匹配现有的【表头名称】
-                # (解决：用户说“写入年龄列”，直接覆盖原“年龄”列)
-                for cell in ws[1]:
-                    # 强转 string 比较，忽略空格
-                    if str(cell.value).strip() == target_pos:
-                        target_col_idx = cell.column
-                        print(f"✅ 按表头名匹配成功: '{target_pos}' -> 第 {target_col_idx} 列")
-                        break
-
-                # 📌 策略 B: 如果没找到表头，尝试解析为【Excel 列字母】(如 "G", "AA")
-                # (解决：用户说“写入 G 列”，即使 G 列目前是空的，也要定位到第 7 列)
-                if target_col_idx is None:
-                    # 只有当它是纯字母，且长度合理(<=3)时才认为是列标 (避免把 "Total" 误判为 T列)
-                    if target_pos.isalpha() and len(target_pos) <= 3:
-                        try:
-                            # 强制转换为大写并获取索引 (例如 "G" -> 7)
-                            potential_idx = column_index_from_string(target_pos.upper())
-
-                            # 🔥 核心修改：只要是合法的正整数列号，就直接采纳！
-                            # 不再检查 <= ws.max_column，允许跳跃写入。
-                            if potential_idx > 0:
-                                target_col_idx = potential_idx
-                                print(f"📍 按列坐标定位: '{target_pos}' -> 第 {target_col_idx} 列")
-
-                                # 💡 细节优化：如果这一列还没有表头，把 target_pos 填进去
-                                # 比如跳到 G 列，G1 是空的，就填入 "G"
-                                header_cell = ws.cell(row=1, column=target_col_idx)
-                                if not header_cell.value:
-                                    header_cell.value = target_pos
-                                    print(f"📝 自动补充表头: {target_pos}")
-                        except:
-                            pass # 转换失败（说明不是列字母），继续往下走
-
-                # 📌 策略 C: 既不是现有表头，也不是列字母，说明是【完全的新列名】
-                # (解决：用户说“写入新列[预测值]”，则追加到最后)
-                if target_col_idx is None:
-                    target_col_idx = ws.max_column + 1
-                    ws.cell(row=1, column=target_col_idx, value=target_pos) # 写表头
-                    print(f"🆕 目标是新字段，追加到末尾: '{target_pos}' -> 第 {target_col_idx} 列")
-
-                # --- 3. 写入数据 ---
-                for i, val in enumerate(calculated_values):
-                    # i 从 0 开始，Excel 数据从第 2 行开始
-                    excel_row = i + 2
-
-                    # 即使跳到了第 7 列，行号依然受 max_row 限制 (不要写到无限行)
-                    if excel_row <= ws.max_row:
-                        cell = ws.cell(row=excel_row, column=target_col_idx)
-                        try:
-                            if hasattr(val, 'item'): val = val.item()
-                            cell.value = val
-                        except:
-                            cell.value = str(val)
+                exec_report["rows"] = len(calculated_values)
+                exec_report["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                print(f"✅ 计算完成 ({exec_report['engine']}): {exec_report['elapsed_ms']} ms")
 
             # 单元格模式 (保持不变)
             elif mode == 'cell':
@@ -138,12 +111,19 @@ def apply_formula_to_file(file_path: str, ai_result: dict):
                 except Exception as e:
                     raise Exception(f"聚合计算失败: {e}")
 
-                if target_pos:
-                    ws[target_pos] = final_value
-                else:
-                    print("⚠️ 未指定 target_position")
+            # --- 2. 写入文件：优先流式改写 sheet XML，不支持时回退 openpyxl 整本加载 ---
+            try:
+                _write_values_streaming(file_path, new_file_path, mode, target_pos, calculated_values, final_value,
+                                        sheet)
+                exec_report["writer"] = "stream"
+            except StreamUnsupported as e:
+                print(f"↩️ 无法流式写入 ({e})，回退到 openpyxl")
+                if os.path.exists(new_file_path):
+                    os.remove(new_file_path)
+                _write_values_openpyxl(file_path, new_file_path, mode, target_pos, calculated_values, final_value,
+                                       sheet)
+                exec_report["writer"] = "openpyxl"
 
-            wb.save(new_file_path)
             print(f"✅ 处理完成: {safe_name}")
             return new_file_path, safe_name
 
@@ -151,31 +131,150 @@ def apply_formula_to_file(file_path: str, ai_result: dict):
         print(f"❌ 严重错误: {e}")
         raise e
 
+def apply_formula_with_report(file_path: str, ai_result: dict, frame: dict = None, sheet: str = None):
+    """
+    进程池入口：子进程里回填的 exec_report 传不回调用方，改为随返回值一起带回
+    :return: (新文件路径, 新文件名, exec_report)
+    """
+    exec_report = {}
+    new_file_path, safe_name = apply_formula_to_file(file_path, ai_result, exec_report, frame=frame, sheet=sheet)
+    return new_file_path, safe_name, exec_report
+
+def _locate_target_column(target_pos: str, header: dict, max_column: int):
+    """
+    智能定位目标列 (🔥 核心逻辑 🔥)
+    :param header: {列号: 表头值}
+    :return: (列号, 需要写入的表头值 或 None)
+    """
+    print(f"💾 正在定位目标列 '{target_pos}'...")
+
+    # 📌 策略 A: 优先匹配现有的【表头名称】
+    # (解决：用户说“写入年龄列”，直接覆盖原“年龄”列)
+    for col_idx in sorted(header):
+        # 强转 string 比较，忽略空格
+        if str(header[col_idx]).strip() == target_pos:
+            print(f"✅ 按表头名匹配成功: '{target_pos}' -> 第 {col_idx} 列")
+            return col_idx, None
+
+    # 📌 策略 B: 如果没找到表头，尝试解析为【Excel 列字母】(如 "G", "AA")
+    # (解决：用户说“写入 G 列”，即使 G 列目前是空的，也要定位到第 7 列)
+    # 只有当它是纯字母，且长度合理(<=3)时才认为是列标 (避免把 "Total" 误判为 T列)
+    if target_pos.isalpha() and len(target_pos) <= 3:
+        try:
+            # 强制转换为大写并获取索引 (例如 "G" -> 7)
+            potential_idx = column_index_from_string(target_pos.upper())
+
+            # 🔥 只要是合法的正整数列号，就直接采纳！允许跳跃写入。
+            if potential_idx > 0:
+                print(f"📍 按列坐标定位: '{target_pos}' -> 第 {potential_idx} 列")
+
+                # 💡 细节优化：如果这一列还没有表头，把 target_pos 填进去
+                # 比如跳到 G 列，G1 是空的，就填入 "G"
+                if not header.get(potential_idx):
+                    print(f"📝 自动补充表头: {target_pos}")
+                    return potential_idx, target_pos
+                return potential_idx, None
+        except:
+            pass # 转换失败（说明不是列字母），继续往下走
+
+    # 📌 策略 C: 既不是现有表头，也不是列字母，说明是【完全的新列名】
+    # (解决：用户说“写入新列[预测值]”，则追加到最后)
+    target_col_idx = max_column + 1
+    print(f"🆕 目标是新字段，追加到末尾: '{target_pos}' -> 第 {target_col_idx} 列")
+    return target_col_idx, target_pos
+
+
+def _write_values_streaming(file_path, new_file_path, mode, target_pos, calculated_values, final_value, sheet=None):
+    """流式改写 sheet XML：内存占用与工作簿大小无关，未改动单元格的格式原样保留 (其他工作表原样复制)"""
+    layout = read_sheet_layout(file_path, sheet)
+    cells = {}
+    column = None
+
+    if mode == 'column':
+        col_idx, header_value = _locate_target_column(target_pos, layout["header"], layout["max_column"])
+        if header_value is not None:
+            cells[(1, col_idx)] = header_value
+        # 行号受原表 max_row 限制 (不要写到无限行)；i 从 0 开始，Excel 数据从第 2 行开始
+        row_limit = max(layout["max_row"] - 1, 0)
+        column = (col_idx, 2, calculated_values[:row_limit])
+
+    elif mode == 'cell':
+        if target_pos:
+            try:
+                letters, row_num = coordinate_from_string(target_pos)
+            except Exception:
+                raise StreamUnsupported(f"无法解析单元格坐标: {target_pos}")
+            cells[(row_num, column_index_from_string(letters))] = final_value
+        else:
+            print("⚠️ 未指定 target_position")
+
+    patch_sheet(file_path, new_file_path, column=column, cells=cells, layout=layout, sheet=sheet)
+
+
+def _write_values_openpyxl(file_path, new_file_path, mode, target_pos, calculated_values, final_value, sheet=None):
+    """兜底路径：整本加载工作簿后逐格写入"""
+    wb = openpyxl.load_workbook(file_path)
+    # 与 pd.read_excel 读取的工作表保持一致 (wb.active 是上次保存时选中的工作表，不一定是第一个)
+    ws = wb[sheet] if sheet is not None else wb.worksheets[0]
+
+    if mode == 'column':
+        header = {cell.column: cell.value for cell in ws[1]}
+        target_col_idx, header_value = _locate_target_column(target_pos, header, ws.max_column)
+        if header_value is not None:
+            ws.cell(row=1, column=target_col_idx, value=header_value) # 写表头
+
+        # --- 写入数据 ---
+        for i, val in enumerate(calculated_values):
+            # i 从 0 开始，Excel 数据从第 2 行开始
+            excel_row = i + 2
+
+            # 即使跳到了第 7 列，行号依然受 max_row 限制 (不要写到无限行)
+            if excel_row <= ws.max_row:
+                cell = ws.cell(row=excel_row, column=target_col_idx)
+                try:
+                    if hasattr(val, 'item'): val = val.item()
+                    cell.value = val
+                except:
+                    cell.value = str(val)
+
+    elif mode == 'cell':
+        if target_pos:
+            ws[target_pos] = final_value
+        else:
+            print("⚠️ 未指定 target_position")
+
+    wb.save(new_file_path)
+
+
 # formula_service.py (追加)
 
-def apply_multi_file_operation(file_map: dict, py_code: str):
+def apply_multi_file_operation(file_map: dict, py_code: str, output_path: str = None, frames: dict = None,
+                               columns: dict = None, sheets: dict = None):
     """
-    执行多表关联操作
+    执行多表关联操作 (模块级函数，API 接口会把它放进进程池执行)
     :param file_map: { "文件名": "物理路径" }
     :param py_code: AI 生成的 Python 代码
+    :param output_path: 结果保存位置，不传则放到第一个文件所在目录
+    :param frames: 可选，{ "文件名": 共享内存句柄 } (frame_handoff)，有句柄的文件直接挂载，不再读文件
+    :param columns: 可选，{ "文件名": 列名列表 } (code_columns.plan_columns)，没有句柄的文件只加载这些列
+    :param sheets: 可选，{ "文件名": 工作表名 }，没有的读第一个工作表 (key 形如 "文件名/工作表名")
+    :return: (结果路径, 结果文件名, 结果行数)
     """
-    import pandas as pd
-    import uuid
-    import os
-
     # 1. 准备环境：加载所有 DataFrame
     dfs = {}
     print("--- 🔄 正在加载多表上下文 ---")
-    try:
-        for fname, fpath in file_map.items():
-            # 简单起见，默认读第一个 Sheet
-            dfs[fname] = pd.read_excel(fpath)
-            print(f"✅ 已加载: {fname} ({len(dfs[fname])} 行)")
-    except Exception as e:
-        raise Exception(f"加载文件失败: {fname} -> {e}")
+    for fname, fpath in file_map.items():
+        try:
+            if frames and fname in frames:
+                dfs[fname] = attach(frames[fname])
+            else:
+                dfs[fname] = load_columns(fpath, (columns or {}).get(fname), sheet=(sheets or {}).get(fname))
+            print(f"✅ 已加载: {fname} ({len(dfs[fname])} 行, {len(dfs[fname].columns)} 列)")
+        except Exception as e:
+            raise Exception(f"加载文件失败: {fname} -> {e}")
 
-    # 2. 准备沙箱
-    safe_env = {
+    # 2. 准备沙箱 (同一个字典同时作为 globals，AI 代码里定义的函数才能互相引用)
+    exec_globals = {
         "pd": pd,
         "dfs": dfs,
         "result_df": None # 占位符
@@ -184,23 +283,25 @@ def apply_multi_file_operation(file_map: dict, py_code: str):
     # 3. 执行 AI 代码
     print(f"--- 🐍 执行多表代码 ---\n{py_code}")
     try:
-        exec(py_code, globals(), safe_env)
+        exec(py_code, exec_globals)
     except Exception as e:
         raise Exception(f"代码执行错误: {e}")
 
     # 4. 获取结果
-    final_df = safe_env.get('result_df')
+    final_df = exec_globals.get('result_df')
     if final_df is None or not isinstance(final_df, pd.DataFrame):
-        raise Exception("代码执行完毕，但 `result_df` 变量为空或不是 DataFrame")
+        raise Exception("代码执行完毕，但 `result_df` 为空。请确保 AI 代码将结果赋值给了 `result_df`。")
 
     # 5. 保存结果到新文件
-    # 取第一个文件的目录作为输出目录
-    first_path = list(file_map.values())[0]
-    dir_name = os.path.dirname(first_path)
-    safe_name = f"multi_result_{uuid.uuid4().hex[:8]}.xlsx"
-    output_path = os.path.join(dir_name, safe_name)
+    if output_path is None:
+        # 取第一个文件的目录作为输出目录
+        first_path = list(file_map.values())[0]
+        output_path = os.path.join(os.path.dirname(first_path), f"multi_result_{uuid.uuid4().hex[:8]}.xlsx")
+    safe_name = os.path.basename(output_path)
 
+    # 保存 Excel (下载用) + 列式旁路文件 (后续读取用)
     final_df.to_excel(output_path, index=False)
+    write_sidecar(final_df, output_path)
     print(f"✅ 多表处理完成，已保存至: {output_path}")
 
-    return output_path, safe_name
\ No newline at end of file
+    return output_path, safe_name, len(final_df)
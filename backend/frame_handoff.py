@@ -0,0 +1,267 @@
+# backend/frame_handoff.py
+"""
+API 进程与沙箱进程之间的 DataFrame 零拷贝交接
+
+沙箱进程执行 AI 代码时需要拿到 DataFrame。直接当参数传要整表 pickle + 走管道，几百 MB 的表光传输就要好几秒；
+让每个沙箱进程自己读文件，又会在每个进程的缓存里各存一份。这里改成：
+
+- API 进程把 (已经在 df_cache 里的) DataFrame 用 pickle 协议 5 序列化，数值列的数据块作为带外缓冲区
+  按 64 字节对齐写进共享内存目录 (/dev/shm，没有时用临时目录) 下的一个文件
+- 沙箱进程拿到的只是一个很小的句柄 (路径 + 偏移表)，用写时复制 (ACCESS_COPY) 的方式 mmap 这个文件，
+  数值列直接引用映射的内存，不拷贝；AI 代码改动数据时内核只复制被改的页，不会影响其他进程
+- 同一个文件 (路径 + mtime + size 相同) 只发布一份，按引用计数管理，最后一个使用者 release 后删除
+
+典型用法 (API 进程)：
+    handles = await run_blocking(share_files, file_map)
+    try:
+        await run_sandboxed(func, ..., frames=handles)
+    finally:
+        release_all(handles)
+
+基准测试：python frame_handoff.py
+"""
+import mmap
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from df_cache import load_dataframe, load_columns
+
+# ================= 配置区 =================
+HANDOFF_DIR = os.getenv("HANDOFF_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "excel_handoff"
+)
+HANDOFF_STALE_SECONDS = int(os.getenv("HANDOFF_STALE_SECONDS", str(24 * 3600)))  # 异常退出遗留文件的清理阈值
+# =========================================
+
+ALIGN = 64  # 数据块按 64 字节对齐，numpy 向量化运算更快
+
+_lock = threading.Lock()
+_published = {}  # key -> {"handle": ..., "refs": 引用数}
+_stats = {"published": 0, "reused": 0, "released": 0, "bytes": 0}
+
+
+# ================= 写入 / 挂载 =================
+
+def _write_frame(df: pd.DataFrame) -> dict:
+    """序列化到共享内存目录，返回句柄 (普通 dict，可以 pickle)"""
+    buffers = []
+    payload = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+
+    os.makedirs(HANDOFF_DIR, exist_ok=True)
+    path = os.path.join(HANDOFF_DIR, f"{os.getpid()}_{uuid.uuid4().hex}.frame")
+    layout = []
+    with open(path, "wb") as f:
+        f.write(payload)
+        offset = len(payload)
+        for buf in buffers:
+            raw = buf.raw()
+            pad = (-offset) % ALIGN
+            f.write(b"\0" * pad)
+            offset += pad
+            f.write(raw)
+            layout.append((offset, raw.nbytes))
+            offset += raw.nbytes
+
+    return {"path": path, "payload_size": len(payload), "buffers": layout, "rows": len(df), "nbytes": offset}
+
+
+def attach(handle: dict) -> pd.DataFrame:
+    """
+    (沙箱进程中调用) 按句柄挂载 DataFrame
+    写时复制映射：数值列零拷贝，修改只影响当前进程
+    """
+    with open(handle["path"], "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mm)
+    buffers = [view[offset: offset + size] for offset, size in handle["buffers"]]
+    return pickle.loads(view[:handle["payload_size"]], buffers=buffers)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # Windows 下仍被映射的文件删不掉，留给 cleanup 处理
+        print(f"⚠️ 共享内存文件删除失败: {e}")
+
+
+# ================= 发布 / 引用计数 =================
+
+def share_frame(df: pd.DataFrame, key=None) -> dict:
+    """
+    发布一个 DataFrame，返回句柄；同一个 key 已发布时直接复用 (引用数 +1)
+    每次 share_* 都要对应一次 release
+    """
+    if key is not None:
+        with _lock:
+            entry = _published.get(key)
+            if entry is not None:
+                entry["refs"] += 1
+                _stats["reused"] += 1
+                return entry["handle"]
+
+    handle = _write_frame(df)
+    with _lock:
+        entry = _published.get(key) if key is not None else None
+        if entry is not None:
+            # 并发发布了同一个文件，用先到的那份
+            entry["refs"] += 1
+            _stats["reused"] += 1
+            _remove(handle["path"])
+            return entry["handle"]
+        handle["key"] = key if key is not None else handle["path"]
+        _published[handle["key"]] = {"handle": handle, "refs": 1}
+        _stats["published"] += 1
+        _stats["bytes"] += handle["nbytes"]
+    return handle
+
+
+def share_file(file_path: str, columns: list = None, sheet: str = None) -> dict:
+    """
+    发布某个表格文件的 DataFrame (走 df_cache，文件被改写后自动发布新版本)
+    :param columns: 只发布这些列 (多表代码列裁剪后的结果)，None 为整表
+    :param sheet: 工作表名，None 为第一个
+    """
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, sheet,
+           tuple(columns) if columns is not None else None)
+    with _lock:
+        entry = _published.get(key)
+        if entry is not None:
+            entry["refs"] += 1
+            _stats["reused"] += 1
+            return entry["handle"]
+    if columns is None:
+        df = load_dataframe(file_path, copy=False, sheet=sheet)
+    else:
+        df = load_columns(file_path, columns, sheet=sheet)
+    return share_frame(df, key)
+
+
+def share_files(file_map: dict, columns: dict = None, sheets: dict = None) -> dict:
+    """
+    {名称: 文件路径} -> {名称: 句柄}
+    columns 为 {名称: 列名列表 或 None}；sheets 为 {名称: 工作表名 或 None}
+    """
+    handles = {}
+    try:
+        for name, path in file_map.items():
+            handles[name] = share_file(path, (columns or {}).get(name), (sheets or {}).get(name))
+    except Exception:
+        release_all(handles)
+        raise
+    return handles
+
+
+def release(handle: dict):
+    with _lock:
+        entry = _published.get(handle["key"])
+        if entry is None:
+            return
+        entry["refs"] -= 1
+        if entry["refs"] > 0:
+            return
+        del _published[handle["key"]]
+        _stats["released"] += 1
+        _stats["bytes"] -= handle["nbytes"]
+    _remove(handle["path"])
+
+
+def release_all(handles: dict):
+    for handle in handles.values():
+        release(handle)
+
+
+def cleanup():
+    """删除本进程发布的全部文件，以及异常退出遗留的过期文件 (启动 / 关闭时调用)"""
+    with _lock:
+        entries = list(_published.values())
+        _published.clear()
+        _stats["bytes"] = 0
+    for entry in entries:
+        _remove(entry["handle"]["path"])
+
+    if not os.path.isdir(HANDOFF_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(HANDOFF_DIR):
+        path = os.path.join(HANDOFF_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > HANDOFF_STALE_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def handoff_stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "active": len(_published),
+            "memory_mb": round(_stats["bytes"] / 1024 / 1024, 2),
+            "dir": HANDOFF_DIR,
+        }
+
+
+# ================= 基准测试 =================
+
+def _probe(df: pd.DataFrame):
+    """子进程里摸一下数据，确认真的拿到了"""
+    return len(df), float(df["v0"].sum())
+
+
+def _probe_handle(handle: dict):
+    return _probe(attach(handle))
+
+
+if __name__ == "__main__":
+    # 对比：DataFrame 直接作为参数传给进程池 (pickle + 管道) vs 共享内存句柄
+    import multiprocessing
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    rows = int(os.getenv("BENCH_ROWS", "2000000"))
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({f"v{i}": rng.random(rows) for i in range(8)})
+    frame["数量"] = rng.integers(0, 1000, rows)
+    frame["部门"] = pd.Categorical(rng.choice(["销售", "财务", "研发", "行政"], rows))
+    size_mb = frame.memory_usage(deep=True).sum() / 1024 / 1024
+    print(f"DataFrame: {rows} 行, {size_mb:.1f} MB")
+
+    def run_shared(pool):
+        # 计入发布 (写共享内存) 的开销；实际使用时同一个文件多次执行只发布一次
+        handle = share_frame(frame)
+        try:
+            return pool.submit(_probe_handle, handle).result()
+        finally:
+            release(handle)
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pool.submit(_probe, frame.head(1)).result()  # 预热子进程
+
+        for label, run in [
+            ("pickle 传参", lambda: pool.submit(_probe, frame).result()),
+            ("共享内存句柄", lambda: run_shared(pool)),
+        ]:
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                result = run()
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{label:8s} 最快 {min(timings):8.1f} ms  (结果 {result[0]} 行)")
+
+        handle = share_frame(frame)
+        start = time.perf_counter()
+        pool.submit(_probe_handle, handle).result()
+        print(f"{'仅挂载':8s}      {(time.perf_counter() - start) * 1000:8.1f} ms  (已发布的文件再次执行)")
+        release(handle)
+
+    cleanup()
@@ -0,0 +1,168 @@
+# backend/job_service.py
+"""
+进程内后台任务队列
+
+多表分析 / 公式生成要等两轮 AI + 整表处理，动辄几十秒，HTTP 请求一直挂着很容易超时。
+这里把它们包装成任务：提交后立即返回 job_id，前端轮询 GET /api/jobs/{id} 查看进度。
+
+- 任务跑在当前事件循环上，同时运行的任务数受 JOB_MAX_CONCURRENCY 限制 (其余排队)
+- 真正的重活 (解析 / exec) 仍然在 executors 的进程池里，这里只做编排
+- 任务状态写入 job_records 表，服务重启后仍可查询历史任务 (写库在线程池里进行，不阻塞事件循环)
+- 任务函数返回 {"success": False, "msg": ...} (业务失败) 时，任务记为 failed，msg 作为错误信息
+- 取消：排队中的任务直接出队；运行中的任务在当前等待点 (AI 请求、沙箱执行) 中止，
+  沙箱里正在执行的 AI 代码所在进程会被立即杀掉 (sandbox.run_sandboxed)；
+  线程池里的短步骤 (读表、发布共享内存) 和进程池里的解析无法中途打断，会跑完但结果被丢弃
+"""
+import asyncio
+import os
+import traceback
+import uuid
+from datetime import datetime, timezone
+
+from database import SessionLocal
+from executors import run_blocking
+from models import JobRecord
+
+# ================= 配置区 =================
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "4"))
+# =========================================
+
+# 各阶段对应的进度百分比
+STAGES = {
+    "queued": 0,
+    "load": 10,
+    "llm": 30,
+    "execute": 60,
+    "save": 80,
+    "preview": 90,
+    "done": 100,
+}
+
+_tasks = {}  # job_id -> asyncio.Task (只有本进程里还没结束的任务)
+_slots = None
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _update(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(JobRecord).filter(JobRecord.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _update_async(job_id: str, **fields):
+    await run_blocking(_update, job_id, **fields)
+
+
+class JobContext:
+    """传给任务函数，用来汇报当前阶段"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    async def stage(self, name: str):
+        print(f"📌 任务 {self.job_id[:8]} -> {name}")
+        await _update_async(self.job_id, stage=name, progress=STAGES.get(name, 0))
+
+
+async def report_stage(job, name: str):
+    """同步接口调用 (job=None) 时什么都不做，业务代码不用区分两种调用方式"""
+    if job is not None:
+        await job.stage(name)
+
+
+def _insert_job(job_id: str, kind: str, payload: dict):
+    db = SessionLocal()
+    try:
+        db.add(JobRecord(id=job_id, kind=kind, status="queued", stage="queued", progress=0, payload=payload))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def submit_job(kind: str, payload: dict, runner) -> str:
+    """
+    提交任务
+    :param runner: async def runner(job: JobContext) -> dict，返回值会作为任务结果保存
+    :return: job_id
+    """
+    job_id = uuid.uuid4().hex
+    await run_blocking(_insert_job, job_id, kind, payload)
+
+    _tasks[job_id] = asyncio.get_running_loop().create_task(_run(job_id, runner))
+    print(f"📥 任务已提交: {kind} ({job_id[:8]})")
+    return job_id
+
+
+async def _run(job_id: str, runner):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(JOB_MAX_CONCURRENCY)
+
+    try:
+        async with _slots:
+            await _update_async(job_id, status="running", started_at=_now())
+            result = await runner(JobContext(job_id))
+        if isinstance(result, dict) and result.get("success") is False:
+            # 业务失败按约定返回 success=False 而不是抛异常，任务同样记为失败
+            await _update_async(job_id, status="failed", result=result, error=result.get("msg") or "任务执行失败",
+                                finished_at=_now())
+        else:
+            await _update_async(job_id, status="succeeded", stage="done", progress=100, result=result,
+                                finished_at=_now())
+    except asyncio.CancelledError:
+        print(f"🛑 任务已取消: {job_id[:8]}")
+        # 任务本身已被取消，这里的写库不能再被取消打断，否则状态会停在 running
+        await asyncio.shield(_update_async(job_id, status="cancelled", finished_at=_now()))
+    except Exception as e:
+        traceback.print_exc()
+        # HTTPException 的说明在 detail 里
+        await _update_async(job_id, status="failed", error=str(getattr(e, "detail", None) or e), finished_at=_now())
+    finally:
+        _tasks.pop(job_id, None)
+
+
+def cancel_job(job_id: str) -> bool:
+    """取消本进程中尚未结束的任务；任务不存在或已结束时返回 False"""
+    task = _tasks.get(job_id)
+    if task is None or task.done():
+        return False
+    task.cancel()
+    return True
+
+
+def get_job(db, job_id: str):
+    job = db.query(JobRecord).filter(JobRecord.id == job_id).first()
+    if job is None:
+        return None
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.strftime("%Y-%m-%d %H:%M:%S") if job.created_at else "",
+        "finished_at": job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else "",
+    }
+
+
+def mark_interrupted_jobs():
+    """启动时调用：上次进程退出时还没跑完的任务不会再继续，标记为失败"""
+    db = SessionLocal()
+    try:
+        count = db.query(JobRecord) \
+            .filter(JobRecord.status.in_(["queued", "running"])) \
+            .update({"status": "failed", "error": "服务重启，任务已中断", "finished_at": _now()},
+                    synchronize_session=False)
+        db.commit()
+        if count:
+            print(f"⚠️ {count} 个未完成的任务已标记为中断")
+    finally:
+        db.close()
@@ -0,0 +1,139 @@
+# backend/llm_cache.py
+"""
+LLM 响应缓存 (SQLite)
+
+同样的表结构 + 同样的需求 (公式模板库里非常常见) 每次都要重新请求 DeepSeek，
+又慢又花钱。这里按请求内容寻址缓存模型回复：
+- key = sha256(system prompt, user prompt, model, temperature)
+- 存在本地 SQLite 文件里，服务重启后依然有效
+- 过期时间 LLM_CACHE_TTL 秒；条目数超过 LLM_CACHE_MAX_ENTRIES 时按最近访问时间淘汰
+- 只缓存成功的回复
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# ================= 配置区 =================
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+# =========================================
+
+_lock = threading.Lock()
+_initialized = False
+# 本进程的命中统计 (条目级的累计命中数存在表里)
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=10)
+    if not _initialized:
+        # WAL：读写互不阻塞，多个进程同时用也安全
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+def make_key(system_prompt: str, user_content: str, model: str, temperature: float) -> str:
+    raw = json.dumps([system_prompt, user_content, model, temperature], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """命中返回缓存的回复，未命中 / 已过期返回 None"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > LLM_CACHE_TTL:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                _stats["misses"] += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            conn.commit()
+            _stats["hits"] += 1
+            return row[0]
+        finally:
+            conn.close()
+
+
+def put(key: str, response: str):
+    if not LLM_CACHE_ENABLED:
+        return
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_access, hits) VALUES (?, ?, ?, ?, 0)",
+                (key, response, now, now),
+            )
+            _stats["writes"] += 1
+
+            # 顺手清理过期条目，再按最近访问时间淘汰超出上限的部分
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > LLM_CACHE_MAX_ENTRIES:
+                excess = count - LLM_CACHE_MAX_ENTRIES
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                    (excess,),
+                )
+                _stats["evictions"] += excess
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        try:
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def cache_stats() -> dict:
+    """命中率等统计，供 /api/cache/stats 展示"""
+    total = _stats["hits"] + _stats["misses"]
+    stats = {
+        **_stats,
+        "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+        "enabled": LLM_CACHE_ENABLED,
+        "ttl_seconds": LLM_CACHE_TTL,
+        "max_entries": LLM_CACHE_MAX_ENTRIES,
+    }
+    if LLM_CACHE_ENABLED:
+        with _lock:
+            conn = _connect()
+            try:
+                entries, total_hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM llm_cache").fetchone()
+            finally:
+                conn.close()
+        stats["entries"] = entries
+        stats["lifetime_hits"] = total_hits  # 跨重启累计
+    return stats
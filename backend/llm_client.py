@@ -0,0 +1,327 @@
+# backend/llm_client.py
+"""
+DeepSeek 调用封装
+
+- call_deepseek_raw:   同步版本 (批量处理等后台逻辑使用)
+- call_deepseek_async: 异步版本 (API 接口使用，等待模型返回时不占用事件循环)
+- stream_deepseek / stream_deepseek_async: 流式版本，逐段返回模型输出
+
+以上调用都会先查 llm_cache，相同的请求直接返回缓存的回复。
+
+连接层：
+- 进程内共用一个连接池 (keep-alive)，不再每次请求都重新握手
+- 连接超时 / 读取超时分开配置，卡死的连接不会永远占着 worker
+- 429 / 5xx / 网络错误自动重试，指数退避 + 随机抖动 (优先遵守 Retry-After)
+- 同时在途的请求数受 LLM_MAX_CONCURRENCY 限制 (同步、异步各自计数)
+"""
+import asyncio
+import os
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+import llm_cache
+from executors import llm_slot, run_blocking, LLM_MAX_CONCURRENCY
+
+try:
+    import httpx
+except ImportError:  # 没装 httpx 时，异步版本退化为在线程池里跑同步请求
+    httpx = None
+
+# ================= 配置区 =================
+# 请确保 API_KEY 正确且有余额
+load_dotenv()
+API_KEY = os.getenv("key")
+API_URL = os.getenv("LLM_API_URL", "https://api.deepseek.com/chat/completions")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # 秒
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_MODEL = "deepseek-chat"
+LLM_TEMPERATURE = 0.1 # 低温度保证逻辑严谨
+# =========================================
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_client = None
+
+
+class LLMError(Exception):
+    """DeepSeek 返回了错误 (重试后仍失败)"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _build_request(system_prompt, user_content, stream=False):
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {API_KEY}"
+    }
+
+    payload = {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ],
+        "stream": stream,
+        "temperature": LLM_TEMPERATURE
+    }
+    return headers, json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def _cache_key(system_prompt, user_content):
+    return llm_cache.make_key(system_prompt, user_content, LLM_MODEL, LLM_TEMPERATURE)
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """第 attempt 次重试前等待的秒数：有 Retry-After 就听服务端的，否则指数退避 + 全抖动"""
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _parse_content(data: dict) -> str:
+    return data['choices'][0]['message']['content']
+
+
+def _parse_sse_line(line):
+    """
+    解析一行 SSE：data: {...} 每行一段增量，data: [DONE] 结束
+    :return: (是否结束, 增量文本 或 None)
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    if not line.startswith("data:"):
+        return False, None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return True, None
+    return False, json.loads(data)['choices'][0].get('delta', {}).get('content') or None
+
+
+def _cache_stream_reply(key, parts, finished):
+    """流式回复只有正常收到 [DONE] 且内容非空时才缓存，否则空回复 / 半截回复会在整个 TTL 内被反复返回"""
+    content = "".join(parts)
+    if finished and content:
+        llm_cache.put(key, content)
+
+
+# ================= 同步版本 =================
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # 与原来的 proxies=None 保持一致，不走系统代理
+                session.trust_env = False
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_CONCURRENCY)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _post_with_retry(headers, body, stream=False) -> requests.Response:
+    """发送请求，遇到可重试的错误按退避策略重试；返回状态码为 200 的响应"""
+    last_error = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            response = get_session().post(
+                API_URL,
+                headers=headers,
+                data=body,
+                timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+                stream=stream
+            )
+            if response.status_code == 200:
+                return response
+
+            response.encoding = 'utf-8'
+            last_error = LLMError(f"API Error ({response.status_code}): {response.text}", response.status_code)
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            if response.status_code not in RETRY_STATUS:
+                raise last_error
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = LLMError(f"网络错误: {e}")
+
+        if attempt < LLM_MAX_RETRIES:
+            delay = _backoff_delay(attempt, retry_after)
+            print(f"🔁 LLM 请求失败，{delay:.2f} 秒后重试 ({attempt + 1}/{LLM_MAX_RETRIES}): {last_error}")
+            time.sleep(delay)
+    raise last_error
+
+
+def call_deepseek_raw(system_prompt, user_content, use_cache=True):
+    key = _cache_key(system_prompt, user_content)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            print("⚡ LLM 缓存命中")
+            return cached
+
+    headers, body = _build_request(system_prompt, user_content)
+
+    try:
+        with _sync_slots:
+            response = _post_with_retry(headers, body)
+        response.encoding = 'utf-8'
+        content = _parse_content(response.json())
+        llm_cache.put(key, content)
+        return content
+    except Exception as e:
+        print(f"Request Error: {repr(str(e))}")
+        raise e
+
+
+def stream_deepseek(system_prompt, user_content, use_cache=True):
+    """流式调用：逐段 yield 模型输出，结束后把完整回复写入缓存"""
+    key = _cache_key(system_prompt, user_content)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    headers, body = _build_request(system_prompt, user_content, stream=True)
+    parts = []
+    finished = False
+    with _sync_slots:
+        # 只有拿到响应头之前的错误会重试，开始输出后中断就直接抛出
+        response = _post_with_retry(headers, body, stream=True)
+        try:
+            for line in response.iter_lines():
+                done, delta = _parse_sse_line(line)
+                if done:
+                    finished = True
+                    break
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            response.close()
+    _cache_stream_reply(key, parts, finished)
+
+
+# ================= 异步版本 =================
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        # trust_env=False：与同步版本保持一致，不走系统代理
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY),
+            trust_env=False
+        )
+    return _async_client
+
+
+async def _send_with_retry_async(headers, body, stream=False):
+    """异步版 _post_with_retry；stream=True 时返回未读取正文的响应，调用方负责 aclose()"""
+    client = _get_async_client()
+    last_error = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            request = client.build_request("POST", API_URL, headers=headers, content=body)
+            response = await client.send(request, stream=stream)
+            if response.status_code == 200:
+                return response
+
+            await response.aread()
+            last_error = LLMError(f"API Error ({response.status_code}): {response.text}", response.status_code)
+            retry_after = response.headers.get("Retry-After")
+            await response.aclose()
+            if response.status_code not in RETRY_STATUS:
+                raise last_error
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            last_error = LLMError(f"网络错误: {e!r}")
+
+        if attempt < LLM_MAX_RETRIES:
+            delay = _backoff_delay(attempt, retry_after)
+            print(f"🔁 LLM 请求失败，{delay:.2f} 秒后重试 ({attempt + 1}/{LLM_MAX_RETRIES}): {last_error}")
+            await asyncio.sleep(delay)
+    raise last_error
+
+
+async def call_deepseek_async(system_prompt, user_content, use_cache=True):
+    """异步调用，受 LLM_MAX_CONCURRENCY 限制同时在途的请求数 (缓存命中时不占名额)"""
+    key = _cache_key(system_prompt, user_content)
+    if use_cache:
+        cached = await run_blocking(llm_cache.get, key)
+        if cached is not None:
+            print("⚡ LLM 缓存命中")
+            return cached
+
+    async with llm_slot():
+        if httpx is None:
+            return await run_blocking(call_deepseek_raw, system_prompt, user_content, use_cache=False)
+
+        headers, body = _build_request(system_prompt, user_content)
+        try:
+            response = await _send_with_retry_async(headers, body)
+            content = _parse_content(response.json())
+            await run_blocking(llm_cache.put, key, content)
+            return content
+        except Exception as e:
+            print(f"Request Error: {repr(str(e))}")
+            raise e
+
+
+async def stream_deepseek_async(system_prompt, user_content, use_cache=True):
+    """异步流式调用：async for delta in stream_deepseek_async(...)"""
+    key = _cache_key(system_prompt, user_content)
+    if use_cache:
+        cached = await run_blocking(llm_cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+
+    if httpx is None:
+        # 没有 httpx 时不流式，整段返回
+        yield await call_deepseek_async(system_prompt, user_content, use_cache=False)
+        return
+
+    headers, body = _build_request(system_prompt, user_content, stream=True)
+    parts = []
+    finished = False
+    async with llm_slot():
+        response = await _send_with_retry_async(headers, body, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                done, delta = _parse_sse_line(line)
+                if done:
+                    finished = True
+                    break
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            await response.aclose()
+    await run_blocking(_cache_stream_reply, key, parts, finished)
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
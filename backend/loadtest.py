@@ -0,0 +1,206 @@
+# backend/loadtest.py
+"""
+接口压测脚本：模拟多个用户同时上传 / 翻页预览 / Chat，输出各接口的 p50 / p95 / p99 延迟
+
+用法 (先启动后端)：
+    python loadtest.py --base-url http://127.0.0.1:8000 --users 40 --duration 30
+
+- 每个虚拟用户循环随机执行一个动作 (按 --mix 的权重)，直到压测时间结束
+- 预览 (/api/files/{id}/data) 本身很快，它的 p99 最能反映事件循环有没有被上传 / 模型等待卡住
+- 对比改动前后时，两个版本用同样的参数各跑一遍
+
+Chat 会真的调用模型。要稳定的模型延迟 (也不花钱) 时加 --mock-llm：脚本在本机起一个假的 DeepSeek 接口，
+后端需要以 LLM_API_URL=<脚本打印的地址> LLM_CACHE_ENABLED=0 启动 (关掉缓存，否则同样的问题会直接命中)。
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+try:
+    import httpx
+except ImportError:  # 压测脚本必须用 httpx 发并发请求
+    httpx = None
+
+# 假模型的固定回复：Chat 第一步要的是代码，结果是一个数，第二步 (如果有) 直接套模板
+MOCK_REPLY = "```python\nresult = len(df)\n```"
+
+
+# ================= 假模型接口 =================
+
+def start_mock_llm(port: int, delay: float) -> ThreadingHTTPServer:
+    """在后台线程里起一个兼容 DeepSeek 格式的接口，每次请求等 delay 秒再回复"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            time.sleep(delay)
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                chunk = {"choices": [{"delta": {"content": MOCK_REPLY}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                return
+            data = json.dumps({"choices": [{"message": {"content": MOCK_REPLY}}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ================= 压测 =================
+
+def make_workbook(rows: int) -> bytes:
+    df = pd.DataFrame({
+        "工号": range(rows),
+        "部门": [f"部门{i % 20}" for i in range(rows)],
+        "金额": [i * 1.5 for i in range(rows)],
+        "日期": pd.date_range("2024-01-01", periods=rows, freq="h"),
+    })
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+XLSX_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+async def _upload(client, payload: bytes, name: str):
+    resp = await client.post("/api/upload", files={"file": (name, payload, XLSX_TYPE)})
+    resp.raise_for_status()
+    return resp.json()["file_id"]
+
+
+async def _preview(client, file_id: int):
+    resp = await client.get(f"/api/files/{file_id}/data", params={"offset": random.randint(0, 500), "limit": 50})
+    resp.raise_for_status()
+
+
+async def _chat(client, file_id: int):
+    resp = await client.post("/api/chat", json={"file_id": file_id, "query": f"一共有多少行 #{random.random()}"})
+    resp.raise_for_status()
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+async def run_load(base_url: str, users: int, duration: float, mix: dict, rows: int, upload_rows: int) -> dict:
+    if httpx is None:
+        raise SystemExit("压测需要 httpx: pip install httpx")
+
+    limits = httpx.Limits(max_connections=users * 2, max_keepalive_connections=users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits, trust_env=False) as client:
+        file_id = await _upload(client, make_workbook(rows), "loadtest.xlsx")
+        # 先预览一次，让后端把这张表放进缓存 (压测的是并发下的排队，不是冷启动)
+        await _preview(client, file_id)
+        upload_payload = make_workbook(upload_rows)
+
+        latencies = {name: [] for name in mix}
+        errors = {name: 0 for name in mix}
+        names = list(mix)
+        weights = [mix[n] for n in names]
+        deadline = time.perf_counter() + duration
+
+        async def user(uid: int):
+            n = 0
+            while time.perf_counter() < deadline:
+                action = random.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    if action == "preview":
+                        await _preview(client, file_id)
+                    elif action == "chat":
+                        await _chat(client, file_id)
+                    elif action == "upload":
+                        # 上传按内容去重：在 zip 末尾追加几个字节让每次内容都不同 (不影响解析)，压的是完整的解析入库流程
+                        tag = f"#{uid}-{n}-{random.random()}".encode()
+                        await _upload(client, upload_payload + tag, f"u{uid}_{n}.xlsx")
+                    latencies[action].append((time.perf_counter() - start) * 1000)
+                except Exception as e:
+                    errors[action] += 1
+                    print(f"⚠️ {action} 失败: {e!r}")
+                n += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[user(i) for i in range(users)])
+        elapsed = time.perf_counter() - started
+
+    report = {"elapsed_s": round(elapsed, 1), "users": users, "endpoints": {}}
+    for name in names:
+        values = latencies[name]
+        report["endpoints"][name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "p99_ms": round(percentile(values, 99), 1),
+            "max_ms": round(max(values), 1) if values else float("nan"),
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n📊 {report['users']} 个并发用户，持续 {report['elapsed_s']} 秒")
+    print(f"{'接口':<10}{'请求数':>8}{'失败':>6}{'rps':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, s in report["endpoints"].items():
+        print(f"{name:<10}{s['count']:>8}{s['errors']:>6}{s['rps']:>8}"
+              f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后端接口压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=40, help="并发用户数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长 (秒)")
+    parser.add_argument("--mix", default="preview=7,chat=2,upload=1", help="各动作的权重")
+    parser.add_argument("--rows", type=int, default=20000, help="预览 / Chat 用的表格行数")
+    parser.add_argument("--upload-rows", type=int, default=20000, help="上传文件的行数")
+    parser.add_argument("--mock-llm", action="store_true", help="在本机起一个假的模型接口")
+    parser.add_argument("--mock-llm-port", type=int, default=8765)
+    parser.add_argument("--mock-llm-delay", type=float, default=1.0, help="假模型每次回复前等待的秒数")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    if args.mock_llm:
+        start_mock_llm(args.mock_llm_port, args.mock_llm_delay)
+        print(f"🤖 假模型接口: http://127.0.0.1:{args.mock_llm_port}/chat/completions (延迟 {args.mock_llm_delay}s)")
+        if args.duration <= 0:
+            # 只起假模型接口，供后端单独使用
+            threading.Event().wait()
+
+    result = asyncio.run(run_load(args.base_url, args.users, args.duration, _parse_mix(args.mix),
+                                  args.rows, args.upload_rows))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
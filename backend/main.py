@@ -1,27 +1,45 @@
 # backend/main.py
 import os
+import base64
+import json
 import shutil
+from datetime import datetime
 import uuid
 import pandas as pd
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import desc  # 🟢 必须添加这一行！
+from sqlalchemy import desc, select, func, and_, tuple_  # 🟢 必须添加这一行！
 from pydantic import BaseModel
-from typing import Union
-from fastapi.responses import FileResponse
+from typing import Union, Optional
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from urllib.parse import quote
-from typing import List
-from ai_service import get_multi_file_agent
-#from formula_service import apply_multi_file_operation
+from typing import List, Dict
+import asyncio
 
 # --- 本地模块引入 ---
-from database import engine, Base, get_db
+from database import engine, Base, get_db, SessionLocal
 # 🟢 变更1：引入 FormulaTemplate 模型
 from models import FileRecord, FormulaTemplate
-from formula_service import apply_formula_to_file
-# 确保 ai_service 中这两个函数都存在
-from ai_service import get_formula_suggestion, get_ai_analysis
+from formula_service import apply_formula_with_report, apply_multi_file_operation
+# 接口统一使用异步版本，等待 AI 返回时不占用事件循环
+from ai_service import get_formula_suggestion_async, get_ai_analysis_async, get_multi_file_agent_async, stream_ai_analysis
+from df_cache import load_dataframe, load_view, cache_stats
+from columnar_store import existing_sidecar, sidecar_path_for, read_columns
+from code_columns import plan_columns
+from executors import run_blocking, run_cpu, shutdown as shutdown_executors
+from sandbox import run_sandboxed, get_sandbox, sandbox_stats, shutdown as shutdown_sandbox
+from frame_handoff import share_file, share_files, release, release_all, handoff_stats, cleanup as cleanup_handoff
+from llm_client import close_async_client
+from prompt_builder import prompt_stats
+import llm_cache
+from result_index import make_result_key, find_result, reuse_result
+from upload_service import save_stream, store_blob, ingest_upload, merge_uploads, schema_of, sheets_of, UploadRejected
+from schema_index import find_same_schema
+from job_service import submit_job, cancel_job, get_job, report_stage, mark_interrupted_jobs
+from fastapi.encoders import jsonable_encoder
+from preview_codec import negotiate_format, to_records, to_columnar, to_arrow_ipc, FORMAT_ARROW, FORMAT_COLUMNAR, ARROW_MEDIA_TYPE
 
 # 1. 自动创建数据库表
 # (这会同时检查 file_records 和 formula_templates 表是否存在)
@@ -29,6 +47,20 @@ Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Excel自动化处理系统")
 
+@app.on_event("startup")
+async def on_startup():
+    await run_blocking(mark_interrupted_jobs)
+    cleanup_handoff()
+    # 预热执行 AI 代码的沙箱进程 (导入 pandas 等在子进程里进行，不阻塞启动)
+    get_sandbox()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_async_client()
+    shutdown_executors()
+    shutdown_sandbox()
+    cleanup_handoff()
+
 # 2. 配置跨域
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +69,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 响应压缩：客户端带 Accept-Encoding: gzip 时才压缩，小响应不压
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # 配置上传文件夹
 UPLOAD_DIR = "uploads"
@@ -46,10 +80,62 @@ if not os.path.exists(UPLOAD_DIR):
 class MultiFileRequest(BaseModel):
     file_ids: List[int]  # 用户选中的多个文件 ID
     query: str           # 用户需求 (例如: "把表A和表B按工号合并...")
+    template_id: Optional[int] = None  # 来自模板库时的模板 ID (参与结果复用的 key)
+    force: bool = False                # True: 不复用之前的结果，强制重新执行
+    # 可选：{ 文件 ID: [工作表名, ...] }，选中的每个工作表在 dfs 里的 key 为 "文件名/工作表名"；
+    # 没有指定的文件只读第一个工作表，key 仍为文件名
+    sheets: Optional[Dict[int, List[str]]] = None
 # --- 定义请求模型 ---
 class ChatRequest(BaseModel):
     file_id: Union[str, int]
+    preview_format: str = "records"  # 结果预览的格式：records / columnar
     query: str
+    template_id: Optional[int] = None
+    force: bool = False
+    sheet: Optional[str] = None  # 工作表名，不传为第一个工作表
+
+def _sheet_names(db: Session, record: FileRecord) -> list:
+    """文件的工作表列表：上传时已存库；旧记录没有的，现读一次 (只读 workbook.xml) 并补存"""
+    if record.sheet_names is None and os.path.exists(record.stored_path):
+        names = sheets_of(record.stored_path)
+        if names is not None:
+            record.sheet_names = names
+            db.commit()
+            # commit 会让记录过期，这里 (线程池里) 就重新加载，回到事件循环后读属性不会再触发查询
+            db.refresh(record)
+    return record.sheet_names or []
+
+def _resolve_sheet(db: Session, record: FileRecord, sheet: Optional[str]) -> Optional[str]:
+    """
+    请求里的工作表名 -> 读取用的 sheet 参数
+    不传或就是第一个工作表时返回 None，与不选工作表的请求共用缓存 / 旁路文件
+    """
+    if not sheet:
+        return None
+    names = _sheet_names(db, record)
+    if sheet not in names:
+        raise HTTPException(status_code=400, detail=f"工作表不存在: {sheet}")
+    return None if sheet == names[0] else sheet
+
+# 以下几个数据库辅助函数都是同步的，async 接口里通过 run_blocking 放到线程池执行，查库 / 提交不阻塞事件循环
+def _get_record(db: Session, file_id) -> FileRecord:
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return record
+
+def _record_and_sheet(db: Session, file_id, sheet: Optional[str]):
+    """文件记录 + 解析后的工作表参数 (见 _resolve_sheet)"""
+    record = _get_record(db, file_id)
+    return record, _resolve_sheet(db, record, sheet)
+
+def _add_records(db: Session, records: list) -> list:
+    """新记录入库；refresh 之后属性都已加载，回到事件循环里读取不会再触发查询"""
+    db.add_all(records)
+    db.commit()
+    for record in records:
+        db.refresh(record)
+    return records
 
 class TemplateCreate(BaseModel):
     title: str
@@ -66,41 +152,88 @@ class TemplateUpdate(BaseModel):
 # --- 接口定义 ---
 
 @app.post("/api/process_multi_files")
-def process_multi_files(request: MultiFileRequest, db: Session = Depends(get_db)):
+async def process_multi_files(request: MultiFileRequest, db: Session = Depends(get_db)):
+    return await run_process_multi_files(request, db)
+
+def _prepare_multi_files(db: Session, request: MultiFileRequest) -> dict:
+    """
+    多表分析的查库部分 (线程池中执行)：查文件记录、查可复用的结果、解析工作表
+    :return: 命中已有结果时 {"response": ...}；否则 {"result_key", "parent_id", "file_count", "targets"}
+             targets 为 [(dfs 里的 key, 物理路径, 工作表名 或 None), ...]
+    """
     # A. 查出所有文件记录
     files = db.query(FileRecord).filter(FileRecord.id.in_(request.file_ids)).all()
 
     if len(files) < 1:
         raise HTTPException(status_code=400, detail="至少选择一个文件")
 
-    # B. 准备上下文：读取所有文件到内存字典 'dfs'
-    loaded_dfs = {}
-    file_map_for_ai = {} # 仅用于给 AI 提供预览路径
-
-    print(f"🔄 开始加载 {len(files)} 个文件...")
-
+    # 同样的源文件内容 + 同样的指令之前执行过：直接返回上次的结果
+    records_by_id = {f.id: f for f in files}
+    sources = [records_by_id[i] for i in dict.fromkeys(request.file_ids) if i in records_by_id]
+    requested_sheets = request.sheets or {}
+    result_key = make_result_key(sources, request.query, request.template_id,
+                                 [requested_sheets.get(r.id) for r in sources])
+    hit = find_result(db, result_key, force=request.force)
+    if hit is not None:
+        print(f"⚡ 复用已有结果: {hit.stored_path}")
+        child = reuse_result(db, hit, files[0].id, "多表合并分析结果.xlsx")
+        raw_result = dict(child.raw_result or {})
+        return {"response": {
+            "success": True,
+            "msg": "多表处理成功 (复用已有结果)",
+            "cached": True,
+            "file_id": child.id,
+            "download_url": f"/api/download/{os.path.basename(child.stored_path)}",
+            "ai_code_used": raw_result.pop("python_code", ""),
+            "raw_result": raw_result
+        }}
+
+    # 多工作表的文件只读选中的工作表，每个工作表单独作为 dfs 里的一张表
+    targets = []
     for f in files:
         if not os.path.exists(f.stored_path):
             continue
+        chosen = requested_sheets.get(f.id)
+        if chosen:
+            targets.extend((f"{f.filename}/{name}", f.stored_path, _resolve_sheet(db, f, name)) for name in chosen)
+        else:
+            targets.append((f.filename, f.stored_path, None))
+    return {"result_key": result_key, "parent_id": files[0].id, "file_count": len(files), "targets": targets}
+
+async def run_process_multi_files(request: MultiFileRequest, db: Session, job=None):
+    """多表分析的完整流程 (同步接口和后台任务共用)"""
+    await report_stage(job, "load")
+    prepared = await run_blocking(_prepare_multi_files, db, request)
+    if "response" in prepared:
+        return prepared["response"]
+    result_key = prepared["result_key"]
+
+    # B. 准备上下文：只读表头确认每个文件都能读取 (有旁路文件时只读 schema)，
+    #    整表等 AI 代码出来、知道用到哪些列之后再按需加载
+    file_map_for_ai = {} # { 文件名 (或 "文件名/工作表名"): 物理路径 }，AI 预览和代码执行都用它
+    file_columns = {} # { 同上 key: 全部列名 }，列裁剪用
+    sheet_map = {} # { 同上 key: 工作表名 或 None (第一个工作表) }
+
+    print(f"🔄 开始加载 {prepared['file_count']} 个文件...")
+
+    for key, path, sheet in prepared["targets"]:
         try:
-            # 读取数据
-            df_temp = pd.read_excel(f.stored_path)
-            # 存入字典
-            loaded_dfs[f.filename] = df_temp
-            # 记录路径供 AI 预览函数使用
-            file_map_for_ai[f.filename] = f.stored_path
+            file_columns[key] = await run_blocking(read_columns, path, sheet)
+            file_map_for_ai[key] = path
+            sheet_map[key] = sheet
         except Exception as e:
-            print(f"❌ 读取文件 {f.filename} 失败: {e}")
+            print(f"❌ 读取文件 {key} 失败: {e}")
 
-    if not loaded_dfs:
+    if not file_map_for_ai:
         raise HTTPException(status_code=400, detail="没有成功加载任何文件，请检查文件是否存在")
 
     try:
         # C. 第一步：找 AI 写代码
-        print(f"🤖 请求 AI 进行多表分析: {list(loaded_dfs.keys())}")
+        print(f"🤖 请求 AI 进行多表分析: {list(file_map_for_ai.keys())}")
 
         # 调用 AI (这里 ai_service.py 已经修改为返回字典)
-        ai_result = get_multi_file_agent(file_map_for_ai, request.query)
+        await report_stage(job, "llm")
+        ai_result = await get_multi_file_agent_async(file_map_for_ai, request.query, sheet_map)
 
         # 🟢【关键修改】解析 AI 返回的字典
         column_formulas_data = {} # 初始化为空字典
@@ -118,42 +251,50 @@ def process_multi_files(request: MultiFileRequest, db: Session = Depends(get_db)
         print(f"🐍 AI生成的代码:\n{py_code}")
         print(f"➗ AI生成的公式逻辑: {excel_formula_display}")
 
-        # D. 第二步：执行代码
-        # 建立沙箱环境
-        exec_globals = {
-            'pd': pd,        # 注入 pandas
-            'dfs': loaded_dfs, # 🟢 注入所有表数据
-            'result_df': None  # 结果占位符
-        }
-
-        # 执行 AI 代码
-        exec(py_code, exec_globals)
-
-        # 获取结果
-        final_df = exec_globals.get('result_df')
-
-        if final_df is None or not isinstance(final_df, pd.DataFrame):
-            raise Exception("代码执行完毕，但 `result_df` 为空。请确保 AI 代码将结果赋值给了 `result_df`。")
-
-        # E. 第三步：结果存库
+        # D. 第二步：执行代码 + 保存结果 (沙箱进程中执行，跑飞了会被超时终止)
+        await report_stage(job, "execute")
         new_filename = f"多表计算结果_{uuid.uuid4().hex[:6]}.xlsx"
         new_path = os.path.join(UPLOAD_DIR, new_filename)
+        # 静态分析 AI 代码用到的列，只加载这些列；发布到共享内存，沙箱进程直接挂载，不用 pickle 传整表
+        column_plan = plan_columns(py_code, file_columns)
+        for fname, cols in column_plan.items():
+            if cols is not None:
+                print(f"✂️ 列裁剪: {fname} 只加载 {len(cols)}/{len(file_columns[fname])} 列 {cols}")
+        frames = await run_blocking(share_files, file_map_for_ai, column_plan, sheet_map)
+        try:
+            await run_sandboxed(apply_multi_file_operation, file_map_for_ai, py_code, new_path, frames=frames,
+                                sheets=sheet_map)
+        finally:
+            release_all(frames)
 
-        # 保存 Excel
-        final_df.to_excel(new_path, index=False)
+        # E. 第三步：结果存库
+        await report_stage(job, "save")
         new_file_size = os.path.getsize(new_path)
+        sidecar_path = existing_sidecar(new_path)
+
+        # 构造一个前端能看懂的 result 对象，用于显示在黄色框框里
+        raw_result = {
+            "action_type": "structure",
+            "excel_formula": excel_formula_display, # 这里就是那串长公式
+            "column_formulas": column_formulas_data, # 👈 新增：把分列公式字典传回给前端
+            "explanation": f"已根据指令合并 {prepared['file_count']} 个文件并计算结果。",
+            "target_position": "新文件",
+            "mode": "structure"
+        }
 
-        # 写入数据库
+        # 写入数据库 (带上 result_key，下次同样的请求直接复用)
         db_file = FileRecord(
             filename="多表合并分析结果.xlsx",
             stored_path=new_path,
+            sidecar_path=sidecar_path,
             file_size=new_file_size,
+            sheet_names=["Sheet1"],  # 结果用 to_excel 写出，只有一个默认工作表
             status="processed",
-            parent_id=files[0].id
+            parent_id=prepared["parent_id"],
+            result_key=result_key,
+            raw_result={**raw_result, "python_code": py_code}
         )
-        db.add(db_file)
-        db.commit()
-        db.refresh(db_file)
+        await run_blocking(_add_records, db, [db_file])
 
         # 🟢【关键修改】返回结构增加 raw_result，适配前端展示
         return {
@@ -162,15 +303,7 @@ def process_multi_files(request: MultiFileRequest, db: Session = Depends(get_db)
             "file_id": db_file.id,
             "download_url": f"/api/download/{new_filename}",
             "ai_code_used": py_code,
-            # 构造一个前端能看懂的 result 对象，用于显示在黄色框框里
-            "raw_result": {
-                "action_type": "structure",
-                "excel_formula": excel_formula_display, # 这里就是那串长公式
-                "column_formulas": column_formulas_data, # 👈 新增：把分列公式字典传回给前端
-                "explanation": f"已根据指令合并 {len(files)} 个文件并计算结果。",
-                "target_position": "新文件",
-                "mode": "structure"
-            }
+            "raw_result": raw_result
         }
 
     except Exception as e:
@@ -181,57 +314,102 @@ def process_multi_files(request: MultiFileRequest, db: Session = Depends(get_db)
 def read_root():
     return {"status": "ok", "message": "Backend is running!"}
 
+# ==========================================
+# 🟢 新增接口：查看缓存命中情况 (DataFrame 缓存 / LLM 响应缓存)
+# ==========================================
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return {"success": True, "dataframe": cache_stats(), "llm": llm_cache.cache_stats(), "sandbox": sandbox_stats(), "handoff": handoff_stats(),
+            "prompt": prompt_stats()}
+
 # ==========================================
 # 🟢 新增接口：获取对应历史记录 (FilesPage用)
 # ==========================================
+HISTORY_MAX_LIMIT = 100
+
+def _encode_cursor(upload_time, record_id) -> str:
+    raw = json.dumps([upload_time.isoformat() if upload_time else None, record_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        upload_time, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(upload_time), int(record_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+
 @app.get("/api/history")
-def get_history_list(q: str = None, db: Session = Depends(get_db)):
+def get_history_list(q: str = None, limit: int = 20, cursor: str = None, db: Session = Depends(get_db)):
     """
     返回成对的文件结构：[{ original: {...}, result: {...} }]
+    - 按上传时间倒序，limit 条一页；next_cursor 不为空时用它请求下一页 (keyset 分页)
+    - 原件 + 最新结果在一条 SQL 里查完 (窗口函数)，不再每个原件单独查一次子文件
     """
-    # 1. 查询所有原始文件 (parent_id 为 NULL)
-    query = db.query(FileRecord).filter(FileRecord.parent_id == None)
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
 
+    # 1. 当前页的原始文件 (parent_id 为 NULL)，多取一条用来判断是否还有下一页
+    page_query = select(FileRecord.id, FileRecord.filename, FileRecord.upload_time) \
+        .where(FileRecord.parent_id.is_(None))
     if q:
-        query = query.filter(FileRecord.filename.contains(q))
+        # 走 pg_trgm 索引 (见 update_schema.py)
+        page_query = page_query.where(FileRecord.filename.contains(q, autoescape=True))
+    if cursor:
+        cursor_time, cursor_id = _decode_cursor(cursor)
+        page_query = page_query.where(tuple_(FileRecord.upload_time, FileRecord.id) < tuple_(cursor_time, cursor_id))
+    page = page_query.order_by(desc(FileRecord.upload_time), desc(FileRecord.id)).limit(limit + 1).subquery("page")
+
+    # 2. 每个原件最新生成的子文件：按 parent_id 分区排序取第一名
+    ranked = select(
+        FileRecord.id, FileRecord.parent_id, FileRecord.filename, FileRecord.stored_path, FileRecord.upload_time,
+        func.row_number().over(
+            partition_by=FileRecord.parent_id,
+            order_by=(desc(FileRecord.upload_time), desc(FileRecord.id))
+        ).label("rn")
+    ).where(FileRecord.parent_id.in_(select(page.c.id))).subquery("ranked")
+
+    rows = db.execute(
+        select(
+            page.c.id, page.c.filename, page.c.upload_time,
+            ranked.c.id.label("child_id"), ranked.c.filename.label("child_filename"),
+            ranked.c.stored_path.label("child_path"), ranked.c.upload_time.label("child_time")
+        )
+        .select_from(page.outerjoin(ranked, and_(ranked.c.parent_id == page.c.id, ranked.c.rn == 1)))
+        .order_by(desc(page.c.upload_time), desc(page.c.id))
+    ).all()
 
-    # 按时间倒序
-    originals = query.order_by(desc(FileRecord.upload_time)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].upload_time, rows[-1].id)
 
     history_list = []
 
-    for org in originals:
-        # 2. 查找该文件的最新生成的子文件
-        # 这里假设一个原文件可能对应多个结果，我们只取最新的一个，或者你也可以改为返回列表
-        child = db.query(FileRecord) \
-            .filter(FileRecord.parent_id == org.id) \
-            .order_by(desc(FileRecord.upload_time)) \
-            .first()
-
+    for row in rows:
         item = {
-            "id": org.id, # 唯一标识
+            "id": row.id, # 唯一标识
             "original": {
-                "file_id": org.id,
-                "filename": org.filename,
-                "upload_time": org.upload_time.strftime("%Y-%m-%d %H:%M") if org.upload_time else ""
+                "file_id": row.id,
+                "filename": row.filename,
+                "upload_time": row.upload_time.strftime("%Y-%m-%d %H:%M") if row.upload_time else ""
             },
             "result": None
         }
 
-        if child:
+        if row.child_id is not None:
             item["result"] = {
-                "file_id": child.id,
-                "filename": child.filename,
-                "generated_time": child.upload_time.strftime("%Y-%m-%d %H:%M") if child.upload_time else "",
+                "file_id": row.child_id,
+                "filename": row.child_filename,
+                "generated_time": row.child_time.strftime("%Y-%m-%d %H:%M") if row.child_time else "",
                 # 构造下载链接
-                "download_url": f"http://127.0.0.1:8000/api/download/{child.stored_path.split(os.sep)[-1]}"
+                "download_url": f"http://127.0.0.1:8000/api/download/{row.child_path.split(os.sep)[-1]}"
             }
 
         history_list.append(item)
 
     return {
         "success": True,
-        "data": history_list
+        "data": history_list,
+        "next_cursor": next_cursor
     }
 
 # ==========================================
@@ -327,33 +505,70 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
     safe_filename = f"{uuid.uuid4().hex}{file_ext}"
     file_location = os.path.join(UPLOAD_DIR, safe_filename)
 
-    # 保存文件
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    file_size = os.path.getsize(file_location)
+    # 分块流式保存 (磁盘 IO 放到线程池)，超过大小上限直接拒绝
+    try:
+        saved = await run_blocking(save_stream, file.filename, file.file, file_location)
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    file_size = saved["file_size"]
+
+    # 同样的内容只保存一份：旁路文件、DataFrame 缓存都按路径共享，重复上传不再重新解析
+    file_location, reused = await run_blocking(store_blob, file_location, saved["sha256"], UPLOAD_DIR)
+    sidecar_path = existing_sidecar(file_location) if reused else None
+    schema = {"schema_fingerprint": None, "column_set_hash": None}
+    sheet_names = None
+
+    # 在进程池里解析一次并生成列式旁路文件，之后的读取都不再碰 openpyxl (同时算表结构指纹)
+    if sidecar_path is None:
+        try:
+            info = await run_cpu(ingest_upload, file.filename, file_location)
+            sidecar_path = info["sidecar_path"]
+            sheet_names = info["sheet_names"]
+            schema = {k: info[k] for k in schema}
+        except Exception as e:
+            print(f"⚠️ 上传时预解析失败: {e}")
+    else:
+        # 重复上传：旁路文件已有，指纹只读它的 schema，很快
+        schema = await run_blocking(schema_of, file_location)
+        sheet_names = await run_blocking(sheets_of, file_location)
 
     # 存入数据库
     db_file = FileRecord(
         filename=file.filename,    # 原始文件名 (显示用)
-        stored_path=file_location, # 物理路径 (读取用)
+        stored_path=file_location, # 物理路径 (下载用)
+        sidecar_path=sidecar_path, # 列式旁路文件 (读取用)
         file_size=file_size,
+        content_hash=saved["sha256"],
+        schema_fingerprint=schema["schema_fingerprint"],
+        column_set_hash=schema["column_set_hash"],
+        sheet_names=sheet_names,   # 工作表列表 (只读 workbook.xml，其他工作表用到时才解析)
         status="uploaded"
     )
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    await run_blocking(_add_records, db, [db_file])
 
-    return {"msg": "上传成功", "file_id": db_file.id, "filename": db_file.filename}
+    return {"msg": "上传成功", "file_id": db_file.id, "filename": db_file.filename,
+            "sha256": saved["sha256"], "deduplicated": reused, "sheet_names": sheet_names}
 
 # ==========================================
-# 🟢 新增接口：获取指定文件的预览数据
-# ==========================================
-# ==========================================
-# 🟢 修复后的接口：获取指定文件的预览数据
+# 🟢 分页预览接口：获取指定文件的一页数据
 # ==========================================
+PREVIEW_MAX_LIMIT = 1000
+
 @app.get("/api/files/{file_id}/data")
-def get_file_data(file_id: int, db: Session = Depends(get_db)):
+def get_file_data(
+        file_id: int,
+        offset: int = 0,
+        limit: int = 50,
+        columns: str = None,       # 只返回这些列，逗号分隔
+        sort_by: str = None,
+        sort_order: str = "asc",   # asc / desc
+        filter_column: str = None, # 在该列中做包含匹配 (不区分大小写)
+        filter_value: str = None,
+        sheet: str = None,         # 工作表名，不传为第一个 (每个工作表单独加载、单独缓存)
+        format: str = None,        # records (默认) / columnar / arrow，也可以用 Accept 头协商
+        request: Request = None,
+        db: Session = Depends(get_db)
+):
     # 1. 数据库查询文件记录
     file_record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
     if not file_record:
@@ -373,42 +588,107 @@ def get_file_data(file_id: int, db: Session = Depends(get_db)):
             print(f"DEBUG: 数据库路径: {file_record.stored_path}，实际查找路径: {file_path}")
             raise HTTPException(status_code=404, detail="磁盘上未找到该文件，可能已被删除")
 
-    try:
-        # 3. 读取 Excel (只读取前 50 行以提高速度)
-        # keep_default_na=False 可以防止 pandas 把空单元格读成 NaN
-        df = pd.read_excel(file_path, nrows=50)
+    offset = max(offset, 0)
+    limit = max(1, min(limit, PREVIEW_MAX_LIMIT))
+    sheet_names = _sheet_names(db, file_record)
+    load_sheet = _resolve_sheet(db, file_record, sheet)
 
-        # 4. 再次确保处理空值 (JSON 标准不支持 NaN)
-        df = df.fillna("")
+    try:
+        # 3. 读取数据 (走缓存 / 列式旁路文件；排序筛选结果也会缓存，翻页只做切片)
+        df_full = load_dataframe(file_path, copy=False, sheet=load_sheet)
+        # 查询参数都是字符串，表头可能是数字，统一按字符串找回原列名
+        column_lookup = {str(c): c for c in df_full.columns}
+        all_columns = list(column_lookup)
+
+        def resolve(name):
+            if name not in column_lookup:
+                raise HTTPException(status_code=400, detail=f"列不存在: {name}")
+            return column_lookup[name]
+
+        selected = [resolve(c) for c in columns.split(",") if c] if columns else None
+        sort_by = resolve(sort_by) if sort_by else None
+        filter_column = resolve(filter_column) if filter_column and filter_value is not None else None
+
+        df_full, positions = load_view(
+            file_path,
+            sort_by=sort_by,
+            ascending=(sort_order != "desc"),
+            filter_column=filter_column,
+            filter_value=filter_value,
+            sheet=load_sheet
+        )
+        filtered_rows = len(df_full) if positions is None else len(positions)
 
-        # 针对包含 "Timestamp" (日期) 类型的列进行字符串转换，防止 JSON 序列化报错
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].astype(str)
+        # 4. 只取当前页 (+ 需要的列)
+        if positions is None:
+            df = df_full.iloc[offset: offset + limit]
+        else:
+            df = df_full.iloc[positions[offset: offset + limit]]
+        if selected:
+            df = df[selected]
 
         # 5. 构造 Ant Design Vue Table 需要的 columns 格式
-        columns = [
+        columns_meta = [
             {"title": col, "dataIndex": col, "key": col, "width": 150}
             for col in df.columns
         ]
 
-        # 6. 构造数据列表
-        data = df.to_dict(orient="records")
-
-        return {
+        meta = {
             "success": True,
             "filename": file_record.filename,
-            "columns": columns,
-            "data": data,
-            "total_rows": 50 # 只是预览，或者你可以再读一次获取 len(df)
+            "columns": columns_meta,
+            "offset": offset,
+            "limit": limit,
+            "total_rows": len(df_full),      # 原表总行数
+            "filtered_rows": filtered_rows,  # 筛选后的行数 (分页用)
+            "total_columns": len(all_columns),
+            "all_columns": all_columns,
+            "sheet_names": sheet_names,      # 全部工作表 (前端切换用)
+            "sheet": sheet or (sheet_names[0] if sheet_names else None)  # 当前工作表
         }
 
+        # 6. 按协商的格式输出数据
+        fmt = negotiate_format(format, request.headers.get("accept") if request else None)
+        if fmt == FORMAT_ARROW:
+            # 元信息 (总行数等) 放在 Arrow schema metadata 里
+            return Response(content=to_arrow_ipc(df, meta), media_type=ARROW_MEDIA_TYPE)
+        if fmt == FORMAT_COLUMNAR:
+            # 值都已是原生类型，跳过 jsonable_encoder 逐个遍历
+            return JSONResponse({**jsonable_encoder(meta), "format": fmt, "data": to_columnar(df)})
+        return {**meta, "data": to_records(df)}
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Read Excel Error: {e}")
         # 打印详细堆栈以便调试
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"读取文件失败: {str(e)}")
+
+# ==========================================
+# 🟢 查找同结构的文件 (按上传时算好的表结构指纹查库，不读任何文件)
+# ==========================================
+@app.get("/api/files/{file_id}/same_schema")
+def get_same_schema_files(file_id: int, strict: bool = True, limit: int = 100, db: Session = Depends(get_db)):
+    """
+    strict=True: 列顺序、类型都一样；strict=False: 只要列名集合一样 (与批处理分组口径一致)
+    """
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    matches = find_same_schema(db, record, strict=strict, limit=min(max(limit, 1), 500))
+    return {
+        "success": True,
+        "schema_fingerprint": record.schema_fingerprint,
+        "column_set_hash": record.column_set_hash,
+        "files": [
+            {"file_id": r.id, "filename": r.filename, "upload_time": r.upload_time}
+            for r in matches
+        ]
+    }
+
 # ==========================================
 # 2. 读取 Excel 数据接口 (用于初始加载)
 # ==========================================
@@ -440,13 +720,11 @@ def get_file_data(file_id: int, db: Session = Depends(get_db)):
 # 3. 纯 AI 对话接口 (咨询用)
 # ==========================================
 @app.post("/api/chat")
-def chat_with_data(request: ChatRequest, db: Session = Depends(get_db)):
-    record = db.query(FileRecord).filter(FileRecord.id == request.file_id).first()
-    if not record:
-        raise HTTPException(status_code=404, detail="文件不存在")
+async def chat_with_data(request: ChatRequest, db: Session = Depends(get_db)):
+    record, sheet = await run_blocking(_record_and_sheet, db, request.file_id, request.sheet)
 
-    # 调用 ai_service
-    ai_result = get_ai_analysis(record.stored_path, request.query)
+    # 调用 ai_service (只加载选中的工作表)
+    ai_result = await get_ai_analysis_async(record.stored_path, request.query, sheet)
 
     # 🟢 修复：ai_service 已经返回了 {"answer": "..."}，这里直接返回 ai_result 即可
     # 如果 ai_service 返回的是纯字符串，则封装一下
@@ -454,59 +732,174 @@ def chat_with_data(request: ChatRequest, db: Session = Depends(get_db)):
         return ai_result
     else:
         return {"answer": ai_result}
+
+@app.post("/api/chat/stream")
+async def chat_with_data_stream(request: ChatRequest, db: Session = Depends(get_db)):
+    """
+    /api/chat 的流式版本 (SSE)：回答边生成边推给前端，最后一条 done 事件带完整回答和耗时 (含首字时间)
+    事件格式见 ai_service.stream_ai_analysis
+    """
+    # 查库放在开始推流之前，推流过程中不再用到数据库会话
+    record, sheet = await run_blocking(_record_and_sheet, db, request.file_id, request.sheet)
+    file_path = record.stored_path
+
+    async def event_stream():
+        async for event, data in stream_ai_analysis(file_path, request.query, sheet):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # X-Accel-Buffering：经过 nginx 反向代理时不要攒包，否则就不是流式了
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 # ==========================================
 # 4. 核心：智能操作接口 (生成公式/修改结构)
 # ==========================================
 @app.post("/api/generate_formula")
-def generate_excel_formula(request: ChatRequest, db: Session = Depends(get_db)):
-    record = db.query(FileRecord).filter(FileRecord.id == request.file_id).first()
-    if not record:
-        raise HTTPException(status_code=404, detail="文件不存在")
+async def generate_excel_formula(request: ChatRequest, db: Session = Depends(get_db)):
+    return await run_generate_formula(request, db)
 
-    ai_result = get_formula_suggestion(record.stored_path, request.query)
+def _prepare_formula(db: Session, request: ChatRequest):
+    """
+    公式生成的查库部分 (线程池中执行)
+    :return: (文件记录, 工作表参数, result_key, 可复用的结果记录 或 None)
+    """
+    record, sheet = _record_and_sheet(db, request.file_id, request.sheet)
+
+    # 同样的源文件内容 + 同样的指令之前执行过：直接返回上次的结果，不再调用 AI
+    result_key = make_result_key([record], request.query, request.template_id, [sheet])
+    hit = find_result(db, result_key, force=request.force)
+    if hit is None:
+        return record, sheet, result_key, None
+    print(f"⚡ 复用已有结果: {hit.stored_path}")
+    return record, sheet, result_key, reuse_result(db, hit, record.id, f"处理结果_{record.filename}")
+
+async def run_generate_formula(request: ChatRequest, db: Session, job=None):
+    """生成公式并执行的完整流程 (同步接口和后台任务共用)"""
+    await report_stage(job, "load")
+    record, sheet, result_key, child = await run_blocking(_prepare_formula, db, request)
+    if child is not None:
+        await report_stage(job, "preview")
+        result_sheet = _result_sheet(child.raw_result or {}, sheet)
+        df_new = await run_blocking(load_dataframe, child.stored_path, copy=False, sheet=result_sheet)
+        response = _formula_response(child, df_new, child.raw_result or {}, {"engine": "cached"}, request.preview_format,
+                                     result_sheet)
+        response.update({"msg": "处理成功 (复用已有结果)", "cached": True})
+        return response
+
+    await report_stage(job, "llm")
+    ai_result = await get_formula_suggestion_async(record.stored_path, request.query, sheet)
 
     if ai_result.get("action_type") == "error":
         return {"success": False, "msg": f"AI 分析失败: {ai_result.get('explanation')}"}
 
     try:
-        # 执行物理操作
-        new_path, new_filename = apply_formula_to_file(record.stored_path, ai_result)
+        # 执行物理操作 (沙箱进程中执行，有超时和资源限制；exec_report 随返回值带回)
+        await report_stage(job, "execute")
+        frame = await run_blocking(share_file, record.stored_path, None, sheet)
+        try:
+            new_path, new_filename, exec_report = await run_sandboxed(
+                apply_formula_with_report, record.stored_path, ai_result, frame=frame, sheet=sheet
+            )
+        finally:
+            release(frame)
+
+        # 读取结果用于预览 (同时会生成列式旁路文件)
+        result_sheet = _result_sheet(ai_result, sheet)
+        df_new = await run_blocking(load_dataframe, new_path, copy=False, sheet=result_sheet)
 
         # 🟢 关键修改：将生成的文件存入数据库，并关联父ID
+        await report_stage(job, "save")
         new_file_size = os.path.getsize(new_path)
         db_child_file = FileRecord(
             filename=f"处理结果_{record.filename}", # 或者使用 new_filename
             stored_path=new_path,
+            sidecar_path=existing_sidecar(new_path),
             file_size=new_file_size,
+            sheet_names=await run_blocking(sheets_of, new_path),
             status="processed",
-            parent_id=record.id  # 🟢 建立关联！
+            parent_id=record.id,  # 🟢 建立关联！
+            result_key=result_key,
+            raw_result=ai_result
         )
-        db.add(db_child_file)
-        db.commit()
-        db.refresh(db_child_file)
+        await run_blocking(_add_records, db, [db_child_file])
 
         # 预览逻辑 (保持不变)
-        df_new = pd.read_excel(new_path)
-        preview_df = df_new.head(50).fillna("")
-        preview_columns = [{"title": col, "dataIndex": col, "key": col, "width": 100} for col in preview_df.columns]
-        preview_rows = preview_df.to_dict(orient='records')
-
-        return {
-            "success": True,
-            "msg": "处理成功",
-            "download_url": f"/api/download/{os.path.basename(new_path)}", # 简化路径
-            "file_id": db_child_file.id, # 返回新的 ID
-            "raw_result": ai_result,
-            "preview_data": {
-                "columns": preview_columns,
-                "dataSource": preview_rows
-            }
-        }
+        await report_stage(job, "preview")
+        return _formula_response(db_child_file, df_new, ai_result, exec_report, request.preview_format, result_sheet)
 
     except Exception as e:
         print(f"Process Error: {str(e)}")
         return {"success": False, "msg": f"执行失败: {str(e)}"}
 
+def _result_sheet(ai_result: dict, sheet: Optional[str]) -> Optional[str]:
+    """
+    结果文件里要预览的工作表：结构修改只输出处理过的那一个工作表 (新文件的第一个)，
+    数值计算在原工作簿上改写，结果仍在原工作表
+    """
+    return None if ai_result.get("action_type") == "structure" else sheet
+
+def _formula_response(child: FileRecord, df_new: pd.DataFrame, ai_result: dict, exec_report: dict, preview_format: str,
+                      sheet: Optional[str] = None):
+    """公式处理结果的返回结构 (新执行和复用已有结果共用)"""
+    preview_df = df_new.head(50)
+    preview_columns = [{"title": col, "dataIndex": col, "key": col, "width": 100} for col in preview_df.columns]
+    if negotiate_format(preview_format) in (FORMAT_COLUMNAR, FORMAT_ARROW):
+        preview_rows = {"columnar": to_columnar(preview_df)}
+    else:
+        preview_rows = {"dataSource": to_records(preview_df)}
+
+    return {
+        "success": True,
+        "msg": "处理成功",
+        "download_url": f"/api/download/{os.path.basename(child.stored_path)}", # 简化路径
+        "file_id": child.id, # 返回新的 ID
+        "sheet": sheet, # 结果所在的工作表 (None 为第一个)，预览结果文件时带上
+        "raw_result": ai_result,
+        "exec_report": exec_report, # 计算路径 (vectorized / row) 与耗时
+        "preview_data": {
+            "columns": preview_columns,
+            **preview_rows
+        }
+    }
+
+# ==========================================
+# 🟢 新增接口：后台任务 (提交后立即返回 job_id，前端轮询进度)
+# ==========================================
+async def _run_job_with_session(handler, request, job):
+    # 任务比 HTTP 请求活得久，不能用请求里的 db，单独开一个会话
+    db = SessionLocal()
+    try:
+        # 结果要存进 JSON 字段，先把日期等类型转成可序列化的值
+        return jsonable_encoder(await handler(request, db, job))
+    finally:
+        db.close()
+
+@app.post("/api/jobs/generate_formula")
+async def submit_generate_formula_job(request: ChatRequest):
+    job_id = await submit_job("generate_formula", jsonable_encoder(request),
+                        lambda job: _run_job_with_session(run_generate_formula, request, job))
+    return {"success": True, "job_id": job_id}
+
+@app.post("/api/jobs/process_multi_files")
+async def submit_multi_files_job(request: MultiFileRequest):
+    job_id = await submit_job("process_multi_files", jsonable_encoder(request),
+                        lambda job: _run_job_with_session(run_process_multi_files, request, job))
+    return {"success": True, "job_id": job_id}
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(job_id: str, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "data": job}
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job_endpoint(job_id: str, db: Session = Depends(get_db)):
+    if get_job(db, job_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not cancel_job(job_id):
+        return {"success": False, "msg": "任务已结束，无法取消"}
+    return {"success": True, "msg": "已请求取消"}
+
 # ==========================================
 # 5. 文件下载接口
 # ==========================================
@@ -524,6 +917,13 @@ def download_file(filename: str):
 # ==========================================
 # 🟢 新增接口：智能批量上传 (支持 合并模式/独立模式)
 # ==========================================
+def _remove_files(paths):
+    """清理上传失败 / 合并后不再需要的落盘文件 (连同旁路文件)"""
+    for path in paths:
+        for p in (path, sidecar_path_for(path)):
+            if os.path.exists(p):
+                os.remove(p)
+
 @app.post("/api/upload/batch")
 async def batch_upload_files(
         files: List[UploadFile] = File(...),
@@ -538,98 +938,41 @@ async def batch_upload_files(
     if not files or len(files) == 0:
         raise HTTPException(status_code=400, detail="未上传任何文件")
 
-    uploaded_records = [] # 只有独立模式会用到
-    dfs_to_merge = []     # 只有合并模式会用到
-    base_columns = None   # 用于合并模式的列名校验
-
-    # --- 1. 循环处理所有文件 ---
     for file in files:
         if not file.filename.endswith((".xlsx", ".xls")):
             raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式错误，仅支持 Excel")
 
-        try:
-            # 读取文件内容
-            content = await file.read()
-            df = pd.read_excel(content)
-
-            # [通用验证]：空表检查
-            if df.empty:
-                raise HTTPException(status_code=400, detail=f"文件 {file.filename} 是空的，无法处理")
-
-            # --- 分支逻辑 ---
-            if auto_merge:
-                # [合并模式]：严格校验列名一致性
-                current_columns = list(df.columns)
-                if base_columns is None:
-                    base_columns = current_columns
-                else:
-                    if set(base_columns) != set(current_columns):
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"【合并失败】文件 '{file.filename}' 的列名与其他文件不一致。\n预期: {base_columns}\n实际: {current_columns}"
-                        )
-
-                # 记录来源，准备合并
-                df['_来源文件'] = file.filename
-                dfs_to_merge.append(df)
-
-            else:
-                # [独立模式]：直接保存每个文件
-                # 1. 保存物理文件
-                file_ext = os.path.splitext(file.filename)[1]
-                safe_filename = f"{uuid.uuid4().hex}{file_ext}"
-                save_path = os.path.join(UPLOAD_DIR, safe_filename)
-
-                # 由于 content 已经被 read() 读到内存，我们需要用 pandas 再写出，或者重置指针
-                # 简单起见，直接用 pandas 写出（顺便还能标准化格式）
-                df.to_excel(save_path, index=False)
-                file_size = os.path.getsize(save_path)
-
-                # 2. 存入数据库
-                db_file = FileRecord(
-                    filename=file.filename,
-                    stored_path=save_path,
-                    file_size=file_size,
-                    status="uploaded"
-                )
-                db.add(db_file)
-                db.commit()
-                db.refresh(db_file)
-
-                # 添加到返回列表
-                uploaded_records.append({
-                    "file_id": db_file.id,
-                    "filename": db_file.filename
-                })
-
-        except HTTPException as he:
-            raise he
-        except Exception as e:
-            print(f"Error processing {file.filename}: {e}")
-            raise HTTPException(status_code=500, detail=f"处理文件 {file.filename} 失败: {str(e)}")
+    # --- 1. 逐个分块写盘 (原始字节原样保存，内存占用只与分块大小有关) ---
+    items = []  # [(原始文件名, 落盘路径, {"file_size", "sha256"}), ...]
+    try:
+        for file in files:
+            save_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}")
+            items.append((file.filename, save_path, await run_blocking(save_stream, file.filename, file.file, save_path)))
+    except UploadRejected as e:
+        _remove_files([path for _, path, _ in items])
+        raise HTTPException(status_code=400, detail=str(e))
 
     # --- 2. 后续处理 (针对合并模式) ---
     if auto_merge:
         try:
-            # 执行合并
-            final_df = pd.concat(dfs_to_merge, ignore_index=True)
-
-            # 保存合并后的文件
+            # 表头校验 + 合并 + 保存，整体放到进程池；合并完成后单个文件不再保留
             merged_filename = f"merged_{uuid.uuid4().hex[:8]}.xlsx"
             save_path = os.path.join(UPLOAD_DIR, merged_filename)
-            final_df.to_excel(save_path, index=False)
+            info = await run_cpu(merge_uploads, [(name, path) for name, path, _ in items], save_path)
 
             # 存库
             display_name = f"批量合并_{len(files)}个文件.xlsx"
             db_file = FileRecord(
                 filename=display_name,
                 stored_path=save_path,
-                file_size=os.path.getsize(save_path),
+                sidecar_path=info["sidecar_path"],
+                file_size=info["file_size"],
+                schema_fingerprint=info["schema_fingerprint"],
+                column_set_hash=info["column_set_hash"],
+                sheet_names=info["sheet_names"],
                 status="uploaded"
             )
-            db.add(db_file)
-            db.commit()
-            db.refresh(db_file)
+            await run_blocking(_add_records, db, [db_file])
 
             return {
                 "mode": "merge",
@@ -638,15 +981,70 @@ async def batch_upload_files(
                 "file_info": {
                     "file_id": db_file.id,
                     "filename": db_file.filename,
-                    "total_rows": len(final_df)
+                    "total_rows": info["total_rows"]
                 }
             }
 
+        except UploadRejected as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"合并过程出错: {str(e)}")
+        finally:
+            _remove_files([path for _, path, _ in items])
 
-    # --- 3. 后续处理 (针对独立模式) ---
+    # --- 3. 后续处理 (针对独立模式)：按内容去重后并行校验、生成旁路文件 ---
     else:
+        # 同样的内容只保存一份 (批次内重复、以前上传过的都算)
+        stored = [await run_blocking(store_blob, path, saved["sha256"], UPLOAD_DIR) for _, path, saved in items]
+        new_blobs = [path for path, reused in stored if not reused]
+
+        # 每个 blob 只校验 / 解析一次；已有旁路文件的 ingest_upload 只读表头
+        unique_paths = list(dict.fromkeys(path for path, _ in stored))
+        names = {path: name for (name, _, _), (path, _) in zip(items, stored)}
+        results = await asyncio.gather(
+            *[run_cpu(ingest_upload, names[path], path) for path in unique_paths],
+            return_exceptions=True
+        )
+
+        # 有一个文件不合格，整批都不入库 (只清理本批新建的 blob，已有的文件还被别的记录引用)
+        for path, info in zip(unique_paths, results):
+            if isinstance(info, Exception):
+                _remove_files(new_blobs)
+                if isinstance(info, UploadRejected):
+                    raise HTTPException(status_code=400, detail=str(info))
+                print(f"Error processing {names[path]}: {info}")
+                raise HTTPException(status_code=500, detail=f"处理文件 {names[path]} 失败: {str(info)}")
+        infos = dict(zip(unique_paths, results))
+
+        # 整批一次入库 (一次提交，在线程池里进行)
+        records = [
+            FileRecord(
+                filename=name,
+                stored_path=save_path,
+                sidecar_path=infos[save_path]["sidecar_path"],
+                file_size=saved["file_size"],
+                content_hash=saved["sha256"],
+                schema_fingerprint=infos[save_path]["schema_fingerprint"],
+                column_set_hash=infos[save_path]["column_set_hash"],
+                sheet_names=infos[save_path]["sheet_names"],
+                status="uploaded"
+            )
+            for (name, _, saved), (save_path, _) in zip(items, stored)
+        ]
+        await run_blocking(_add_records, db, records)
+
+        # 返回列表
+        uploaded_records = [
+            {
+                "file_id": db_file.id,
+                "filename": db_file.filename,
+                "sha256": saved["sha256"],
+                "deduplicated": reused,
+                "sheet_names": db_file.sheet_names
+            }
+            for db_file, (_, _, saved), (_, reused) in zip(records, items, stored)
+        ]
+
         return {
             "mode": "independent",
             "success": True,
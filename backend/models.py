@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, JSON, Text, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -9,13 +9,31 @@ class FileRecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     stored_path = Column(String)
+    # 🟢 新增：列式旁路文件 (Feather)，读取时优先使用，xlsx 只用于下载
+    sidecar_path = Column(String, nullable=True)
     file_size = Column(Float)
+    # 🟢 新增：原始文件内容的 sha256，同样内容的上传共用一个 stored_path
+    content_hash = Column(String, nullable=True, index=True)
+    # 🟢 新增：表结构指纹 (见 schema_index.py)，上传时算一次，按结构分组 / 查找同结构文件都直接查库
+    schema_fingerprint = Column(String, nullable=True, index=True)  # 有序列名 + 类型 (严格)
+    column_set_hash = Column(String, nullable=True, index=True)     # 排序后的列名集合 (宽松)
+    # 🟢 新增：工作表名称列表 (按工作簿顺序，只读 workbook.xml 得到)，第一个为默认工作表
+    sheet_names = Column(JSON, nullable=True)
     status = Column(String, default="uploaded")
     upload_time = Column(DateTime(timezone=True), server_default=func.now())
 
     # 🟢 新增：父文件ID，用于关联“原件”和“修改后的文件”
     parent_id = Column(Integer, ForeignKey("file_records.id"), nullable=True)
 
+    # 🟢 新增：结果复用 (见 result_index.py)，同样的源文件内容 + 指令直接返回这条记录
+    result_key = Column(String, nullable=True, index=True)
+    raw_result = Column(JSON, nullable=True)  # 生成该结果时 AI 返回的处理逻辑
+
+    __table_args__ = (
+        # 🟢 历史列表：parent_id IS NULL 按时间倒序分页 + 按 parent_id 找最新子文件，都走这个索引
+        Index("ix_file_records_parent_upload", "parent_id", "upload_time", "id"),
+    )
+
 class FormulaTemplate(Base):
     __tablename__ = "formula_templates"
 
@@ -23,4 +41,20 @@ class FormulaTemplate(Base):
     category = Column(String)
     title = Column(String)
     description = Column(String)  # 🟢 补回 description
-    prompt_text = Column(String)
\ No newline at end of file
+    prompt_text = Column(String)
+
+class JobRecord(Base):
+    """🟢 新增：后台任务 (多表分析 / 公式生成) 的状态，供前端轮询"""
+    __tablename__ = "job_records"
+
+    id = Column(String, primary_key=True, index=True)  # uuid
+    kind = Column(String)                               # generate_formula / process_multi_files
+    status = Column(String, default="queued", index=True)  # queued / running / succeeded / failed / cancelled
+    stage = Column(String, default="queued")            # load / llm / execute / save / preview / done
+    progress = Column(Integer, default=0)               # 0 ~ 100
+    payload = Column(JSON)                              # 提交时的请求体
+    result = Column(JSON, nullable=True)                # 成功时与同步接口的返回值一致
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
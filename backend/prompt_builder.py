@@ -0,0 +1,362 @@
+# backend/prompt_builder.py
+"""
+按 token 预算构造表格上下文 (Prompt 里"这张表长什么样"的那一段)
+
+原来三个 Prompt 各自把表格原样塞进去：公式生成是全部列映射 + 5 行 markdown，
+Chat 是 str(df.dtypes) + 3 行 markdown，多表是每个文件 3 行 markdown。
+200 列的宽表或者一次选十个文件时 Prompt 动辄上万 token，模型又慢又贵，
+to_markdown (tabulate) 本身在 profile 里也很显眼。这里统一改成：
+
+- 每列一份画像 (类型、非空数、范围 / 常见取值)，按文件版本 (路径 + mtime + size + 工作表) 缓存，
+  整表在 df_cache 里就用整表算，不在就只读开头 PROMPT_PROFILE_ROWS 行估算，不为拼 Prompt 加载整表
+- 按优先级装进预算：用户问题里提到的列 > 其他列 (按原顺序)；
+  先保证列名清单，再给列补统计信息，最后用剩下的预算放样例行 (行数从多到少试，放得下为止)
+- 放不下的列给出汇总 ("另有 N 列：数值 x 列、文本 y 列")，单元格内容过长截断
+- 纯文本拼接，不走 markdown 渲染
+- 每次构造都记录 token 估算值等指标 (prompt_stats，/api/cache/stats 可查)
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from df_cache import peek_dataframe, load_head
+
+# ================= 配置区 =================
+PROMPT_TABLE_BUDGET = int(os.getenv("PROMPT_TABLE_BUDGET", "1500"))  # 单表上下文的 token 预算
+PROMPT_MULTI_BUDGET = int(os.getenv("PROMPT_MULTI_BUDGET", "4000"))  # 多表时所有表合计的预算
+PROMPT_MIN_TABLE_BUDGET = int(os.getenv("PROMPT_MIN_TABLE_BUDGET", "300"))  # 表再多，每张表至少分到这么多
+PROMPT_SAMPLE_ROWS = int(os.getenv("PROMPT_SAMPLE_ROWS", "5"))  # 样例行数上限
+PROMPT_PROFILE_ROWS = int(os.getenv("PROMPT_PROFILE_ROWS", "500"))  # 整表不在缓存时，只用开头这么多行估算画像
+PROMPT_CELL_CHARS = int(os.getenv("PROMPT_CELL_CHARS", "40"))  # 单元格 / 常见取值的最大字符数
+PROMPT_PROFILE_CACHE_SIZE = int(os.getenv("PROMPT_PROFILE_CACHE_SIZE", "256"))
+# =========================================
+
+# 列名清单、列统计、样例行各自最多用到预算的多少 (累计)
+_NAMES_SHARE = 0.5
+_STATS_SHARE = 0.75
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_lock = threading.Lock()
+_profiles = OrderedDict()  # 文件版本 key -> 画像
+_stats = {"prompts": 0, "tokens": 0, "max_tokens": 0, "tables": 0, "truncated_tables": 0,
+          "profile_hits": 0, "profile_misses": 0}
+_by_kind = {}  # Prompt 种类 -> {"count", "tokens", "last_tokens"}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估 token 数 (不依赖分词器)：中日韩字符按 1 个 token，其余按 3.5 个字符 1 个 token
+    对中文为主的 Prompt 略偏高，做预算判断刚好偏保守
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 3.5)
+
+
+def get_col_letter(n):
+    """
+    将数字索引转化为 Excel 列名
+    0 -> A, 1 -> B, ... 26 -> AA
+    """
+    s = ""
+    while n >= 0:
+        s = chr(n % 26 + 65) + s
+        n = n // 26 - 1
+    return s
+
+
+def _clip(value, limit: int = None) -> str:
+    limit = limit or PROMPT_CELL_CHARS
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return ""
+    if isinstance(value, float):
+        value = int(value) if value.is_integer() else f"{value:.6g}"  # 小数只保留 6 位有效数字
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+# ================= 列画像 =================
+
+def _kind_label(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "布尔"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "整数"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "小数"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "日期"
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "分类"
+    return "文本"
+
+
+def _profile_column(series: pd.Series) -> dict:
+    kind = _kind_label(series.dtype)
+    info = {"kind": kind, "non_null": int(series.notna().sum())}
+    if not info["non_null"]:
+        return info
+    try:
+        if kind in ("整数", "小数", "日期"):
+            info["min"], info["max"] = _clip(series.min()), _clip(series.max())
+        elif kind != "布尔":
+            counts = series.value_counts(dropna=True)
+            info["unique"] = int(len(counts))
+            info["top"] = [_clip(v, 16) for v in counts.index[:3]]
+    except Exception:
+        pass  # 混合类型等无法比较 / 统计的列，只给类型和非空数
+    return info
+
+
+def _profile_key(file_path: str, sheet: str = None):
+    st = os.stat(file_path)
+    return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, sheet)
+
+
+def profile_table(file_path: str, sheet: str = None, df: pd.DataFrame = None) -> dict:
+    """
+    表格画像：{"columns": [列名], "profiles": [每列统计], "rows": 行数 或 None, "sample": 前几行, "exact": 是否整表统计}
+    - 传入 df 或整表已在 df_cache 里：整表统计
+    - 否则只读开头 PROMPT_PROFILE_ROWS 行估算 (行数未知)
+    同一个文件版本只算一次；整表统计的结果会替换掉之前的估算结果
+    """
+    key = _profile_key(file_path, sheet)
+    if df is None:
+        df = peek_dataframe(file_path, sheet)
+    exact = df is not None
+
+    with _lock:
+        cached = _profiles.get(key)
+        if cached is not None and (cached["exact"] or not exact):
+            _profiles.move_to_end(key)
+            _stats["profile_hits"] += 1
+            return cached
+        _stats["profile_misses"] += 1
+
+    if df is None:
+        df = load_head(file_path, PROMPT_PROFILE_ROWS, sheet=sheet)
+    profile = {
+        "columns": [str(c) for c in df.columns],
+        "profiles": [_profile_column(df.iloc[:, i]) for i in range(df.shape[1])],
+        "rows": len(df) if exact else None,
+        "sample": [[_clip(v) for v in row] for row in df.head(PROMPT_SAMPLE_ROWS).itertuples(index=False, name=None)],
+        "exact": exact,
+    }
+
+    with _lock:
+        _profiles[key] = profile
+        _profiles.move_to_end(key)
+        while len(_profiles) > PROMPT_PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+# ================= 按预算渲染 =================
+
+def _column_priority(columns: List[str], query: str) -> List[int]:
+    """用户问题里提到的列排在最前 (长列名优先匹配，避免 "金额" 抢了 "应发金额")，其余保持原顺序"""
+    text = (query or "").lower()
+    mentioned = []
+    for i in sorted(range(len(columns)), key=lambda i: -len(columns[i])):
+        name = columns[i].lower()
+        if name and name in text:
+            mentioned.append(i)
+            text = text.replace(name, " ")
+    picked = set(mentioned)
+    return sorted(mentioned) + [i for i in range(len(columns)) if i not in picked]
+
+
+def _stats_text(info: dict) -> str:
+    parts = [f"非空 {info['non_null']}"]
+    if "min" in info:
+        parts.append(f"范围 {info['min']} ~ {info['max']}")
+    if "unique" in info:
+        parts.append(f"{info['unique']} 种")
+        if info.get("top"):
+            parts.append("常见: " + " / ".join(info["top"]))
+    return f"[{info['kind']}] " + ", ".join(parts)
+
+
+def _summarize_kinds(profiles: List[dict], indices: List[int]) -> str:
+    counts = OrderedDict()
+    for i in indices:
+        counts[profiles[i]["kind"]] = counts.get(profiles[i]["kind"], 0) + 1
+    return "、".join(f"{kind} {n} 列" for kind, n in counts.items())
+
+
+def render_table(profile: dict, query: str = "", budget: int = None, letters: bool = False,
+                 sample_rows: int = None) -> Tuple[str, dict]:
+    """
+    把画像按预算渲染成文本
+    :param letters: 是否标注 Excel 列字母 (公式生成需要)
+    :return: (文本, 指标)
+    """
+    start = time.perf_counter()
+    budget = budget or PROMPT_TABLE_BUDGET
+    sample_rows = PROMPT_SAMPLE_ROWS if sample_rows is None else sample_rows
+    columns, profiles = profile["columns"], profile["profiles"]
+    order = _column_priority(columns, query)
+
+    rows_text = f"{profile['rows']} 行" if profile["rows"] is not None else "行数未统计"
+    head = f"表格规模: {rows_text} × {len(columns)} 列" + ("" if profile["exact"] else f" (统计基于前 {PROMPT_PROFILE_ROWS} 行)")
+
+    def label(i):
+        return f"{get_col_letter(i)} {columns[i]}" if letters else columns[i]
+
+    # 1. 列名清单：按优先级放，放不下的列只给汇总
+    used = estimate_tokens(head)
+    listed = []
+    for i in order:
+        cost = estimate_tokens(label(i)) + 1
+        if used + cost > budget * _NAMES_SHARE and listed:
+            break
+        listed.append(i)
+        used += cost
+
+    # 2. 按优先级给已列出的列补统计信息
+    listed_set = set(listed)
+    detailed = set()
+    for i in [i for i in order if i in listed_set]:
+        cost = estimate_tokens(_stats_text(profiles[i])) + 1
+        if used + cost > budget * _STATS_SHARE:
+            break
+        detailed.add(i)
+        used += cost
+
+    lines = [head, "列 (按原顺序)" + (" [Excel 列字母 列名]" if letters else "") + ":"]
+    plain = []  # 连续的没有统计信息的列合并成一行，省 token
+    for i in sorted(listed):
+        if i in detailed:
+            if plain:
+                lines.append("- " + ", ".join(plain))
+                plain = []
+            lines.append(f"- {label(i)} {_stats_text(profiles[i])}")
+        else:
+            plain.append(label(i))
+    if plain:
+        lines.append("- " + ", ".join(plain))
+    omitted = [i for i in range(len(columns)) if i not in listed_set]
+    if omitted:
+        lines.append(f"(另有 {len(omitted)} 列未列出：{_summarize_kinds(profiles, omitted)}；代码中可用 df.columns 查看)")
+    body = "\n".join(lines)
+
+    # 3. 样例行：只含带统计的列 (没有则用已列出的列)，行数从多到少，放得下为止
+    sample_cols = sorted(detailed) or sorted(listed)
+    sample_text, shown = "", 0
+    remaining = budget - estimate_tokens(body)
+    for n in range(min(sample_rows, len(profile["sample"])), 0, -1):
+        table = [" | ".join(columns[i] for i in sample_cols)]
+        table += [" | ".join(row[i] for i in sample_cols) for row in profile["sample"][:n]]
+        note = "" if len(sample_cols) == len(columns) else f"，只含 {len(sample_cols)}/{len(columns)} 列"
+        candidate = f"样例数据 (前 {n} 行{note}):\n" + "\n".join(table)
+        if estimate_tokens(candidate) <= remaining:
+            sample_text, shown = candidate, n
+            break
+
+    text = body + ("\n" + sample_text if sample_text else "")
+    metrics = {
+        "tokens": estimate_tokens(text),
+        "budget": budget,
+        "columns": len(columns),
+        "columns_listed": len(listed),
+        "columns_detailed": len(detailed),
+        "sample_rows": shown,
+        "truncated": bool(omitted) or len(detailed) < len(columns) or shown < min(sample_rows, len(profile["sample"])),
+        "render_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+    with _lock:
+        _stats["tables"] += 1
+        _stats["truncated_tables"] += int(metrics["truncated"])
+    return text, metrics
+
+
+def build_table_context(file_path: str, query: str = "", sheet: str = None, df: pd.DataFrame = None,
+                        budget: int = None, letters: bool = False) -> Tuple[str, dict]:
+    """单表上下文：画像 (有缓存) + 按预算渲染"""
+    return render_table(profile_table(file_path, sheet, df), query, budget, letters)
+
+
+def build_multi_context(file_map: Dict[str, str], query: str = "", sheets: Dict[str, Optional[str]] = None,
+                        budget: int = None) -> Dict[str, Tuple[str, dict]]:
+    """
+    多表上下文：总预算按表数平分 (每张表至少 PROMPT_MIN_TABLE_BUDGET)
+    :return: {dfs key: (文本, 指标)}，读取失败的表为 (错误说明, {"error": ...})
+    """
+    per_table = max((budget or PROMPT_MULTI_BUDGET) // max(len(file_map), 1), PROMPT_MIN_TABLE_BUDGET)
+    contexts = {}
+    for key, path in file_map.items():
+        try:
+            contexts[key] = build_table_context(path, query, (sheets or {}).get(key), budget=per_table)
+        except Exception as e:
+            contexts[key] = (f"读取失败: {e}", {"error": str(e)})
+    return contexts
+
+
+# ================= 指标 =================
+
+def record_prompt(kind: str, system_prompt: str, user_message: str) -> dict:
+    """记录一次完整 Prompt 的大小 (构造完、发给模型之前调用)"""
+    chars = len(system_prompt or "") + len(user_message or "")
+    tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+    with _lock:
+        _stats["prompts"] += 1
+        _stats["tokens"] += tokens
+        _stats["max_tokens"] = max(_stats["max_tokens"], tokens)
+        entry = _by_kind.setdefault(kind, {"count": 0, "tokens": 0, "last_tokens": 0})
+        entry["count"] += 1
+        entry["tokens"] += tokens
+        entry["last_tokens"] = tokens
+    print(f"📏 Prompt [{kind}]: 约 {tokens} tokens ({chars} 字符)")
+    return {"kind": kind, "tokens": tokens, "chars": chars}
+
+
+def prompt_stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "avg_tokens": round(_stats["tokens"] / _stats["prompts"], 1) if _stats["prompts"] else 0.0,
+            "profiles_cached": len(_profiles),
+            "by_kind": {
+                kind: {**entry, "avg_tokens": round(entry["tokens"] / entry["count"], 1)}
+                for kind, entry in _by_kind.items()
+            },
+        }
+
+
+if __name__ == "__main__":
+    # 对比：200 列宽表，原来的 列映射 + to_markdown(5 行) vs 按预算构造
+    import numpy as np
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    rows, width = 2000, 200
+    frame = pd.DataFrame({f"指标{i:03d}": rng.random(rows) for i in range(width - 2)})
+    frame.insert(0, "姓名", [f"员工{i}" for i in range(rows)])
+    frame.insert(1, "部门", rng.choice(["销售", "财务", "研发"], rows))
+    path = os.path.join(tempfile.mkdtemp(), "wide.xlsx")
+    open(path, "wb").close()  # 画像 key 只需要文件存在，数据直接传 df
+
+    start = time.perf_counter()
+    old = " | ".join(f"【{get_col_letter(i)}列】: {c}" for i, c in enumerate(frame.columns)) + "\n" + \
+        frame.head(5).to_markdown(index=False)
+    old_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    text, metrics = build_table_context(path, "按部门汇总指标007", df=frame, letters=True)
+    first_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    build_table_context(path, "按部门汇总指标007", df=frame, letters=True)
+    cached_ms = (time.perf_counter() - start) * 1000
+
+    print(f"原来: 约 {estimate_tokens(old)} tokens, {old_ms:.1f} ms")
+    print(f"现在: 约 {metrics['tokens']} tokens, 首次 {first_ms:.1f} ms (含画像), 画像命中 {cached_ms:.1f} ms")
+    print(metrics)
+    print(text[:600])
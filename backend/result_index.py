@@ -0,0 +1,90 @@
+# backend/result_index.py
+"""
+派生结果索引
+
+同一份源文件 + 同样的指令 (模板库里反复点同一个模板最常见)，每次都要重新问 AI、重新执行，
+其实上次的结果文件早就作为子记录 (parent_id) 存在 FileRecord 里了。
+
+这里给结果记录打上 result_key：
+- key = sha256(源文件内容哈希列表, 规范化后的指令, 模板 id, 模型[, 选中的工作表])
+- 源文件内容相同 (content_hash 相同) 即可命中，不要求是同一条上传记录
+- 请求里带 force=True 时跳过查找、重新执行，新结果会成为该 key 的最新记录
+"""
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+
+from models import FileRecord
+from llm_client import LLM_MODEL
+
+
+def normalize_query(query: str) -> str:
+    """去掉首尾空白、合并连续空白，避免多敲一个空格就算作新指令"""
+    return " ".join((query or "").split())
+
+
+def source_fingerprint(record: FileRecord) -> str:
+    """源文件的内容指纹：有 content_hash 用哈希，没有 (旧记录 / 处理结果) 用记录 id"""
+    return record.content_hash or f"file:{record.id}"
+
+
+def make_result_key(sources: List[FileRecord], query: str, template_id: Optional[int] = None,
+                    sheets: Optional[list] = None) -> str:
+    """
+    :param sheets: 与 sources 对齐，每个源文件选中的工作表 (None 为默认的第一个工作表)
+                   全部为默认时不参与计算，与加入工作表选择之前生成的 key 保持一致
+    """
+    parts = [[source_fingerprint(r) for r in sources], normalize_query(query), template_id, LLM_MODEL]
+    if sheets and any(s is not None for s in sheets):
+        parts.append(list(sheets))
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def find_result(db: Session, result_key: str, force: bool = False) -> Optional[FileRecord]:
+    """
+    返回该 key 最新的、磁盘文件仍然存在的结果记录
+    :param force: 请求要求重新执行时直接返回 None，不查库
+    """
+    if force:
+        return None
+    candidates = (
+        db.query(FileRecord)
+        .filter(FileRecord.result_key == result_key)
+        .order_by(desc(FileRecord.upload_time), desc(FileRecord.id))
+        .limit(5)
+        .all()
+    )
+    for record in candidates:
+        if record.stored_path and os.path.exists(record.stored_path):
+            return record
+    return None
+
+
+def reuse_result(db: Session, hit: FileRecord, parent_id: int, filename: str) -> FileRecord:
+    """
+    命中的结果如果挂在别的父记录下 (内容相同的另一次上传)，
+    给当前父记录补一条子记录，共用同一个结果文件，历史列表里才能看到
+    """
+    if hit.parent_id == parent_id:
+        return hit
+
+    child = FileRecord(
+        filename=filename,
+        stored_path=hit.stored_path,
+        sidecar_path=hit.sidecar_path,
+        file_size=hit.file_size,
+        status="processed",
+        parent_id=parent_id,
+        result_key=hit.result_key,
+        raw_result=hit.raw_result,
+        sheet_names=hit.sheet_names
+    )
+    db.add(child)
+    db.commit()
+    db.refresh(child)
+    return child
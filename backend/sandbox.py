@@ -0,0 +1,282 @@
+# backend/sandbox.py
+"""
+AI 生成代码的执行沙箱
+
+AI 写的 pandas 代码 (公式、多表合并、数据分析) 可能跑飞：一个笛卡尔积 merge 或者超慢的 df.apply
+就能把整个进程池占满。这里单独维护一组预热好的工作进程专门执行这类代码：
+
+- 工作进程启动时就 import pandas / numpy / openpyxl，执行时不再付导入开销
+- 每次执行有墙钟超时 (SANDBOX_TIMEOUT)，超时直接杀掉该进程并补一个新的
+- 每个进程有内存上限 (RLIMIT_AS)，每次执行有 CPU 时间上限 (RLIMIT_CPU)；超限同样杀掉重建
+- 一个进程出问题只影响它正在执行的那一个任务，其他任务照常进行
+- 调用方取消 (后台任务被取消、请求被中止) 时立即杀掉正在执行的进程并补一个新的，不会让跑飞的代码继续占着 CPU
+- 数据不经过 pickle 传入：任务参数只是文件路径或共享内存句柄 (frame_handoff)，进程内直接挂载或读取
+
+资源限制依赖 resource 模块 (Linux / macOS)，Windows 上只有超时保护。
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from executors import run_blocking, CPU_WORKERS
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，只做超时保护
+    resource = None
+
+# ================= 配置区 =================
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(CPU_WORKERS)))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "60"))  # 单次执行墙钟超时 (秒)
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "120"))  # 单次执行 CPU 时间上限 (秒)，0 表示不限
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "4096"))  # 单个进程内存上限 (MB)，0 表示不限
+SANDBOX_START_TIMEOUT = float(os.getenv("SANDBOX_START_TIMEOUT", "60"))  # 工作进程启动 (导入依赖) 的等待上限
+SANDBOX_CANCEL_POLL = 0.1  # 等待结果时检查取消信号的间隔 (秒)
+# =========================================
+
+
+class SandboxError(Exception):
+    """沙箱内执行失败：进程崩溃、超出资源限制等"""
+
+
+class SandboxTimeout(SandboxError):
+    """执行超时，进程已被终止"""
+
+
+class SandboxCancelled(SandboxError):
+    """调用方取消了执行，进程已被终止"""
+
+
+# ================= 工作进程 =================
+
+def _apply_memory_limit(memory_mb: int):
+    if resource is None or memory_mb <= 0:
+        return
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _apply_cpu_limit(cpu_seconds: int):
+    """RLIMIT_CPU 是进程累计值：软上限设为“已用 + 本次额度”，超出时内核发 SIGXCPU 终止进程"""
+    if resource is None or cpu_seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn, memory_mb: int):
+    _apply_memory_limit(memory_mb)
+    # 预热：提前导入执行 AI 代码要用到的库
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        func, args, kwargs, cpu_seconds = message
+        _apply_cpu_limit(cpu_seconds)
+        try:
+            reply = ("ok", func(*args, **kwargs))
+        except BaseException as e:
+            reply = ("err", e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # 返回值 / 异常无法 pickle 时，改成字符串说明传回去
+            conn.send(("err", SandboxError(f"执行结果无法传回: {e!r}")))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, SANDBOX_MEMORY_MB), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self):
+        if self.ready:
+            return
+        if not self.conn.poll(SANDBOX_START_TIMEOUT):
+            raise SandboxError("沙箱进程启动超时")
+        try:
+            self.conn.recv()
+        except EOFError:
+            raise SandboxError("沙箱进程启动失败")
+        self.ready = True
+
+    def stop(self, kill: bool = False):
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(5)
+        self.conn.close()
+
+
+# ================= 进程池 =================
+
+class SandboxPool:
+    def __init__(self, size: int = None):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"runs": 0, "errors": 0, "timeouts": 0, "cancelled": 0, "respawns": 0}
+        for _ in range(size or SANDBOX_WORKERS):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker: _Worker):
+        """杀掉出问题的进程并补一个新的"""
+        worker.stop(kill=True)
+        with self._lock:
+            self._workers.discard(worker)
+            self.stats["respawns"] += 1
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def _wait_result(self, worker: _Worker, timeout: float, cancel: threading.Event = None):
+        """等结果，期间定时检查取消信号；超时抛 SandboxTimeout，被取消抛 SandboxCancelled"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["timeouts"] += 1
+                raise SandboxTimeout(f"代码执行超时 (超过 {timeout:g} 秒)，已终止")
+            if worker.conn.poll(min(remaining, SANDBOX_CANCEL_POLL) if cancel is not None else remaining):
+                return
+            if cancel is not None and cancel.is_set():
+                self.stats["cancelled"] += 1
+                raise SandboxCancelled("执行已取消，已终止")
+
+    def run_sync(self, func, args=(), kwargs=None, timeout: float = None, cancel: threading.Event = None):
+        """
+        在沙箱进程中执行 func(*args, **kwargs) 并等待结果 (阻塞调用)
+        func 必须是模块级函数，参数和返回值要能 pickle
+        :param cancel: 可选，其他线程 set() 之后立即杀掉执行进程并抛出 SandboxCancelled
+        """
+        timeout = timeout or SANDBOX_TIMEOUT
+        worker = self._idle.get()
+        healthy = False
+        try:
+            worker.wait_ready()
+            if cancel is not None and cancel.is_set():
+                # 排队等空闲进程期间就被取消了，进程还没用过，不用杀
+                healthy = True
+                raise SandboxCancelled("执行已取消")
+            started = time.perf_counter()
+            try:
+                worker.conn.send((func, args, kwargs or {}, SANDBOX_CPU_SECONDS))
+            except (BrokenPipeError, ConnectionResetError):
+                raise SandboxError("沙箱进程已退出")
+            self._wait_result(worker, timeout, cancel)
+            try:
+                status, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                raise SandboxError("执行进程异常退出 (可能超出 CPU 时间或内存限制)")
+
+            self.stats["runs"] += 1
+            if status == "ok":
+                healthy = True
+                print(f"🧪 沙箱执行完成: {func.__name__} ({round((time.perf_counter() - started) * 1000, 2)} ms)")
+                return payload
+            if isinstance(payload, MemoryError):
+                raise SandboxError(f"代码执行超出内存限制 ({SANDBOX_MEMORY_MB} MB)")
+            # 普通异常：进程本身没问题，原样抛给调用方
+            healthy = True
+            raise payload
+        except SandboxError:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            if healthy:
+                self._idle.put(worker)
+            else:
+                self._replace(worker)
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox() -> SandboxPool:
+    """首次调用时启动工作进程 (API 启动时调用一次即可预热)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool()
+    return _pool
+
+
+def run_sandboxed_sync(func, *args, **kwargs):
+    """同步版本：批处理等后台逻辑使用"""
+    return get_sandbox().run_sync(func, args, kwargs)
+
+
+async def run_sandboxed(func, *args, **kwargs):
+    """
+    异步版本：在线程里等待沙箱结果，不占用事件循环
+    协程被取消 (job_service.cancel_job 等) 时通知等待线程杀掉执行进程，而不是让它在后台跑完
+    """
+    cancel = threading.Event()
+    # 线程里的等待不能被直接打断 (取消会一直推迟到线程返回)，所以用 shield 包一层：
+    # 外层被取消时立即发出信号，等线程杀掉进程、退出后再把取消传上去
+    waiter = asyncio.ensure_future(run_blocking(get_sandbox().run_sync, func, args, kwargs, None, cancel))
+    try:
+        return await asyncio.shield(waiter)
+    except asyncio.CancelledError:
+        cancel.set()
+        try:
+            await waiter
+        except BaseException:
+            pass
+        raise
+
+
+def sandbox_stats() -> dict:
+    if _pool is None:
+        return {"workers": 0}
+    return {"workers": SANDBOX_WORKERS, "idle": _pool._idle.qsize(), **_pool.stats}
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,94 @@
+# backend/schema_index.py
+"""
+表结构指纹
+
+批处理按列结构分组时，原来要把每个文件的表头重新读一遍；分组结果用完就丢。
+这里在上传时算一次表结构指纹存进 FileRecord，之后分组、"找同结构的文件"都是纯数据库查询：
+
+- schema_fingerprint: 有序的 (列名, 类型) 列表的哈希，列顺序、类型都一样才相同 (严格)
+- column_set_hash:    排序后的列名集合的哈希，只看有哪些列 (宽松，批处理分组用的就是这个口径)
+
+类型只取粗粒度：number / bool / datetime / string，同一列有没有空值 (int 变 float) 不影响指纹。
+"""
+import hashlib
+import json
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+
+from columnar_store import read_head
+from models import FileRecord
+
+# 指纹算法有变化时递增，旧指纹自然不再匹配
+SCHEMA_VERSION = 1
+# 推断类型时读取的行数 (有旁路文件时类型以旁路文件 schema 为准，这个行数只影响没有旁路文件的情况)
+SCHEMA_SAMPLE_ROWS = 100
+
+
+def _kind(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "string"
+
+
+def read_schema(file_path: str) -> List[list]:
+    """[[列名, 类型], ...]，只读开头几行 (有旁路文件时只解码第一个数据块)"""
+    df = read_head(file_path, SCHEMA_SAMPLE_ROWS)
+    return [[str(col), _kind(dtype)] for col, dtype in df.dtypes.items()]
+
+
+def _digest(value) -> str:
+    raw = json.dumps([SCHEMA_VERSION, value], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fingerprint_schema(schema: List[list]) -> dict:
+    return {
+        "schema_fingerprint": _digest(schema),
+        "column_set_hash": _digest(sorted(name for name, _ in schema)),
+    }
+
+
+def compute_schema(file_path: str) -> dict:
+    """上传时调用：{"schema_fingerprint", "column_set_hash"}"""
+    return fingerprint_schema(read_schema(file_path))
+
+
+def find_same_schema(db: Session, record: FileRecord, strict: bool = True, limit: int = 100) -> List[FileRecord]:
+    """与 record 结构相同的其他上传文件 (按上传时间倒序)"""
+    if strict:
+        if not record.schema_fingerprint:
+            return []
+        condition = FileRecord.schema_fingerprint == record.schema_fingerprint
+    else:
+        if not record.column_set_hash:
+            return []
+        condition = FileRecord.column_set_hash == record.column_set_hash
+
+    return (
+        db.query(FileRecord)
+        .filter(condition, FileRecord.parent_id.is_(None), FileRecord.id != record.id)
+        .order_by(desc(FileRecord.upload_time), desc(FileRecord.id))
+        .limit(limit)
+        .all()
+    )
+
+
+def schemas_for_paths(db: Session, file_paths: List[str]) -> List[Optional[dict]]:
+    """
+    批处理分组用：按文件路径从数据库取指纹，与 file_paths 顺序一致，库里没有的为 None
+    (上传的文件按内容寻址保存，同一路径的记录指纹必然相同，任取一条即可)
+    """
+    rows = (
+        db.query(FileRecord.stored_path, FileRecord.schema_fingerprint, FileRecord.column_set_hash)
+        .filter(FileRecord.stored_path.in_(list(set(file_paths))), FileRecord.column_set_hash.isnot(None))
+        .all()
+    )
+    found = {path: {"schema_fingerprint": strict, "column_set_hash": loose} for path, strict, loose in rows}
+    return [found.get(path) for path in file_paths]
@@ -0,0 +1,38 @@
+# backend/tests/conftest.py
+"""
+后端模块都是平铺在 backend/ 下直接 import 的 (uvicorn 也是在 backend/ 目录里启动)，
+这里把 backend/ 加进 sys.path，在仓库任意位置运行 pytest 都能找到它们。
+
+需要数据库的测试用内存 SQLite (session_factory / db 两个 fixture)。
+database 模块在导入时就创建 PostgreSQL 引擎，没装驱动的环境这些测试会跳过。
+"""
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def session_factory():
+    """每个测试一个全新的内存库，建好所有表"""
+    models = pytest.importorskip("models")
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    try:
+        yield session
+    finally:
+        session.close()
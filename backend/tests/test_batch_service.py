@@ -0,0 +1,90 @@
+# backend/tests/test_batch_service.py
+"""批处理分组：按列名集合分组 (忽略列顺序)，每组只问一次 AI，结果按输入顺序返回"""
+import pandas as pd
+import pytest
+
+# batch_service 依赖 models (database 模块导入时就创建 PostgreSQL 引擎)，没装驱动的环境跳过
+batch_service = pytest.importorskip("batch_service")
+
+AI_RESULT = {"action_type": "formula", "mode": "column", "python_expression": "'ok'", "target_position": "结果"}
+
+
+@pytest.fixture
+def files(tmp_path):
+    frames = {
+        "a.xlsx": pd.DataFrame({"工号": [1, 2], "金额": [10, 20]}),
+        "dept.xlsx": pd.DataFrame({"部门": ["研发", "销售"]}),
+        "b.xlsx": pd.DataFrame({"金额": [30], "工号": [3]}),  # 与 a.xlsx 列顺序不同，仍是同一组
+    }
+    paths = {}
+    for name, df in frames.items():
+        paths[name] = str(tmp_path / name)
+        df.to_excel(paths[name], index=False)
+    return paths
+
+
+@pytest.fixture
+def suggestions(monkeypatch):
+    """记录每次 AI 请求的 (代表文件, 严格指纹)；沙箱换成当前进程直接执行"""
+    calls = []
+
+    def fake_suggest(rep_file, user_requirement, schema_fingerprint=None):
+        calls.append((rep_file, schema_fingerprint))
+        return dict(AI_RESULT)
+
+    monkeypatch.setattr(batch_service, "_suggest_for_schema", fake_suggest)
+    monkeypatch.setattr(batch_service, "run_sandboxed_sync", lambda func, *args, **kwargs: func(*args, **kwargs))
+    return calls
+
+
+def test_groups_scanned_files_by_column_set(files, suggestions, tmp_path):
+    broken = tmp_path / "broken.xlsx"
+    broken.write_bytes(b"not an excel file")
+    paths = [files["a.xlsx"], files["dept.xlsx"], files["b.xlsx"], str(broken)]
+
+    results = batch_service.batch_process_files(paths, "加一列", scan_workers=2, apply_workers=2)
+
+    # 两种结构各问一次 AI，代表文件是组内输入顺序的第一个
+    assert sorted(rep for rep, _ in suggestions) == sorted([files["a.xlsx"], files["dept.xlsx"]])
+    assert [r["original_file"] for r in results] == paths
+    assert [r["status"] for r in results] == ["success", "success", "success", "failed"]
+    assert results[0]["group_signature"] == results[2]["group_signature"] != results[1]["group_signature"]
+    assert "无法读取表头" in results[3]["error"]
+    assert pd.read_excel(results[2]["processed_file"])["结果"].tolist() == ["ok"]
+
+
+def test_stored_schemas_are_used_without_rescanning(files, suggestions):
+    # 指纹由调用方从库里查好传入：按传入的 column_set_hash 分组，严格指纹传给 AI 复用缓存
+    paths = [files["a.xlsx"], files["dept.xlsx"]]
+    schemas = [{"schema_fingerprint": "strict-1", "column_set_hash": "loose-1"}] * 2
+
+    results = batch_service.batch_process_files(paths, "加一列", schemas=schemas)
+
+    assert suggestions == [(files["a.xlsx"], "strict-1")]
+    assert [r["group_signature"] for r in results] == ["loose-1", "loose-1"]
+
+
+def test_ai_error_fails_whole_group(files, monkeypatch, suggestions):
+    monkeypatch.setattr(batch_service, "_suggest_for_schema",
+                        lambda *args: {"action_type": "error", "explanation": "看不懂"})
+    paths = [files["a.xlsx"], files["b.xlsx"]]
+
+    results = batch_service.batch_process_files(paths, "加一列", schemas=[None, None])
+
+    assert [(r["status"], r["error"]) for r in results] == [("failed", "看不懂")] * 2
+
+
+def test_apply_workers_capped_by_sandbox_size(files, suggestions, monkeypatch):
+    seen = []
+    real_pool = batch_service.ThreadPoolExecutor
+
+    def recording_pool(max_workers=None, **kwargs):
+        seen.append(max_workers)
+        return real_pool(max_workers=max_workers, **kwargs)
+
+    monkeypatch.setattr(batch_service, "SANDBOX_WORKERS", 2)
+    monkeypatch.setattr(batch_service, "ThreadPoolExecutor", recording_pool)
+    schemas = [{"schema_fingerprint": "s", "column_set_hash": "g"}]
+    batch_service.batch_process_files([files["a.xlsx"]], "加一列", apply_workers=16, llm_workers=1, schemas=schemas)
+
+    assert seen == [1, 2]
@@ -0,0 +1,62 @@
+# backend/tests/test_code_columns.py
+"""多表代码的列裁剪分析：只有能证明不依赖其他列时才裁剪，拿不准的一律整表加载 (None)"""
+import pytest
+
+from code_columns import plan_columns
+
+FILES = {
+    "a.xlsx": ["工号", "姓名", "实发", "部门"],
+    "b.xlsx": ["工号", "部门", "备注"],
+}
+
+
+@pytest.mark.parametrize("code, expected", [
+    # 按常量列名取列 / 多列投影 / 属性取列，结果按原表列顺序
+    ("result_df = dfs['a.xlsx'][['实发', '工号']].merge(dfs['b.xlsx'][['工号', '部门']], on='工号')",
+     {"a.xlsx": ["工号", "实发"], "b.xlsx": ["工号", "部门"]}),
+    ("result_df = dfs['a.xlsx'].姓名.to_frame()", {"a.xlsx": ["姓名"], "b.xlsx": ["工号"]}),
+    # 别名只绑定一次：通过别名取列同样可以裁剪
+    ("d = dfs['a.xlsx']\nresult_df = d[['工号']].assign(x=d['实发'])", {"a.xlsx": ["工号", "实发"], "b.xlsx": ["工号"]}),
+    # 用到了全部列：不必裁剪
+    ("result_df = dfs['b.xlsx'][['工号', '部门', '备注']]", {"a.xlsx": ["工号"], "b.xlsx": None}),
+])
+def test_constant_column_access_is_pruned(code, expected):
+    assert plan_columns(code, FILES) == expected
+
+
+@pytest.mark.parametrize("code", [
+    # 别名被重新赋值
+    "d = dfs['a.xlsx']\nd = d[d['实发'] > 0]\nresult_df = d[['工号']]",
+    # 写列 (Store)：直接写、通过别名写
+    "dfs['a.xlsx']['新列'] = 1\nresult_df = dfs['a.xlsx'][['工号']]",
+    "d = dfs['a.xlsx']\nd['新列'] = d['实发'] * 2\nresult_df = d",
+    # 动态 / 计算出来的列名
+    "col = '实发'\nresult_df = dfs['a.xlsx'][col]",
+    "result_df = dfs['a.xlsx']['实' + '发']",
+    "result_df = dfs['a.xlsx'][[c for c in ['工号']]]",
+    # df.columns / iloc / loc / 整表使用
+    "result_df = dfs['a.xlsx'][list(dfs['a.xlsx'].columns[:2])]",
+    "result_df = dfs['a.xlsx'].iloc[:, 0:2]",
+    "result_df = dfs['a.xlsx'].loc[:, '工号']",
+    "result_df = dfs['a.xlsx'].merge(dfs['b.xlsx'][['工号']], on='工号')",
+    "result_df = dfs['a.xlsx'][dfs['a.xlsx']['实发'] > 0]",
+])
+def test_unprovable_access_loads_whole_table(code):
+    assert plan_columns(code, FILES)["a.xlsx"] is None
+
+
+@pytest.mark.parametrize("code", [
+    "name = 'a.xlsx'\nresult_df = dfs[name][['工号']]",
+    "result_df = pd.concat(list(dfs.values()))",
+    "result_df = eval(\"dfs['a.xlsx']\")[['工号']]",
+    "result_df = getattr(dfs['a.xlsx'], '工号').to_frame()",
+    "result_df = dfs['不存在.xlsx']",
+    "result_df = dfs['a.xlsx'][['工号']",  # 语法错误
+])
+def test_dynamic_code_loads_everything(code):
+    assert plan_columns(code, FILES) == {"a.xlsx": None, "b.xlsx": None}
+
+
+def test_unknown_column_names_are_ignored():
+    # 写错的列名不在计划里 (执行时照样 KeyError)，一列都没命中时留第一列保住行数
+    assert plan_columns("result_df = dfs['a.xlsx'][['不存在']]", FILES)["a.xlsx"] == ["工号"]
@@ -0,0 +1,59 @@
+# backend/tests/test_excel_ops.py
+"""excel_ops 的整列实现必须与逐行 (标量) 实现逐元素一致"""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import excel_ops
+from excel_ops import _to_float, _to_float_vec
+
+
+def _same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) == type(b)
+
+
+@pytest.mark.parametrize("series", [
+    pd.Series(["1_000", "nan", "NaN", " 12 ", "inf", "１２", "0x1A", "", "abc", "1e3", "-2.5"], dtype=object),
+    pd.Series([1, "2", None, np.nan, pd.NaT, pd.Timestamp("2020-01-01"), True, 3.5], dtype=object),
+    pd.Series([1.5, np.nan, 3.0]),
+    pd.Series([1, 2, 3]),
+    pd.Series([True, False]),
+    pd.Series([1, None, 3], dtype="Int64"),
+    pd.Series([1.5, None], dtype="Float64"),
+    pd.Series(pd.to_datetime(["2020-01-01", None])),
+    pd.Series(pd.to_timedelta(["1 day", None])),
+    pd.Series(["1", "x", None], dtype="string"),
+    pd.Series(["1", "x", "1"], dtype="category"),
+])
+def test_to_float_vec_matches_scalar(series):
+    expected = [_to_float(v) for v in series.astype(object).tolist()]
+    actual = _to_float_vec(series)
+    assert actual.dtype == float
+    assert all(_same(a, e) for a, e in zip(actual.tolist(), expected)), (actual.tolist(), expected)
+
+
+@pytest.mark.parametrize("digits", [0, 1, 2, -1])
+def test_round_vector_matches_scalar(digits):
+    series = pd.Series([2.675, 1.005, 0.5, 1.5, -2.5, 1234.5678, "3.145", None])
+    expected = [excel_ops.EXCEL_ROUND(v, digits) for v in series.tolist()]
+    actual = excel_ops.EXCEL_ROUND(series, digits)
+    assert all(_same(a, e) for a, e in zip(actual.tolist(), expected)), (actual.tolist(), expected)
+
+
+def test_vlookup_vector_keeps_integer_results():
+    keys = pd.Series(["张三", "李四", "张三"])
+    result = excel_ops.EXCEL_VLOOKUP_DICT(keys, {"张三": 1, "李四": 2})
+    assert pd.api.types.is_integer_dtype(result)
+    assert result.tolist() == [1, 2, 1]
+
+
+def test_vlookup_vector_matches_scalar_with_default():
+    keys = pd.Series(["张三", "王五", None, 1])
+    table = {"张三": 10, 1: 2.5}
+    result = excel_ops.EXCEL_VLOOKUP_DICT(keys, table, "未找到")
+    expected = [excel_ops.EXCEL_VLOOKUP_DICT(k, table, "未找到") for k in keys.tolist()]
+    assert all(_same(a, e) for a, e in zip(result.tolist(), expected)), (result.tolist(), expected)
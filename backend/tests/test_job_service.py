@@ -0,0 +1,74 @@
+# backend/tests/test_job_service.py
+"""后台任务的状态：业务失败 (success=False) 记为 failed，取消记为 cancelled"""
+import asyncio
+
+import pytest
+
+# database 模块在导入时就创建 PostgreSQL 引擎，没装驱动的环境跳过
+job_service = pytest.importorskip("job_service")
+
+
+@pytest.fixture(autouse=True)
+def _use_test_db(session_factory, monkeypatch):
+    monkeypatch.setattr(job_service, "SessionLocal", session_factory)
+    monkeypatch.setattr(job_service, "_slots", None)
+
+
+def _run_job(runner, cancel_after: float = None):
+    async def main():
+        job_id = await job_service.submit_job("test", {}, runner)
+        task = job_service._tasks[job_id]
+        if cancel_after is not None:
+            await asyncio.sleep(cancel_after)
+            assert job_service.cancel_job(job_id)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return job_id
+    return asyncio.run(main())
+
+
+def _job(session_factory, job_id):
+    db = session_factory()
+    try:
+        return job_service.get_job(db, job_id)
+    finally:
+        db.close()
+
+
+def test_success_result_marks_succeeded(session_factory):
+    async def runner(job):
+        await job.stage("execute")
+        return {"success": True, "file_id": 1}
+
+    job = _job(session_factory, _run_job(runner))
+    assert job["status"] == "succeeded"
+    assert job["progress"] == 100
+    assert job["result"] == {"success": True, "file_id": 1}
+
+
+def test_success_false_result_marks_failed(session_factory):
+    async def runner(job):
+        return {"success": False, "msg": "AI 分析失败: 列不存在"}
+
+    job = _job(session_factory, _run_job(runner))
+    assert job["status"] == "failed"
+    assert job["error"] == "AI 分析失败: 列不存在"
+
+
+def test_exception_marks_failed(session_factory):
+    async def runner(job):
+        raise ValueError("boom")
+
+    job = _job(session_factory, _run_job(runner))
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
+
+
+def test_cancel_marks_cancelled(session_factory):
+    async def runner(job):
+        await asyncio.sleep(30)
+
+    job = _job(session_factory, _run_job(runner, cancel_after=0.2))
+    assert job["status"] == "cancelled"
@@ -0,0 +1,227 @@
+# backend/tests/test_llm_client.py
+"""
+llm_client 的连接层：用本机 http.server 模拟 DeepSeek 接口
+- 429 / 5xx 重试 (遵守 Retry-After)
+- 不可重试的 4xx 直接抛 LLMError
+- 读取超时
+- SSE 增量拼接 (只有完整收到 [DONE] 的非空回复才写缓存)
+同步、异步两条路径都覆盖。
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_cache
+import llm_client
+from llm_client import LLMError
+
+
+def _reply(content):
+    return json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+
+
+def _sse(*deltas, done=True):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]}, ensure_ascii=False)}\n\n" for d in deltas]
+    if done:
+        lines.append("data: [DONE]\n\n")
+    return [line.encode("utf-8") for line in lines]
+
+
+class MockServer:
+    """按顺序返回预先排好的响应：(状态码, 响应头, 正文 或 SSE 分块列表, 返回前等待的秒数)"""
+
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                server.requests.append(json.loads(self.rfile.read(length)))
+                status, headers, body, delay = server.script.pop(0)
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(body, list):
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for chunk in body:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                else:
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/chat/completions"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def add(self, status=200, body=b"", headers=None, delay=0):
+        self.script.append((status, headers or {}, body, delay))
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    srv = MockServer()
+    monkeypatch.setattr(llm_client, "API_URL", srv.url)
+    monkeypatch.setattr(llm_client, "LLM_READ_TIMEOUT", 0.5)
+    monkeypatch.setattr(llm_client, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.0)
+    # 连接池 / 异步客户端按当前配置重新创建
+    monkeypatch.setattr(llm_client, "_session", None)
+    monkeypatch.setattr(llm_client, "_async_client", None)
+    yield srv
+    srv.close()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """不碰磁盘上的缓存文件，记录写入了什么"""
+    written = {}
+    monkeypatch.setattr(llm_cache, "get", lambda key: None)
+    monkeypatch.setattr(llm_cache, "put", lambda key, value: written.__setitem__(key, value))
+    return written
+
+
+def _run(coro_fn):
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            await llm_client.close_async_client()
+    return asyncio.run(main())
+
+
+async def _collect(agen):
+    return [delta async for delta in agen]
+
+
+def _call_sync(system, user):
+    return llm_client.call_deepseek_raw(system, user, use_cache=False)
+
+
+def _call_async(system, user):
+    return _run(lambda: llm_client.call_deepseek_async(system, user, use_cache=False))
+
+
+def _stream_sync(system, user):
+    return list(llm_client.stream_deepseek(system, user, use_cache=False))
+
+
+def _stream_async(system, user):
+    return _run(lambda: _collect(llm_client.stream_deepseek_async(system, user, use_cache=False)))
+
+
+CALLS = pytest.mark.parametrize("call", [_call_sync, _call_async], ids=["sync", "async"])
+STREAMS = pytest.mark.parametrize("stream", [_stream_sync, _stream_async], ids=["sync", "async"])
+
+
+@CALLS
+def test_retries_5xx_then_succeeds(server, cache, call):
+    server.add(503, b"busy")
+    server.add(500, b"oops")
+    server.add(200, _reply("好的"))
+
+    assert call("sys", "user") == "好的"
+    assert len(server.requests) == 3
+    assert server.requests[0]["messages"][1]["content"] == "user"
+
+
+@CALLS
+def test_429_honours_retry_after(server, cache, call):
+    server.add(429, b"slow down", headers={"Retry-After": "0.4"})
+    server.add(200, _reply("ok"))
+
+    start = time.perf_counter()
+    assert call("sys", "user") == "ok"
+    assert time.perf_counter() - start >= 0.4
+    assert len(server.requests) == 2
+
+
+@CALLS
+def test_gives_up_after_max_retries(server, cache, call):
+    for _ in range(3):
+        server.add(502, b"bad gateway")
+
+    with pytest.raises(LLMError) as exc:
+        call("sys", "user")
+    assert exc.value.status_code == 502
+    assert len(server.requests) == 3
+
+
+@CALLS
+def test_non_retryable_4xx_raises_immediately(server, cache, call):
+    server.add(401, b"invalid key")
+    server.add(200, _reply("should not be used"))
+
+    with pytest.raises(LLMError) as exc:
+        call("sys", "user")
+    assert exc.value.status_code == 401
+    assert "invalid key" in str(exc.value)
+    assert len(server.requests) == 1
+
+
+@CALLS
+def test_read_timeout_is_retried_then_raised(server, cache, call, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MAX_RETRIES", 1)
+    server.add(200, _reply("too late"), delay=1.5)
+    server.add(200, _reply("too late"), delay=1.5)
+
+    start = time.perf_counter()
+    with pytest.raises(LLMError) as exc:
+        call("sys", "user")
+    assert exc.value.status_code is None
+    assert "网络错误" in str(exc.value)
+    assert len(server.requests) == 2
+    assert time.perf_counter() - start < 2.5  # 没有等满服务端的 1.5 秒 x 2
+
+
+@STREAMS
+def test_stream_assembles_deltas_and_caches(server, cache, stream):
+    server.add(200, _sse("共有", "200 ", "行"))
+
+    assert stream("sys", "user") == ["共有", "200 ", "行"]
+    assert server.requests[0]["stream"] is True
+    assert list(cache.values()) == ["共有200 行"]
+
+
+@STREAMS
+def test_stream_retries_before_first_byte(server, cache, stream):
+    server.add(503, b"busy")
+    server.add(200, _sse("ok"))
+
+    assert stream("sys", "user") == ["ok"]
+    assert len(server.requests) == 2
+
+
+@STREAMS
+def test_stream_without_done_is_not_cached(server, cache, stream):
+    server.add(200, _sse("半截", done=False))
+
+    assert stream("sys", "user") == ["半截"]
+    assert cache == {}
+
+
+@STREAMS
+def test_empty_stream_is_not_cached(server, cache, stream):
+    server.add(200, _sse())
+
+    assert stream("sys", "user") == []
+    assert cache == {}
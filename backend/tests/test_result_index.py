@@ -0,0 +1,94 @@
+# backend/tests/test_result_index.py
+"""派生结果复用：key 的口径、查找时跳过已删除的结果文件、跨父记录复用时补子记录"""
+import datetime
+
+import pytest
+
+# result_index 依赖 models (database 模块导入时就创建 PostgreSQL 引擎)，没装驱动的环境跳过
+result_index = pytest.importorskip("result_index")
+from result_index import normalize_query, make_result_key, find_result, reuse_result  # noqa: E402
+from models import FileRecord  # noqa: E402
+
+
+def _source(db, content_hash="abc", name="工资表.xlsx"):
+    record = FileRecord(filename=name, stored_path=f"/uploads/{name}", content_hash=content_hash)
+    db.add(record)
+    db.commit()
+    return record
+
+
+def _result(db, tmp_path, key, parent, name, minutes=0, exists=True):
+    path = tmp_path / name
+    if exists:
+        path.write_bytes(b"xlsx")
+    record = FileRecord(filename=name, stored_path=str(path), status="processed", parent_id=parent.id,
+                        result_key=key, raw_result={"python_expression": "1"}, sheet_names=["Sheet1"],
+                        upload_time=datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=minutes))
+    db.add(record)
+    db.commit()
+    return record
+
+
+def test_whitespace_variants_share_a_key(db):
+    src = _source(db)
+    assert normalize_query("  按工号\t合并 \n 两张表 ") == "按工号 合并 两张表"
+    assert make_result_key([src], "按工号 合并") == make_result_key([src], " 按工号   合并\n")
+    assert make_result_key([src], "按工号合并") != make_result_key([src], "按工号 合并")
+    assert make_result_key([src], "按工号 合并", template_id=1) != make_result_key([src], "按工号 合并")
+
+
+def test_same_content_different_upload_shares_a_key(db):
+    first, second = _source(db, "same", "a.xlsx"), _source(db, "same", "b.xlsx")
+    assert make_result_key([first], "求和") == make_result_key([second], "求和")
+    # 没有内容哈希的旧记录按 id 区分
+    old_a, old_b = _source(db, None, "c.xlsx"), _source(db, None, "d.xlsx")
+    assert make_result_key([old_a], "求和") != make_result_key([old_b], "求和")
+
+
+def test_default_sheet_key_matches_keys_made_before_sheet_selection(db):
+    src = _source(db)
+    before = make_result_key([src], "求和")
+    assert make_result_key([src], "求和", sheets=[None]) == before
+    assert make_result_key([src], "求和", sheets=[]) == before
+    assert make_result_key([src], "求和", sheets=["Sheet2"]) != before
+
+
+def test_find_result_returns_latest_existing_file(db, tmp_path):
+    src = _source(db)
+    key = make_result_key([src], "求和")
+    older = _result(db, tmp_path, key, src, "older.xlsx", minutes=1)
+    _result(db, tmp_path, key, src, "deleted.xlsx", minutes=2, exists=False)  # 结果文件已被删除
+    _result(db, tmp_path, "other-key", src, "other.xlsx", minutes=3)
+
+    assert find_result(db, key).id == older.id
+    assert find_result(db, "missing-key") is None
+
+
+def test_force_skips_lookup(db, tmp_path):
+    src = _source(db)
+    key = make_result_key([src], "求和")
+    _result(db, tmp_path, key, src, "hit.xlsx")
+    assert find_result(db, key) is not None
+    assert find_result(db, key, force=True) is None
+
+
+def test_reuse_under_same_parent_returns_hit(db, tmp_path):
+    src = _source(db)
+    hit = _result(db, tmp_path, "k", src, "hit.xlsx")
+    assert reuse_result(db, hit, src.id, "处理结果.xlsx") is hit
+    assert db.query(FileRecord).count() == 2
+
+
+def test_reuse_under_other_parent_creates_child(db, tmp_path):
+    first, second = _source(db, "same", "a.xlsx"), _source(db, "same", "b.xlsx")
+    hit = _result(db, tmp_path, "k", first, "hit.xlsx")
+
+    child = reuse_result(db, hit, second.id, "处理结果_b.xlsx")
+
+    assert child.id != hit.id
+    assert child.parent_id == second.id
+    assert child.filename == "处理结果_b.xlsx"
+    assert (child.stored_path, child.result_key, child.raw_result, child.sheet_names) == \
+        (hit.stored_path, hit.result_key, hit.raw_result, hit.sheet_names)
+    # 之后同样的请求按 key 查到的是最新的这条子记录，指向同一个结果文件
+    assert find_result(db, "k").stored_path == hit.stored_path
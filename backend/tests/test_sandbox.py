@@ -0,0 +1,68 @@
+# backend/tests/test_sandbox.py
+"""沙箱取消：调用方取消后，正在执行的进程要被立即杀掉，而不是在后台跑完"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import sandbox
+from sandbox import SandboxPool, SandboxCancelled
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = SandboxPool(size=1)
+    # 先等进程启动完 (导入依赖可能要好几秒)，下面固定等 1 秒时任务一定已经发到进程里了
+    for worker in list(pool._workers):
+        worker.wait_ready()
+    monkeypatch.setattr(sandbox, "_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+def _busy_worker(pool):
+    with pool._lock:
+        return next(iter(pool._workers))
+
+
+def test_cancel_event_kills_running_worker(pool):
+    cancel = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            pool.run_sync(time.sleep, (30,), cancel=cancel)
+        except SandboxCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(1)
+    busy = _busy_worker(pool)
+
+    start = time.perf_counter()
+    cancel.set()
+    thread.join(10)
+    assert time.perf_counter() - start < 5
+    assert errors and not busy.process.is_alive()
+    assert pool.stats["cancelled"] == 1
+    # 补了一个新进程，后续任务照常执行
+    assert pool.run_sync(abs, (-3,)) == 3
+
+
+def test_cancelling_run_sandboxed_kills_worker(pool):
+    async def main():
+        task = asyncio.ensure_future(sandbox.run_sandboxed(time.sleep, 30))
+        await asyncio.sleep(1)
+        busy = _busy_worker(pool)
+        start = time.perf_counter()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return busy, time.perf_counter() - start
+
+    busy, elapsed = asyncio.run(main())
+    assert elapsed < 5
+    assert not busy.process.is_alive()
+    assert pool.stats["cancelled"] == 1
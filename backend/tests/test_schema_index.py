@@ -0,0 +1,85 @@
+# backend/tests/test_schema_index.py
+"""表结构指纹：严格指纹看列顺序和类型，宽松指纹只看列名集合"""
+import pandas as pd
+import pytest
+
+# schema_index 依赖 models (database 模块导入时就创建 PostgreSQL 引擎)，没装驱动的环境跳过
+schema_index = pytest.importorskip("schema_index")
+from schema_index import fingerprint_schema, compute_schema, find_same_schema, schemas_for_paths  # noqa: E402
+from models import FileRecord  # noqa: E402
+
+
+def test_column_order_only_changes_strict_fingerprint():
+    a = fingerprint_schema([["工号", "number"], ["姓名", "string"]])
+    b = fingerprint_schema([["姓名", "string"], ["工号", "number"]])
+    assert a["column_set_hash"] == b["column_set_hash"]
+    assert a["schema_fingerprint"] != b["schema_fingerprint"]
+
+
+def test_type_change_only_changes_strict_fingerprint():
+    a = fingerprint_schema([["工号", "number"], ["姓名", "string"]])
+    b = fingerprint_schema([["工号", "string"], ["姓名", "string"]])
+    assert a["column_set_hash"] == b["column_set_hash"]
+    assert a["schema_fingerprint"] != b["schema_fingerprint"]
+
+
+def test_fingerprint_is_stable():
+    schema = [["工号", "number"], ["日期", "datetime"]]
+    assert fingerprint_schema(schema) == fingerprint_schema([list(c) for c in schema])
+    assert fingerprint_schema(schema) != fingerprint_schema(schema + [["备注", "string"]])
+
+
+def _save(tmp_path, name, df):
+    path = tmp_path / name
+    df.to_excel(path, index=False)
+    return str(path)
+
+
+def test_compute_schema_from_files(tmp_path):
+    base = pd.DataFrame({"工号": [1, 2], "姓名": ["张三", "李四"], "金额": [1.5, 2.0]})
+    same = _save(tmp_path, "same.xlsx", base.assign(工号=[3, 4]))
+    # 有空值时 int 列会变成 float：类型仍是 number，指纹不变
+    blanks = _save(tmp_path, "blanks.xlsx", base.assign(工号=[None, 5]))
+    reordered = _save(tmp_path, "reordered.xlsx", base[["金额", "工号", "姓名"]])
+    original = compute_schema(_save(tmp_path, "base.xlsx", base))
+
+    assert compute_schema(same) == original
+    assert compute_schema(blanks) == original
+    assert compute_schema(reordered)["column_set_hash"] == original["column_set_hash"]
+    assert compute_schema(reordered)["schema_fingerprint"] != original["schema_fingerprint"]
+
+
+# ================= 数据库查询 (内存 SQLite，见 conftest.py) =================
+
+def _record(db, name, schema, parent_id=None, path=None):
+    fp = fingerprint_schema(schema)
+    record = FileRecord(filename=name, stored_path=path or f"/uploads/{name}", parent_id=parent_id, **fp)
+    db.add(record)
+    db.commit()
+    return record
+
+
+def test_find_same_schema_strict_and_loose(db):
+    cols = [["工号", "number"], ["姓名", "string"]]
+    me = _record(db, "me.xlsx", cols)
+    exact = _record(db, "exact.xlsx", cols)
+    reordered = _record(db, "reordered.xlsx", cols[::-1])
+    _record(db, "other.xlsx", [["部门", "string"]])
+    _record(db, "child.xlsx", cols, parent_id=exact.id)  # 生成的结果文件不算
+
+    assert [r.id for r in find_same_schema(db, me, strict=True)] == [exact.id]
+    assert sorted(r.id for r in find_same_schema(db, me, strict=False)) == sorted([exact.id, reordered.id])
+
+    me.schema_fingerprint = None
+    assert find_same_schema(db, me, strict=True) == []
+
+
+def test_schemas_for_paths_keeps_input_order(db):
+    a = _record(db, "a.xlsx", [["x", "number"]], path="/uploads/a.xlsx")
+    b = _record(db, "b.xlsx", [["y", "number"]], path="/uploads/b.xlsx")
+    result = schemas_for_paths(db, ["/uploads/b.xlsx", "/uploads/missing.xlsx", "/uploads/a.xlsx"])
+    assert result == [
+        {"schema_fingerprint": b.schema_fingerprint, "column_set_hash": b.column_set_hash},
+        None,
+        {"schema_fingerprint": a.schema_fingerprint, "column_set_hash": a.column_set_hash},
+    ]
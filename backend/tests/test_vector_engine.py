@@ -0,0 +1,81 @@
+# backend/tests/test_vector_engine.py
+"""向量化引擎：整列运算失败时必须抛 VectorizeError，公式请求回退到逐行 eval，而不是整体失败"""
+import pandas as pd
+import pytest
+
+import excel_ops
+from formula_service import apply_formula_to_file
+from vector_engine import evaluate_column, VectorizeError
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "数值": [1, 2, 3],
+        "文本列": ["a", "b", "c"],
+        "混合列": [1, "x", 2.5],
+        "s": ["x1", "y22", "z333"],
+        "空文本": pd.Series(["a", None, "c"], dtype=object),
+        "空混合": pd.Series([1, None, "x"], dtype=object),
+    })
+
+
+def _env(df):
+    return {"excel_ops": excel_ops, "df": df, "pd": pd, "rows": [], "row": None}
+
+
+@pytest.mark.parametrize("expr", [
+    "-row['文本列']",
+    "-row['混合列']",
+    "+row['文本列']",
+    "row['s'].zfill('a')",
+    "row['s'].replace('x', 1)",
+    "row['s'][1:'a']",
+    "row['空文本'] + '!'",
+    "'!' + row['空文本']",
+    "row['空混合'] * 2",
+])
+def test_failing_column_ops_raise_vectorize_error(df, expr):
+    with pytest.raises(VectorizeError):
+        evaluate_column(expr, df, _env(df))
+
+
+def test_ifexp_where_failure_raises_vectorize_error(df, monkeypatch):
+    def broken_where(self, *args, **kwargs):
+        raise TypeError("boom")
+    monkeypatch.setattr(pd.Series, "where", broken_where)
+    with pytest.raises(VectorizeError):
+        evaluate_column("row['数值'] if row['数值'] > 1 else 0", df, _env(df))
+
+
+def test_supported_ops_still_vectorize(df):
+    assert evaluate_column("-row['数值']", df, _env(df)).tolist() == [-1, -2, -3]
+    assert evaluate_column("row['s'].zfill(4)", df, _env(df)).tolist() == ["00x1", "0y22", "z333"]
+    assert evaluate_column("row['数值'] if row['数值'] > 1 else 0", df, _env(df)).tolist() == [0, 2, 3]
+
+
+@pytest.mark.parametrize("expr", [
+    "-row['文本列']",
+    "-row['混合列']",
+    "row['s'].zfill('a')",
+    "row['s'].replace('x', 1)",
+])
+def test_formula_falls_back_to_row_eval(tmp_path, df, expr):
+    src = tmp_path / "src.xlsx"
+    df.to_excel(src, index=False)
+    report = {}
+
+    new_path, _ = apply_formula_to_file(str(src), {
+        "action_type": "formula", "mode": "column",
+        "python_expression": expr, "target_position": "结果",
+    }, report)
+
+    assert report["engine"] == "row"
+    out = pd.read_excel(new_path)
+    expected = []
+    for _, row in df.iterrows():
+        try:
+            expected.append(eval(expr, {}, {"row": row}))
+        except Exception as e:
+            expected.append(f"Error: {e}")
+    assert out["结果"].astype(str).tolist() == [str(v) for v in expected]
@@ -0,0 +1,249 @@
+# backend/tests/test_xlsx_stream.py
+"""
+流式读表头 / 样本行必须与 pd.read_excel(nrows=...) 的结果一致 (带格式的空列、中间空行)；
+流式改写 sheet XML 的结果必须与 openpyxl 整本加载后写入的结果一致
+"""
+import os
+import re
+import zipfile
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+from openpyxl.styles import Font, PatternFill
+
+from columnar_store import read_head, read_columns
+from xlsx_stream import read_sheet_head, StreamUnsupported, NS_MAIN
+
+YELLOW = PatternFill("solid", fgColor="FFFF00")
+
+
+def _styled_columns(ws):
+    ws.append(["a", "b"])
+    ws.append([1, 2])
+    ws.append([3, 4])
+    ws["E1"].fill = YELLOW  # 只带格式的空列
+    ws["E2"].fill = YELLOW
+    ws["H30"].font = Font(bold=True)  # <dimension> 被撑到 H30
+
+
+def _blank_rows(ws):
+    ws.append(["a", "b", "c"])
+    ws.append([1, "x", 2.5])
+    # 第 3 行在 XML 里根本不存在
+    ws["A4"] = 3
+    ws["A5"].font = Font(bold=True)  # 只带格式的空行
+    ws["A6"] = 4
+    ws["C6"] = "y"
+    ws["A7"] = 5
+
+
+def _header_gap(ws):
+    ws.append(["a", None, "c"])
+    ws.append([1, None, None])
+    ws.append([None, None, None, None, 9])  # 样本行比表头宽
+    ws["F1"].fill = YELLOW
+
+
+@pytest.fixture(params=[_styled_columns, _blank_rows, _header_gap])
+def workbook(request, tmp_path):
+    wb = openpyxl.Workbook()
+    request.param(wb.active)
+    path = tmp_path / f"{request.param.__name__}.xlsx"
+    wb.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("nrows", [0, 1, 2, 3, 5, 10])
+def test_head_matches_read_excel(workbook, nrows):
+    expected = pd.read_excel(workbook, nrows=nrows)
+    head = read_sheet_head(workbook, nrows)
+
+    assert head["columns"] == expected.columns.tolist()
+    assert head["column_count"] == len(expected.columns)
+    actual = pd.DataFrame(head["rows"], columns=head["columns"])
+    actual = actual.where(actual.notna(), np.nan).infer_objects()
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("nrows", [0, 3, 10])
+def test_columnar_store_head_matches_read_excel(workbook, nrows):
+    expected = pd.read_excel(workbook, nrows=nrows)
+    pd.testing.assert_frame_equal(read_head(workbook, nrows), expected, check_dtype=False)
+    assert read_columns(workbook) == pd.read_excel(workbook, nrows=0).columns.tolist()
+
+
+def test_row_count_still_comes_from_dimension(tmp_path):
+    wb = openpyxl.Workbook()
+    _styled_columns(wb.active)
+    path = tmp_path / "dim.xlsx"
+    wb.save(path)
+    # 行数上限仍取 <dimension> (含只带格式的尾部空行)，列数不受它影响
+    head = read_sheet_head(str(path), 1)
+    assert head["row_count"] == 29
+    assert head["columns"] == ["a", "b"]
+
+
+# ================= 流式写入：结果必须与 openpyxl 整本加载的写法一致 =================
+
+BOLD = Font(bold=True)
+
+
+def _source_workbook(path, gap_row: bool = False):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "数据"
+    ws.append(["姓名", "金额", "备注"])
+    rows = [["张三", 10, "a"], ["李四", 20.5, None], ["王五", 30, "c"]]
+    for i, row in enumerate(rows, start=2):
+        # gap_row：最后一行写到第 5 行，第 4 行在 XML 里根本不存在
+        row_num = i + 1 if gap_row and i == 4 else i
+        for col, value in enumerate(row, start=1):
+            if value is not None:
+                ws.cell(row=row_num, column=col, value=value)
+        ws.cell(row=row_num, column=2).font = BOLD
+    other = wb.create_sheet("其他")
+    other["A1"] = "不要动我"
+    other["B2"] = 3.14
+    wb.save(path)
+    return str(path)
+
+
+def _values(path, sheet="数据"):
+    wb = openpyxl.load_workbook(path)
+    return [list(r) for r in wb[sheet].iter_rows(values_only=True)]
+
+
+def _run_both(monkeypatch, src, ai_result):
+    """同一个请求分别走流式写入和 openpyxl 兜底写入，返回 (流式结果路径, 报告, openpyxl 结果路径)"""
+    import formula_service
+
+    report = {}
+    stream_path, _ = formula_service.apply_formula_to_file(src, ai_result, report)
+
+    def no_stream(*args, **kwargs):
+        raise StreamUnsupported("测试强制走 openpyxl")
+
+    with monkeypatch.context() as m:
+        m.setattr(formula_service, "_write_values_streaming", no_stream)
+        fallback_path, _ = formula_service.apply_formula_to_file(src, ai_result, {})
+    return stream_path, report, fallback_path
+
+
+@pytest.mark.parametrize("target", ["金额", "B", "E", "翻倍"])
+def test_column_write_matches_openpyxl(tmp_path, monkeypatch, target):
+    src = _source_workbook(tmp_path / "src.xlsx")
+    ai_result = {"mode": "column", "python_expression": "row['金额'] * 2", "target_position": target}
+    stream_path, report, fallback_path = _run_both(monkeypatch, src, ai_result)
+
+    assert report["writer"] == "stream"
+    assert _values(stream_path) == _values(fallback_path)
+    # 覆盖原有单元格时保留原样式
+    assert openpyxl.load_workbook(stream_path)["数据"]["B2"].font.bold
+
+
+def test_column_write_fills_rows_missing_from_xml(tmp_path, monkeypatch):
+    src = _source_workbook(tmp_path / "src.xlsx", gap_row=True)
+    with zipfile.ZipFile(src) as zf:
+        assert b'<row r="4"' not in zf.read("xl/worksheets/sheet1.xml")
+
+    ai_result = {"mode": "column", "python_expression": "str(row['姓名']) + '!'", "target_position": "D"}
+    stream_path, report, fallback_path = _run_both(monkeypatch, src, ai_result)
+
+    assert report["writer"] == "stream"
+    assert _values(stream_path) == _values(fallback_path)
+    assert _values(stream_path)[3][3] == "nan!"
+
+
+def test_cell_write_past_max_row_matches_openpyxl(tmp_path, monkeypatch):
+    src = _source_workbook(tmp_path / "src.xlsx")
+    ai_result = {"mode": "cell", "python_expression": "df['金额'].sum()", "target_position": "B10"}
+    stream_path, report, fallback_path = _run_both(monkeypatch, src, ai_result)
+
+    assert report["writer"] == "stream"
+    assert _values(stream_path) == _values(fallback_path)
+    assert _values(stream_path)[9][1] == 60.5
+
+
+def test_date_values_fall_back_to_openpyxl(tmp_path):
+    import formula_service
+
+    wb = openpyxl.Workbook()
+    wb.active.append(["日期"])
+    wb.active.append([pd.Timestamp("2024-01-02").to_pydatetime()])
+    src = tmp_path / "dates.xlsx"
+    wb.save(src)
+
+    report = {}
+    ai_result = {"mode": "column", "python_expression": "row['日期']", "target_position": "复制"}
+    out, _ = formula_service.apply_formula_to_file(str(src), ai_result, report)
+    assert report["writer"] == "openpyxl"
+    assert _values(out, "Sheet")[1] == [pd.Timestamp("2024-01-02").to_pydatetime()] * 2
+
+
+def _rewrite_member(path, name, transform, extra: dict = None):
+    """改写 zip 包里的一个部件 (openpyxl 写不出共享公式 / calcChain，只能手工构造)"""
+    tmp = str(path) + ".tmp"
+    with zipfile.ZipFile(path) as zin, zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            if item.filename == name:
+                data = transform(data)
+            elif extra and item.filename in extra:
+                data = extra[item.filename](data)
+            zout.writestr(item, data)
+        for new_name, data in (extra or {}).get("__new__", {}).items():
+            zout.writestr(new_name, data)
+    os.replace(tmp, path)
+
+
+def test_shared_formula_master_falls_back_to_openpyxl(tmp_path, monkeypatch):
+    src = _source_workbook(tmp_path / "src.xlsx")
+    _rewrite_member(src, "xl/worksheets/sheet1.xml", lambda data: re.sub(
+        rb'<c r="C2"[^>]*(?:/>|>.*?</c>)',
+        b'<c r="C2"><f t="shared" ref="C2:C4" si="0">B2*3</f><v>30</v></c>', data, flags=re.S))
+
+    ai_result = {"mode": "column", "python_expression": "row['金额'] + 1", "target_position": "备注"}
+    stream_path, report, fallback_path = _run_both(monkeypatch, src, ai_result)
+
+    assert report["writer"] == "openpyxl"
+    assert _values(stream_path) == _values(fallback_path)
+    assert [row[2] for row in _values(stream_path)] == ["备注", 11, 21.5, 31]
+
+
+def test_calc_chain_dropped_and_other_parts_untouched(tmp_path):
+    import formula_service
+
+    src = _source_workbook(tmp_path / "src.xlsx")
+    calc_chain = b'<?xml version="1.0" encoding="UTF-8"?><calcChain xmlns="%s"><c r="B2" i="1"/></calcChain>' % NS_MAIN.encode()
+    _rewrite_member(src, "[Content_Types].xml", lambda data: data.replace(
+        b"</Types>",
+        b'<Override PartName="/xl/calcChain.xml" '
+        b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml"/></Types>'),
+        extra={
+            "xl/_rels/workbook.xml.rels": lambda data: data.replace(
+                b"</Relationships>",
+                b'<Relationship Id="rIdCalc" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                b'relationships/calcChain" Target="calcChain.xml"/></Relationships>'),
+            "__new__": {"xl/calcChain.xml": calc_chain},
+        })
+
+    report = {}
+    ai_result = {"mode": "column", "python_expression": "row['金额'] * 2", "target_position": "金额"}
+    out, _ = formula_service.apply_formula_to_file(src, ai_result, report)
+    assert report["writer"] == "stream"
+
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(out) as zout:
+        assert "xl/calcChain.xml" not in zout.namelist()
+        assert b"calcChain" not in zout.read("[Content_Types].xml")
+        assert b"calcChain" not in zout.read("xl/_rels/workbook.xml.rels")
+        # 除了目标工作表和 calcChain 相关的部件，其余 (其他工作表、样式、共享字符串) 逐字节不变
+        changed = {"xl/worksheets/sheet1.xml", "xl/calcChain.xml", "[Content_Types].xml", "xl/_rels/workbook.xml.rels"}
+        for name in zin.namelist():
+            if name not in changed:
+                assert zout.read(name) == zin.read(name), name
+        assert "xl/styles.xml" in zout.namelist() and "xl/worksheets/sheet2.xml" in zout.namelist()
+
+    assert _values(out, "其他") == _values(src, "其他")
+    assert [row[1] for row in _values(out)] == ["金额", 20, 41.0, 60]
@@ -1,8 +1,38 @@
 # backend/update_schema.py
+import sys
+
 from database import engine
 from sqlalchemy import text
 from models import Base
 
+# 🟢 增量字段：(表名, 列名, 类型)
+# ADD COLUMN IF NOT EXISTS 可以重复执行，不会清空已有数据
+NEW_COLUMNS = [
+    ("file_records", "sidecar_path", "VARCHAR"),
+    ("file_records", "content_hash", "VARCHAR"),
+    ("file_records", "result_key", "VARCHAR"),
+    ("file_records", "raw_result", "JSON"),
+    ("file_records", "schema_fingerprint", "VARCHAR"),
+    ("file_records", "column_set_hash", "VARCHAR"),
+    ("file_records", "sheet_names", "JSON"),
+]
+
+# 🟢 增量索引：IF NOT EXISTS 同样可以重复执行
+NEW_INDEXES = [
+    # 历史列表分页 + 取最新子文件 (与 models.FileRecord.__table_args__ 一致)
+    "CREATE INDEX IF NOT EXISTS ix_file_records_parent_upload ON file_records (parent_id, upload_time, id);",
+    # 文件名模糊搜索 (LIKE '%关键字%')：trigram GIN 索引，避免全表扫描
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+    "CREATE INDEX IF NOT EXISTS ix_file_records_filename_trgm ON file_records USING gin (filename gin_trgm_ops);",
+    # 按内容哈希查找已上传过的文件
+    "CREATE INDEX IF NOT EXISTS ix_file_records_content_hash ON file_records (content_hash);",
+    # 结果复用查找 (result_index.find_result)
+    "CREATE INDEX IF NOT EXISTS ix_file_records_result_key ON file_records (result_key);",
+    # 按表结构查找 / 批处理分组 (schema_index)
+    "CREATE INDEX IF NOT EXISTS ix_file_records_schema_fingerprint ON file_records (schema_fingerprint);",
+    "CREATE INDEX IF NOT EXISTS ix_file_records_column_set_hash ON file_records (column_set_hash);",
+]
+
 def update_schema():
     print("🛠️ 正在更新数据库结构...")
 
@@ -25,5 +55,36 @@ def update_schema():
     print("   - file_records 表已重建 (包含 parent_id)")
     print("   - formula_templates 表保持原样 (数据未丢失)")
 
+def add_new_columns():
+    """增量迁移：只补充缺失的列，保留已有数据"""
+    print("🛠️ 正在补充新增字段...")
+
+    # 先建好新表 (已存在的表会被跳过)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.connect() as conn:
+        for table, column, col_type in NEW_COLUMNS:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {col_type};"))
+            print(f"   - {table}.{column} ✅")
+        conn.commit()
+
+    with engine.connect() as conn:
+        for statement in NEW_INDEXES:
+            try:
+                conn.execute(text(statement))
+                conn.commit()
+                print(f"   - {statement.split(' ON ')[0]} ✅")
+            except Exception as e:
+                # 例如没有权限安装 pg_trgm 扩展：跳过，不影响其他索引
+                conn.rollback()
+                print(f"   - ⚠️ 跳过: {statement} ({e})")
+
+    print("✅ 增量字段 / 索引补充完成！")
+
 if __name__ == "__main__":
-    update_schema()
\ No newline at end of file
+    # python update_schema.py          -> 增量补字段 (推荐)
+    # python update_schema.py --rebuild -> 重建 file_records 表 (会清空上传记录)
+    if "--rebuild" in sys.argv:
+        update_schema()
+    else:
+        add_new_columns()
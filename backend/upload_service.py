@@ -0,0 +1,206 @@
+# backend/upload_service.py
+"""
+上传文件的落盘、校验与合并
+
+- 上传内容分块流式写盘 (save_stream)，不会把整个文件读进内存，原始字节原样保存
+- 按 sha256 去重 (store_blob)，同样的内容只存一份、只解析一次
+- 校验只读表头 (read_header)，不做完整解析
+
+save_stream / store_blob 只做文件 IO，通过 executors.run_blocking 在线程池执行；
+其余函数都是模块级函数、参数和返回值都可以 pickle，
+API 接口通过 executors.run_cpu 把它们放进进程池执行，解析大表时不会卡住其他请求。
+"""
+import hashlib
+import os
+from typing import BinaryIO, List, Optional, Tuple
+
+import pandas as pd
+
+from openpyxl import Workbook
+
+from columnar_store import existing_sidecar, read_frame, SidecarWriter
+from schema_index import compute_schema
+from xlsx_stream import read_sheet_head, list_sheets, StreamUnsupported
+
+# ================= 配置区 =================
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1 << 20)))  # 每次读写 1MB
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "100"))  # 单个文件大小上限
+# =========================================
+
+
+class UploadRejected(Exception):
+    """文件内容不符合要求 (空表、列名不一致、超过大小上限等)，接口层转成 400"""
+
+
+def save_stream(filename: str, fileobj: BinaryIO, save_path: str, max_bytes: int = None) -> dict:
+    """
+    把上传的文件流分块写到磁盘，边写边算 sha256，原始字节原样保存
+    - 内存里同一时间只有一个分块
+    - 超过大小上限时删除已写入的部分并抛出 UploadRejected
+    :return: {"file_size": ..., "sha256": ...}
+    """
+    if max_bytes is None:
+        max_bytes = int(UPLOAD_MAX_MB * 1024 * 1024)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(save_path, "wb") as out:
+            while True:
+                chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"文件 {filename} 超过大小上限 {UPLOAD_MAX_MB:g} MB")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        raise
+    return {"file_size": size, "sha256": digest.hexdigest()}
+
+
+def store_blob(staged_path: str, sha256: str, upload_dir: str) -> Tuple[str, bool]:
+    """
+    按内容寻址保存：同样的字节只存一份 (upload_dir/<sha256>.<扩展名>)
+    已经存在时丢弃刚写入的临时文件，原文件 (连同旁路文件) 不动
+    :return: (最终路径, 是否复用了已有文件)
+    """
+    target = os.path.join(upload_dir, f"{sha256}{os.path.splitext(staged_path)[1]}")
+    if os.path.exists(target):
+        os.remove(staged_path)
+        return target, True
+    os.replace(staged_path, target)
+    return target, False
+
+
+def read_header(file_path: str) -> Tuple[list, bool]:
+    """
+    只读表头：返回 (列名列表, 是否有数据行)
+    xlsx 直接流式读开头的 XML (表头 + 第一行数据)，不解析整张表；.xls 或特殊文件回退到 pandas 读一行
+    """
+    try:
+        head = read_sheet_head(file_path, 1)
+        return head["columns"], bool(head["rows"])
+    except StreamUnsupported:
+        df = pd.read_excel(file_path, nrows=1)
+        return list(df.columns), not df.empty
+
+
+def build_sidecar(xlsx_path: str):
+    """解析一次 xlsx 并生成列式旁路文件，之后的读取都不再碰 openpyxl"""
+    sidecar = existing_sidecar(xlsx_path)
+    if sidecar:
+        return sidecar
+    read_frame(xlsx_path)
+    return existing_sidecar(xlsx_path)
+
+
+def schema_of(file_path: str) -> dict:
+    """表结构指纹 (见 schema_index)；算不出来不影响上传，字段留空，批处理时再现读表头"""
+    try:
+        return compute_schema(file_path)
+    except Exception as e:
+        print(f"⚠️ 表结构指纹计算失败: {e}")
+        return {"schema_fingerprint": None, "column_set_hash": None}
+
+
+def sheets_of(file_path: str) -> Optional[list]:
+    """工作表名称列表 (只读 workbook.xml)；读不出来时返回 None，用到时再补"""
+    try:
+        return list_sheets(file_path)
+    except Exception as e:
+        print(f"⚠️ 工作表列表读取失败: {e}")
+        return None
+
+
+def ingest_upload(filename: str, file_path: str) -> dict:
+    """
+    [独立模式] 校验已落盘的上传文件并生成旁路文件 (文件本身不再重写)
+    只处理第一个工作表；其他工作表只记下名称，第一次用到时才解析
+    :return: {"sidecar_path": ..., "sheet_names": ..., "schema_fingerprint": ..., "column_set_hash": ...}
+    """
+    # [通用验证]：空表检查 (只看表头和行数)
+    columns, has_rows = read_header(file_path)
+    if not columns or not has_rows:
+        raise UploadRejected(f"文件 {filename} 是空的，无法处理")
+
+    try:
+        sidecar_path = build_sidecar(file_path)
+    except Exception as e:
+        print(f"⚠️ 上传时预解析失败: {e}")
+        sidecar_path = None
+    # 旁路文件生成之后再算指纹，只读它的第一个数据块
+    return {"sidecar_path": sidecar_path, "sheet_names": sheets_of(file_path), **schema_of(file_path)}
+
+
+def merge_uploads(items: List[Tuple[str, str]], save_path: str) -> dict:
+    """
+    [合并模式] 严格校验列名一致性后合并为一个文件
+    逐个文件读取、按列名对齐后直接追加写出 (write-only 工作簿 + 列式旁路文件)，
+    内存里同一时间只有一个源文件的数据，合并几百个文件也不会撑爆内存。
+    :param items: [(原始文件名, 已落盘的文件路径), ...]
+    :return: {"file_size": ..., "sidecar_path": ..., "total_rows": ..., "sheet_names": ...,
+              "schema_fingerprint": ..., "column_set_hash": ...}
+    """
+    # 1. 先只读表头做校验，有问题的批次不必解析任何数据
+    base_columns = None
+    for filename, path in items:
+        current_columns, has_rows = read_header(path)
+        if not current_columns or not has_rows:
+            raise UploadRejected(f"文件 {filename} 是空的，无法处理")
+
+        if base_columns is None:
+            base_columns = current_columns
+        elif set(base_columns) != set(current_columns):
+            raise UploadRejected(
+                f"【合并失败】文件 '{filename}' 的列名与其他文件不一致。\n预期: {base_columns}\n实际: {current_columns}"
+            )
+
+    # 2. 校验通过后逐个解析、追加写出
+    # 来源文件名只有几种取值，用分类类型存储 (旁路文件里是字典编码)
+    source_dtype = pd.CategoricalDtype(list(dict.fromkeys(name for name, _ in items)))
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    sidecar = SidecarWriter(save_path)
+    output_columns = None
+    total_rows = 0
+
+    try:
+        for filename, path in items:
+            df = pd.read_excel(path)
+            if output_columns is None:
+                output_columns = list(df.columns)
+                ws.append(output_columns + ['_来源文件'])
+            elif set(df.columns) != set(output_columns):
+                raise UploadRejected(
+                    f"【合并失败】文件 '{filename}' 的列名与其他文件不一致。\n预期: {output_columns}\n实际: {list(df.columns)}"
+                )
+
+            # 列顺序不同也没关系，统一按第一个文件的列顺序对齐
+            df = df[output_columns]
+            # 记录来源
+            df['_来源文件'] = pd.Series(filename, index=df.index, dtype=source_dtype)
+            sidecar.write(df)
+
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+                ws.append(row)
+            total_rows += len(df)
+            del df
+
+        wb.save(save_path)
+    except BaseException:
+        sidecar.abort()
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        raise
+
+    return {
+        "file_size": os.path.getsize(save_path),
+        "sidecar_path": sidecar.close(),
+        "total_rows": total_rows,
+        "sheet_names": ["Sheet1"],
+        **schema_of(save_path),
+    }
@@ -0,0 +1,288 @@
+# backend/vector_engine.py
+"""
+公式模式 (mode="column") 的向量化执行引擎
+
+AI 返回的是 `row['单价'] * row['数量']` 这种逐行表达式，原来的做法是
+df.apply(axis=1) 对每一行 eval 一次，几十万行时非常慢。
+
+这里把表达式解析成 AST，整列只求值一次：
+- row['列名']          -> df['列名'] (整列 Series)
+- 四则运算 / 比较 / and / or / not / x if c else y  -> pandas 整列运算
+- 与 row 无关的子表达式 (如 excel_ops.EXCEL_SUM([r['金额'] for r in rows]))
+  只 eval 一次，当作常量参与运算
+- excel_ops.XXX(...) -> 直接传入整列 (excel_ops 的向量化实现)
+- 常用内置函数 -> 按列逐元素调用 (没有逐行 eval 的开销)
+- 字符串切片与 .strip()/.upper() 等方法 -> .str 访问器
+
+任何不支持的写法、或者向量化结果可能与逐行执行不一致的情况 (除零、空值参与字符串运算等)，
+都会抛出 VectorizeError，由调用方回退到逐行 eval。
+"""
+import ast
+import operator
+
+import pandas as pd
+
+
+class VectorizeError(Exception):
+    """表达式无法 (或不应) 向量化执行，调用方应回退到逐行 eval"""
+
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_CMP_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+# 可以逐元素调用的内置函数
+_BUILTINS = {"abs": abs, "round": round, "str": str, "int": int, "float": float, "len": len}
+
+# 字符串方法 -> pandas .str 访问器上的同名方法
+_STR_METHODS = {"strip", "lstrip", "rstrip", "upper", "lower", "replace", "startswith", "endswith", "zfill"}
+
+
+def _uses_row(node) -> bool:
+    """子树里是否引用了当前行变量 row"""
+    return any(isinstance(n, ast.Name) and n.id == "row" for n in ast.walk(node))
+
+
+class _Evaluator:
+    def __init__(self, df: pd.DataFrame, env: dict):
+        self.df = df
+        self.env = env
+
+    # ---------- 工具 ----------
+    def _is_series(self, val):
+        return isinstance(val, pd.Series)
+
+    def _as_bool(self, val):
+        """and / or / not / if 的条件必须是布尔值，否则 Python 语义 (返回操作数本身) 无法整列复现"""
+        if self._is_series(val):
+            if not pd.api.types.is_bool_dtype(val):
+                raise VectorizeError("逻辑运算的操作数不是布尔列")
+            return val
+        if isinstance(val, bool):
+            return val
+        raise VectorizeError("逻辑运算的操作数不是布尔值")
+
+    def _as_str_series(self, val):
+        """.str 访问器只在整列都是非空字符串时才与逐行结果一致"""
+        if not self._is_series(val):
+            raise VectorizeError("字符串操作的对象不是整列")
+        if val.isna().any() or not val.map(lambda x: isinstance(x, str)).all():
+            raise VectorizeError("列中含有空值或非字符串，交给逐行执行")
+        return val.str
+
+    def _broadcast_call(self, func, args):
+        """按行逐元素调用普通 Python 函数 (无逐行 eval / 构造行 Series 的开销)"""
+        if not any(self._is_series(a) for a in args):
+            return func(*args)
+        columns = [a.tolist() if self._is_series(a) else [a] * len(self.df) for a in args]
+        try:
+            values = [func(*vals) for vals in zip(*columns)]
+        except Exception as e:
+            raise VectorizeError(f"{getattr(func, '__name__', func)} 逐元素调用失败: {e}")
+        return pd.Series(values, index=self.df.index)
+
+    # ---------- 求值 ----------
+    def eval(self, node):
+        # 与 row 无关的子表达式：直接 eval 一次当常量
+        if not _uses_row(node):
+            try:
+                code = compile(ast.Expression(body=node), "<expr>", "eval")
+                return eval(code, self.env)
+            except Exception as e:
+                raise VectorizeError(f"常量子表达式求值失败: {e}")
+
+        method = getattr(self, f"_eval_{type(node).__name__}", None)
+        if method is None:
+            raise VectorizeError(f"暂不支持的语法: {type(node).__name__}")
+        return method(node)
+
+    def _eval_Subscript(self, node):
+        key_node = node.slice
+        # Python 3.8 的 AST 里下标包了一层 Index
+        if isinstance(key_node, getattr(ast, "Index", ())):
+            key_node = key_node.value
+
+        # row['列名']
+        if isinstance(node.value, ast.Name) and node.value.id == "row":
+            if not (isinstance(key_node, ast.Constant) and key_node.value in self.df.columns):
+                raise VectorizeError("row[...] 引用的列不存在")
+            return self.df[key_node.value]
+
+        # 字符串切片：str(row['身份证'])[6:10]
+        if isinstance(key_node, ast.Slice):
+            target = self._as_str_series(self.eval(node.value))
+            parts = [self.eval(p) if p is not None else None for p in (key_node.lower, key_node.upper, key_node.step)]
+            if any(self._is_series(p) for p in parts):
+                raise VectorizeError("切片边界不能依赖行数据")
+            try:
+                return target.slice(*parts)
+            except Exception as e:
+                raise VectorizeError(f"整列切片失败: {e}")
+
+        raise VectorizeError("暂不支持的下标写法")
+
+    def _eval_BinOp(self, node):
+        op = _BIN_OPS.get(type(node.op))
+        if op is None:
+            raise VectorizeError(f"暂不支持的运算符: {type(node.op).__name__}")
+        left = self.eval(node.left)
+        right = self.eval(node.right)
+
+        # 逐行执行时除零会抛异常 (结果写成 Error)，整列运算却会得到 inf，必须回退
+        if isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+            zero = (right == 0)
+            if (zero.any() if self._is_series(zero) else bool(zero)):
+                raise VectorizeError("除数中存在 0")
+        # 文本 / 混合列里的空值参与运算：整列运算静默得到 NaN，逐行执行却是 Error 单元格，必须回退
+        for side in (left, right):
+            if self._is_series(side) and not pd.api.types.is_numeric_dtype(side) and side.isna().any():
+                raise VectorizeError("非数值列中存在空值")
+        try:
+            return op(left, right)
+        except Exception as e:
+            raise VectorizeError(f"整列运算失败: {e}")
+
+    def _eval_UnaryOp(self, node):
+        operand = self.eval(node.operand)
+        if isinstance(node.op, ast.Not):
+            val = self._as_bool(operand)
+            return ~val if self._is_series(val) else not val
+        unary = {ast.USub: operator.neg, ast.UAdd: operator.pos}.get(type(node.op))
+        if unary is not None:
+            # 文本列 / 混合列取负会抛 TypeError，逐行执行时对应的是 Error 单元格
+            try:
+                return unary(operand)
+            except Exception as e:
+                raise VectorizeError(f"整列一元运算失败: {e}")
+        raise VectorizeError(f"暂不支持的一元运算: {type(node.op).__name__}")
+
+    def _eval_Compare(self, node):
+        result = None
+        left = self.eval(node.left)
+        for op_node, right_node in zip(node.ops, node.comparators):
+            right = self.eval(right_node)
+            if isinstance(op_node, (ast.In, ast.NotIn)):
+                if not (self._is_series(left) and isinstance(right, (list, tuple, set))):
+                    raise VectorizeError("in 运算只支持 row['列'] in [常量列表]")
+                part = left.isin(right)
+                if isinstance(op_node, ast.NotIn):
+                    part = ~part
+            else:
+                op = _CMP_OPS.get(type(op_node))
+                if op is None:
+                    raise VectorizeError(f"暂不支持的比较: {type(op_node).__name__}")
+                try:
+                    part = op(left, right)
+                except Exception as e:
+                    raise VectorizeError(f"整列比较失败: {e}")
+            result = part if result is None else (result & part)
+            left = right
+        return result
+
+    def _eval_BoolOp(self, node):
+        values = [self._as_bool(self.eval(v)) for v in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        result = values[0]
+        for val in values[1:]:
+            result = combine(result, val)
+        return result
+
+    def _eval_IfExp(self, node):
+        cond = self._as_bool(self.eval(node.test))
+        if not self._is_series(cond):
+            return self.eval(node.body) if cond else self.eval(node.orelse)
+        body = self._broadcast(self.eval(node.body))
+        orelse = self._broadcast(self.eval(node.orelse))
+        # Series.where 会保留混合类型 (object)，不像 np.where 会把数字转成字符串
+        try:
+            return body.where(cond, orelse)
+        except Exception as e:
+            raise VectorizeError(f"条件表达式整列求值失败: {e}")
+
+    def _eval_Call(self, node):
+        if node.keywords:
+            raise VectorizeError("暂不支持关键字参数调用")
+        func_node = node.func
+
+        # 字符串方法：row['姓名'].strip()
+        if isinstance(func_node, ast.Attribute) and func_node.attr in _STR_METHODS and _uses_row(func_node.value):
+            target = self._as_str_series(self.eval(func_node.value))
+            args = [self.eval(a) for a in node.args]
+            if any(self._is_series(a) for a in args):
+                raise VectorizeError("字符串方法的参数不能依赖行数据")
+            try:
+                return getattr(target, func_node.attr)(*args)
+            except Exception as e:
+                raise VectorizeError(f"字符串方法 {func_node.attr} 整列调用失败: {e}")
+
+        # excel_ops.EXCEL_XXX(...)
+        if (isinstance(func_node, ast.Attribute) and isinstance(func_node.value, ast.Name)
+                and func_node.value.id == "excel_ops"):
+            ops = self.env["excel_ops"]
+            func = getattr(ops, func_node.attr, None)
+            args = [self.eval(a) for a in node.args]
+            # 支持整列的函数直接传整列 (单参数的 SUM/AVERAGE 在逐行语义下不是聚合，仍逐元素调用)
+            vectorizable = func_node.attr in getattr(ops, "ELEMENTWISE_FUNCS", ())
+            if func_node.attr in getattr(ops, "AGGREGATE_FUNCS", ()) and len(args) == 1:
+                vectorizable = False
+            if func is not None and vectorizable:
+                try:
+                    return func(*args)
+                except Exception as e:
+                    raise VectorizeError(f"{func_node.attr} 整列计算失败: {e}")
+            if func is None:
+                raise VectorizeError("excel_ops 中没有该函数")
+            return self._broadcast_call(func, args)
+        # 内置函数 round / abs / str ...
+        elif isinstance(func_node, ast.Name) and func_node.id in _BUILTINS:
+            func = _BUILTINS[func_node.id]
+        else:
+            func = None
+
+        if func is None:
+            raise VectorizeError("暂不支持的函数调用")
+        return self._broadcast_call(func, [self.eval(a) for a in node.args])
+
+    def _broadcast(self, val):
+        if self._is_series(val):
+            return val
+        return pd.Series([val] * len(self.df), index=self.df.index, dtype=object)
+
+
+def evaluate_column(py_expr: str, df: pd.DataFrame, env: dict) -> pd.Series:
+    """
+    整列计算 AI 给出的逐行表达式。
+    :param env: 与逐行 eval 相同的执行环境 (excel_ops / df / pd / rows)
+    :return: 与 df 等长的结果 Series
+    :raises VectorizeError: 无法保证与逐行执行结果一致时
+    """
+    try:
+        tree = ast.parse(py_expr.strip(), mode="eval")
+    except SyntaxError as e:
+        raise VectorizeError(f"表达式语法错误: {e}")
+
+    result = _Evaluator(df, env).eval(tree.body)
+
+    if isinstance(result, pd.Series):
+        if len(result) != len(df):
+            raise VectorizeError("结果行数与原表不一致")
+        return result
+    if isinstance(result, (pd.DataFrame, list, tuple, dict, set)):
+        raise VectorizeError("表达式结果不是单值")
+    # 常量结果：每一行都相同
+    return pd.Series([result] * len(df), index=df.index)
@@ -14,4 +14,62 @@ export function generateFormula(data) {
         method: 'post',
         data
     });
-}
\ No newline at end of file
+}
+
+// Chat 流式回答的阶段说明 (与后端 ai_service.stream_ai_analysis 对应)
+export const CHAT_STAGE_TEXT = {
+    codegen: '正在分析数据...',
+    summarize: '正在组织回答...'
+};
+
+/**
+ * 流式咨询 (SSE)：回答边生成边回调
+ * axios 在浏览器里拿不到流式响应体，这里用 fetch 逐块读取
+ * @param {object} data - 与 /api/chat 相同的请求体
+ * @param {object} handlers - { onStage(stage), onDelta(text) }
+ * @returns {Promise<object>} done 事件的内容 { answer, answer_mode, timings }
+ */
+export async function streamChat(data, { onStage, onDelta } = {}) {
+    const response = await fetch(`${request.defaults.baseURL}/api/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+        body: JSON.stringify(data)
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`请求失败 (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let result = null;
+
+    // 每个事件是 "event: xxx\ndata: {...}\n\n"
+    const handleEvent = (block) => {
+        let event = 'message';
+        let payload = '';
+        for (const line of block.split('\n')) {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) payload += line.slice(5).trim();
+        }
+        if (!payload) return;
+        const body = JSON.parse(payload);
+        if (event === 'stage') onStage?.(body.stage);
+        else if (event === 'delta') onDelta?.(body.text);
+        else if (event === 'done') result = body;
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            handleEvent(buffer.slice(0, sep));
+            buffer = buffer.slice(sep + 2);
+        }
+    }
+    if (buffer.trim()) handleEvent(buffer);
+    if (!result) throw new Error('回答中断，请稍后重试');
+    return result;
+}
@@ -9,10 +9,12 @@ export function uploadFile(formData) {
     });
 }
 
-export function getFileData(fileId) {
+// params: { offset, limit, columns, sort_by, sort_order, filter_column, filter_value }
+export function getFileData(fileId, params = {}) {
     return request({
         url: `/api/files/${fileId}/data`,
-        method: 'get'
+        method: 'get',
+        params
     });
 }
 
@@ -0,0 +1,59 @@
+import request from '../utils/request';
+
+// 各阶段的中文说明 (与后端 job_service.STAGES 对应)
+export const JOB_STAGE_TEXT = {
+    queued: '排队中',
+    load: '加载数据',
+    llm: 'AI 分析中',
+    execute: '执行计算',
+    save: '保存结果',
+    preview: '生成预览',
+    done: '已完成'
+};
+
+export function submitJob(kind, data) {
+    return request({
+        url: `/api/jobs/${kind}`,
+        method: 'post',
+        data
+    });
+}
+
+export function getJob(jobId) {
+    return request({
+        url: `/api/jobs/${jobId}`,
+        method: 'get'
+    });
+}
+
+export function cancelJob(jobId) {
+    return request({
+        url: `/api/jobs/${jobId}/cancel`,
+        method: 'post'
+    });
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+/**
+ * 提交任务并轮询直到结束
+ * @param {string} kind - generate_formula / process_multi_files
+ * @param {object} data - 与同步接口相同的请求体
+ * @param {function} onProgress - 每次轮询回调 (job) => {}
+ * @returns 与同步接口相同结构的结果；任务失败/取消时返回 { success: false, msg }
+ */
+export async function runJob(kind, data, onProgress, interval = 1000) {
+    const submitted = await submitJob(kind, data);
+    const jobId = submitted.job_id;
+
+    while (true) {
+        await sleep(interval);
+        const res = await getJob(jobId);
+        const job = res.data;
+        if (onProgress) onProgress(job);
+
+        if (job.status === 'succeeded') return job.result;
+        if (job.status === 'failed') return { success: false, msg: job.error };
+        if (job.status === 'cancelled') return { success: false, msg: '任务已取消' };
+    }
+}
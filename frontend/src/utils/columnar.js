@@ -0,0 +1,31 @@
+// 列式预览数据解码 (对应后端 preview_codec.to_columnar)
+// { names, types, values: [[第 1 列], ...], length } -> [{ 列名: 值 }, ...]
+
+const pad = (n) => String(n).padStart(2, '0');
+
+// 毫秒时间戳 -> 与后端原来 astype(str) 一致的文本：整天只显示日期
+const formatDatetime = (ms) => {
+  const d = new Date(ms);
+  const date = `${d.getUTCFullYear()}-${pad(d.getUTCMonth() + 1)}-${pad(d.getUTCDate())}`;
+  if (ms % 86400000 === 0) return date;
+  return `${date} ${pad(d.getUTCHours())}:${pad(d.getUTCMinutes())}:${pad(d.getUTCSeconds())}`;
+};
+
+export function decodeColumnar(payload) {
+  if (!payload || !payload.names) return [];
+  const { names, types, values } = payload;
+  const length = payload.length ?? (values[0] ? values[0].length : 0);
+  const rows = new Array(length);
+  for (let r = 0; r < length; r++) rows[r] = {};
+
+  names.forEach((name, c) => {
+    const col = values[c];
+    const isDate = types[c] === 'datetime';
+    for (let r = 0; r < length; r++) {
+      const v = col[r];
+      // 空值显示为空字符串，与行式格式保持一致
+      rows[r][name] = v === null || v === undefined ? '' : (isDate ? formatDatetime(v) : v);
+    }
+  });
+  return rows;
+}